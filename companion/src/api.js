@@ -27,9 +27,10 @@ export async function completePairing(pairingCode, name, platform) {
   });
 }
 
-export async function heartbeat() {
+export async function heartbeat(runningCommandIds = []) {
   return request("POST", "/api/device/heartbeat", {
     device_id: getDeviceId(),
+    running_command_ids: runningCommandIds,
   });
 }
 
@@ -8,6 +8,7 @@ import path from "node:path";
 import os from "node:os";
 
 const HEARTBEAT_INTERVAL_MS = 10_000;
+const COMMAND_HEARTBEAT_MS = 30_000;
 const CLAIM_WAIT_S = 20;
 const MIN_BACKOFF_MS = 2_000;
 const MAX_BACKOFF_MS = 30_000;
@@ -161,12 +162,25 @@ export function startWorker() {
     }
   }
 
+  // claim-next long-polls count as heartbeats server-side, so explicit heartbeats
+  // are only sent when no poll is outstanding (e.g. while a command runs).
+  let claimInFlight = false;
+  let lastClaimEndedAt = 0;
+  // Claimed commands are leased; the executing command is re-announced at most every
+  // COMMAND_HEARTBEAT_MS, which renews its lease before the backend reaper releases it.
+  let runningCommandId = null;
+  let lastCommandBeatAt = 0;
+
   async function sendHeartbeat() {
+    if (claimInFlight || Date.now() - lastClaimEndedAt < HEARTBEAT_INTERVAL_MS) return;
+    const commandDue = runningCommandId && Date.now() - lastCommandBeatAt >= COMMAND_HEARTBEAT_MS;
+    const runningIds = commandDue ? [runningCommandId] : [];
     try {
       const token = getDeviceToken();
       const deviceId = loadConfig().deviceId;
       console.log(`[worker] heartbeat auth token=${token ? "present" : "missing"} deviceId=${deviceId ?? "-"}`);
-      await heartbeat();
+      await heartbeat(runningIds);
+      if (commandDue) lastCommandBeatAt = Date.now();
     } catch (err) {
       console.error("[worker] heartbeat failed:", err.message);
     }
@@ -182,11 +196,15 @@ export function startWorker() {
 
     while (true) {
       let cmd = null;
+      claimInFlight = true;
       try {
         const result = await claimNext(CLAIM_WAIT_S);
         cmd = result?.command ?? null;
         backoff = MIN_BACKOFF_MS;
+        lastClaimEndedAt = Date.now();
+        claimInFlight = false;
       } catch (err) {
+        claimInFlight = false;
         console.error("[worker] claim-next failed:", err.message);
         await sleep(backoff);
         backoff = Math.min(backoff * 2, MAX_BACKOFF_MS);
@@ -357,6 +375,8 @@ export function startWorker() {
 
       let seq = 0;
       let flushChain = Promise.resolve();
+      runningCommandId = commandId;
+      lastCommandBeatAt = Date.now();
 
       function enqueueLogs(stream, chunks) {
         flushChain = flushChain.then(async () => {
@@ -375,6 +395,7 @@ export function startWorker() {
 
       // Wait for all in-flight log flushes to complete
       await flushChain;
+      runningCommandId = null;
 
       const status = exitCode === 0 ? "completed" : "failed";
       try {
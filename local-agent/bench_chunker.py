@@ -0,0 +1,67 @@
+"""
+Time log chunking over synthetic build output of increasing size.
+
+  bytes    _chunk_bytes: one pass over the raw pipe bytes (what LogUploader uses)
+  legacy   the previous per-character chunker that re-encoded its buffer on every
+           character; only run up to --legacy-max-mb because it is quadratic per chunk
+
+Usage:
+    python3 local-agent/bench_chunker.py --sizes 1 10 100
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from dispatch_local_agent import _chunk_bytes  # noqa: E402
+
+LINE = "[build] compiling src/módulo_ünicode/файл.rs ✓ 42 warnings\n"
+
+
+def _legacy_chunk_text(s: str, max_bytes: int) -> list[str]:
+    out: list[str] = []
+    buf = ""
+    for ch in s:
+        buf += ch
+        if len(buf.encode("utf-8")) >= max_bytes:
+            out.append(buf)
+            buf = ""
+    if buf:
+        out.append(buf)
+    return out
+
+
+def _payload(mb: int) -> bytes:
+    line = LINE.encode("utf-8")
+    return line * (mb * 1024 * 1024 // len(line) + 1)
+
+
+def _time(fn) -> tuple[float, int]:
+    start = time.perf_counter()
+    n = len(fn())
+    return time.perf_counter() - start, n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="payload sizes in MB")
+    parser.add_argument("--chunk-bytes", type=int, default=4000)
+    parser.add_argument("--legacy-max-mb", type=int, default=1)
+    args = parser.parse_args()
+
+    for mb in args.sizes:
+        data = _payload(mb)
+        elapsed, chunks = _time(lambda: _chunk_bytes(data, args.chunk_bytes))
+        print(f"{mb:4d} MB  bytes   {elapsed:8.3f} s  {len(data) / elapsed / 1e6:8.1f} MB/s  {chunks} chunks")
+        if mb <= args.legacy_max_mb:
+            text = data.decode("utf-8")
+            elapsed, chunks = _time(lambda: _legacy_chunk_text(text, args.chunk_bytes))
+            print(f"{mb:4d} MB  legacy  {elapsed:8.3f} s  {len(data) / elapsed / 1e6:8.1f} MB/s  {chunks} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,122 @@
 from __future__ import annotations
 
 import argparse
+import gzip
+import http.client
 import json
 import os
+import queue
 import subprocess
 import sys
+import threading
 import time
-import urllib.error
-import urllib.request
-from dataclasses import dataclass
+import urllib.parse
+from dataclasses import dataclass, field
 from typing import Any
 
 
+class HttpPool:
+    """
+    Keep-alive HTTP/1.1 connections to the backend, shared by all agent threads.
+
+    Each request checks out an idle connection (or opens one), so concurrent log
+    uploads, heartbeats and claims never share a socket, and the TCP/TLS handshake
+    is paid once per connection rather than once per call. An idempotent request
+    that fails on a reused connection is resent on a fresh one: the server may have
+    closed it while idle. That failure can also come after the server processed the
+    request, so non-idempotent requests (idempotent=False) are never resent, and
+    neither are requests made with retries=0. Other transport errors are retried
+    `retries` times with backoff.
+    """
+
+    def __init__(self, *, max_idle: int = 8, timeout_s: float = 30.0, retries: int = 2) -> None:
+        self.max_idle = max_idle
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+
+    def _checkout(self, key: tuple[str, str, int], timeout_s: float) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.timeout = timeout_s
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout_s)
+                return conn, True
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout_s), False
+
+    def _checkin(self, key: tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for c in conns:
+            c.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+        timeout_s: float | None = None,
+        retries: int | None = None,
+        idempotent: bool = True,
+    ) -> tuple[int, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        key = (scheme, parts.hostname or "localhost", parts.port or (443 if scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        retries = self.retries if retries is None else retries
+        resend_stale = idempotent and retries > 0
+
+        attempt = 0
+        delay = 0.5
+        while True:
+            conn, reused = self._checkout(key, timeout_s)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                stale = isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                if reused and stale and resend_stale:
+                    continue  # stale keep-alive connection; does not count as an attempt
+                if attempt >= retries or not idempotent:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                delay = min(delay * 2, 8.0)
+                continue
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return resp.status, data
+
+
+_http = HttpPool()
+
+# Request bodies at least this large are gzipped when the caller allows it.
+GZIP_MIN_BYTES = 1024
+
+
 def _http_json(
     *,
     method: str,
@@ -19,24 +124,29 @@ def _http_json(
     body: dict[str, Any] | None = None,
     auth_token: str | None = None,
     agent_token: str | None = None,
-    timeout_s: int = 30,
+    timeout_s: float | None = None,
+    retries: int | None = None,
+    compress: bool = False,
+    idempotent: bool = True,
 ) -> dict[str, Any]:
     data = None
-    headers = {"Content-Type": "application/json"}
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
     if auth_token:
         headers["Authorization"] = f"Bearer {auth_token}"
     if agent_token:
         headers["X-Agent-Token"] = agent_token
     if body is not None:
         data = json.dumps(body).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            raw = resp.read().decode("utf-8")
-            return json.loads(raw) if raw else {}
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode("utf-8") if hasattr(e, "read") else ""
-        raise RuntimeError(f"HTTP {e.code} {method} {url}: {raw}") from e
+        if compress and len(data) >= GZIP_MIN_BYTES:
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    status, raw_bytes = _http.request(
+        method, url, body=data, headers=headers, timeout_s=timeout_s, retries=retries, idempotent=idempotent
+    )
+    raw = raw_bytes.decode("utf-8")
+    if status >= 400:
+        raise RuntimeError(f"HTTP {status} {method} {url}: {raw}")
+    return json.loads(raw) if raw else {}
 
 
 @dataclass
@@ -52,23 +162,219 @@ class Config:
     poll_interval_s: float = 1.0
     claim_wait_seconds: int = 20
     log_chunk_bytes: int = 4000
+    # Output is uploaded while the command runs, whenever this much is buffered
+    # or the oldest buffered byte is this old.
+    log_flush_bytes: int = 64 * 1024
+    log_flush_interval_s: float = 0.5
+    # Pipe reads queued for upload; when full, readers block and so does the child.
+    log_queue_max: int = 256
+    log_upload_retries: int = 5
+    # Commands run concurrently, overall and per project (sessions are always serialized).
+    max_concurrent: int = 4
+    max_per_project: int = 2
+    # Backend HTTP: per-request timeout, transport retries (claim-next is never
+    # retried: the server may already have claimed a command for us), idle sockets kept.
+    http_timeout_s: float = 30.0
+    http_retries: int = 2
+    http_pool_size: int = 8
+
+
+def _utf8_tail_start(data: bytes) -> int:
+    """Index where a trailing, incomplete UTF-8 sequence starts (len(data) if none)."""
+    n = len(data)
+    for back in range(1, min(4, n) + 1):
+        b = data[n - back]
+        if b & 0xC0 == 0x80:
+            continue  # continuation byte; keep looking for the lead byte
+        if b >= 0xF0:
+            need = 4
+        elif b >= 0xE0:
+            need = 3
+        elif b >= 0xC0:
+            need = 2
+        else:
+            need = 1
+        return n - back if back < need else n
+    return n
 
 
-def _chunk_text(s: str, max_bytes: int) -> list[str]:
-    if not s:
-        return []
+def _chunk_bytes(data: bytes, max_bytes: int) -> list[str]:
+    """
+    Split raw output into chunks of at most max_bytes, in one pass.
+
+    Cuts after the last newline in the second half of each window when there is one,
+    otherwise at the nearest UTF-8 character boundary, so multi-byte characters are
+    never split. Undecodable bytes are replaced.
+    """
     out: list[str] = []
-    buf = ""
-    for ch in s:
-        buf += ch
-        if len(buf.encode("utf-8")) >= max_bytes:
-            out.append(buf)
-            buf = ""
-    if buf:
-        out.append(buf)
+    n = len(data)
+    start = 0
+    while start < n:
+        end = start + max_bytes
+        if end >= n:
+            out.append(data[start:].decode("utf-8", errors="replace"))
+            break
+        cut = data.rfind(b"\n", start + max_bytes // 2, end) + 1
+        if not cut:
+            cut = end
+            # Back up over at most 3 continuation bytes to the start of the character.
+            while cut > end - 3 and data[cut] & 0xC0 == 0x80:
+                cut -= 1
+            if data[cut] & 0xC0 == 0x80:
+                cut = end  # not valid UTF-8 here anyway
+        out.append(data[start:cut].decode("utf-8", errors="replace"))
+        start = cut
     return out
 
 
+def _command_env() -> dict[str, str]:
+    # Ensure full user PATH is available (nohup can strip it).
+    env = os.environ.copy()
+    home = os.path.expanduser("~")
+    extra_paths = [
+        f"{home}/.local/bin",
+        f"{home}/.cargo/bin",
+        "/usr/local/bin",
+        "/opt/homebrew/bin",
+    ]
+    current_path = env.get("PATH", "")
+    for p in extra_paths:
+        if p not in current_path:
+            current_path = f"{p}:{current_path}"
+    env["PATH"] = current_path
+    return env
+
+
+class LogUploader:
+    """
+    Ships a command's output to append-logs while it runs.
+
+    Pipe readers call write(); a sender thread batches what is queued and posts it
+    once log_flush_bytes are buffered or log_flush_interval_s has passed. Requests
+    go out one at a time in arrival order, and a failed request is retried with the
+    same sequence_start (the backend ignores sequences it already has), so ordering
+    holds across retries.
+    """
+
+    def __init__(self, cfg: Config, command_id: str, sequence_start: int = 0) -> None:
+        self._cfg = cfg
+        self._command_id = command_id
+        self._seq = sequence_start
+        self._queue: queue.Queue = queue.Queue(maxsize=cfg.log_queue_max)
+        # Bytes of a character split across pipe reads, carried into the next flush.
+        self._carry = {"stdout": b"", "stderr": b""}
+        self._thread = threading.Thread(target=self._run, name=f"logs-{command_id}", daemon=True)
+        self._thread.start()
+
+    def write(self, stream: str, data: bytes) -> None:
+        """Queue raw output; blocks when the uploader is behind (backpressure)."""
+        if data:
+            self._queue.put((stream, data))
+
+    def close(self) -> int:
+        """Flush everything written so far and stop. Returns the next sequence number."""
+        self._queue.put(None)
+        self._thread.join()
+        return self._seq
+
+    def _run(self) -> None:
+        pending: list[tuple[str, bytes]] = []
+        pending_bytes = 0
+        first_at: float | None = None
+        done = False
+        while not done:
+            timeout = None
+            if first_at is not None:
+                timeout = max(0.0, first_at + self._cfg.log_flush_interval_s - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if item is None:
+                done = True
+            elif item:
+                pending.append(item)
+                pending_bytes += len(item[1])
+                if first_at is None:
+                    first_at = time.monotonic()
+            due = first_at is not None and time.monotonic() - first_at >= self._cfg.log_flush_interval_s
+            if done or (pending and (due or pending_bytes >= self._cfg.log_flush_bytes)):
+                self._flush(pending, final=done)
+                pending, pending_bytes, first_at = [], 0, None
+
+    def _flush(self, pending: list[tuple[str, bytes]], *, final: bool) -> None:
+        # Consecutive writes to the same stream go out as one request.
+        runs: list[tuple[str, list[bytes]]] = []
+        for name, data in pending:
+            if runs and runs[-1][0] == name:
+                runs[-1][1].append(data)
+            else:
+                runs.append((name, [data]))
+        if final:
+            runs.extend((name, []) for name, tail in self._carry.items() if tail)
+        for name, parts in runs:
+            data = self._carry[name] + b"".join(parts)
+            cut = len(data) if final else _utf8_tail_start(data)
+            data, self._carry[name] = data[:cut], data[cut:]
+            chunks = _chunk_bytes(data, self._cfg.log_chunk_bytes)
+            if chunks:
+                self._post(name, chunks)
+                self._seq += len(chunks)
+
+    def _post(self, stream: str, chunks: list[str]) -> None:
+        body = {"sequence_start": self._seq, "stream": stream, "chunks": chunks}
+        delay = 0.5
+        for attempt in range(self._cfg.log_upload_retries + 1):
+            try:
+                _http_json(
+                    method="POST",
+                    url=f"{self._cfg.backend_url}/api/agent/local/commands/{self._command_id}/append-logs",
+                    body=body,
+                    auth_token=self._cfg.auth_token,
+                    agent_token=self._cfg.agent_token,
+                    retries=0,  # retried below with the same sequence_start
+                    compress=True,
+                )
+                return
+            except Exception as e:
+                if attempt == self._cfg.log_upload_retries:
+                    print(f"[local-agent] append-logs failed, dropping {len(chunks)} chunks: {e}", file=sys.stderr)
+                    return
+                print(f"[local-agent] append-logs failed (retrying): {e}", file=sys.stderr)
+                time.sleep(delay)
+                delay = min(delay * 2, 8.0)
+
+
+def _pump(pipe, stream: str, uploader: LogUploader) -> None:
+    try:
+        for data in iter(lambda: pipe.read1(65536), b""):
+            uploader.write(stream, data)
+    finally:
+        pipe.close()
+
+
+def _run_streaming(command_text: str, cwd: str, uploader: LogUploader) -> int:
+    """Run a shell command, streaming stdout/stderr into `uploader` as they are produced."""
+    proc = subprocess.Popen(
+        command_text,
+        cwd=cwd,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=_command_env(),
+    )
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, "stdout", uploader), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, "stderr", uploader), daemon=True),
+    ]
+    for t in readers:
+        t.start()
+    exit_code = proc.wait()
+    for t in readers:
+        t.join()
+    return int(exit_code or 0)
+
+
 def _is_cd_command(cmd: str) -> bool:
     s = cmd.strip()
     return s == "cd" or s.startswith("cd ")
@@ -95,6 +401,213 @@ def _apply_cd(cmd: str, current_dir: str, project_root: str) -> tuple[bool, str,
     return False, current_dir, f"cd: no such directory: {target}\n"
 
 
+@dataclass
+class AgentState:
+    """Per-daemon state shared by workers. Entries for one session are only touched by
+    that session's (serialized) commands."""
+
+    session_cwd: dict[str, str] = field(default_factory=dict)
+    next_sequence_by_command: dict[str, int] = field(default_factory=dict)
+
+
+def _execute_command(cfg: Config, cmd: dict[str, Any], state: AgentState) -> None:
+    """Run one claimed command end to end: execute, stream logs, report completion."""
+    command_id = cmd.get("id")
+    session_id = cmd.get("session_id")
+    command_text = cmd.get("command") or ""
+
+    # Use project_path from the command if available, then cfg, then home directory.
+    cmd_project_path = cmd.get("project_path") or cfg.project_path or os.path.expanduser("~")
+    if cmd_project_path and os.path.isdir(cmd_project_path):
+        effective_project_path = cmd_project_path
+    else:
+        effective_project_path = cfg.project_path or os.path.expanduser("~")
+        if cmd_project_path and not os.path.isdir(cmd_project_path):
+            os.makedirs(cmd_project_path, exist_ok=True)
+            effective_project_path = cmd_project_path
+
+    print(f"[local-agent] running command_id={command_id} cwd={effective_project_path} cmd={command_text!r}")
+
+    cwd = state.session_cwd.get(session_id) or effective_project_path
+    uploader = LogUploader(cfg, command_id, state.next_sequence_by_command.get(command_id, 0))
+    exit_code = 0
+
+    try:
+        # Make `cd` persistent across commands (Cursor-like terminal semantics).
+        # When there is no fixed project root, use the effective path as the boundary.
+        cd_root = cfg.project_path or effective_project_path
+        if _is_cd_command(command_text):
+            ok, new_cwd, msg = _apply_cd(command_text, cwd, cd_root)
+            if ok:
+                state.session_cwd[session_id] = new_cwd
+                uploader.write("stdout", msg.encode("utf-8"))
+                exit_code = 0
+            else:
+                uploader.write("stderr", msg.encode("utf-8"))
+                exit_code = 1
+        else:
+            exit_code = _run_streaming(command_text, cwd, uploader)
+    except Exception as e:
+        uploader.write("stderr", f"Agent error: {e}".encode("utf-8"))
+        exit_code = -1
+        print(f"[local-agent] execution error command_id={command_id}: {e}", file=sys.stderr)
+
+    # Flush remaining output — always runs, even after errors
+    state.next_sequence_by_command[command_id] = uploader.close()
+
+    # Always report completion — never leave a command stuck as "running"
+    status = "completed" if exit_code == 0 else "failed"
+    try:
+        _http_json(
+            method="POST",
+            url=f"{cfg.backend_url}/api/agent/local/commands/{command_id}/complete",
+            body={"status": status, "exit_code": exit_code},
+            auth_token=cfg.auth_token,
+            agent_token=cfg.agent_token,
+        )
+    except Exception as e:
+        print(f"[local-agent] complete failed: {e}", file=sys.stderr)
+
+    print(f"[local-agent] done command_id={command_id} status={status} exit_code={exit_code}")
+
+
+class CommandPool:
+    """
+    Runs claimed commands on up to cfg.max_concurrent threads.
+
+    Commands of one terminal session run strictly in claim order (so `cd` state and
+    ordering match a real terminal), and at most cfg.max_per_project commands of a
+    project run at once. A claimed command that cannot start yet waits in `_pending`
+    and still counts against capacity, so the daemon never claims more than it can hold.
+    """
+
+    def __init__(self, cfg: Config, state: AgentState | None = None, run=_execute_command) -> None:
+        self._cfg = cfg
+        self._state = state or AgentState()
+        self._run = run
+        self._cond = threading.Condition()
+        self._pending: list[dict[str, Any]] = []
+        self._inflight = 0
+        self._busy_sessions: set[str] = set()
+        self._running_by_project: dict[str, int] = {}
+        self._running_ids: set[str] = set()
+
+    @staticmethod
+    def _project_key(cmd: dict[str, Any]) -> str:
+        return str(cmd.get("project_id") or cmd.get("project_path") or "")
+
+    def wait_for_capacity(self) -> None:
+        with self._cond:
+            while self._inflight >= self._cfg.max_concurrent:
+                self._cond.wait()
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._inflight == 0, timeout)
+
+    def submit(self, cmd: dict[str, Any]) -> None:
+        with self._cond:
+            self._inflight += 1
+            self._pending.append(cmd)
+            self._running_ids.add(cmd["id"])
+            self._start_runnable()
+
+    def running_ids(self) -> list[str]:
+        """Claimed commands not yet finished (server-side they are all 'running')."""
+        with self._cond:
+            return sorted(self._running_ids)
+
+    def _start_runnable(self) -> None:
+        # Caller holds self._cond.
+        still_pending = []
+        for cmd in self._pending:
+            session_id = cmd["session_id"]
+            project = self._project_key(cmd)
+            if session_id in self._busy_sessions or self._running_by_project.get(project, 0) >= self._cfg.max_per_project:
+                still_pending.append(cmd)
+                continue
+            self._busy_sessions.add(session_id)
+            self._running_by_project[project] = self._running_by_project.get(project, 0) + 1
+            threading.Thread(target=self._worker, args=(cmd,), name=f"cmd-{cmd['id']}", daemon=True).start()
+        self._pending = still_pending
+
+    def _worker(self, cmd: dict[str, Any]) -> None:
+        try:
+            self._run(self._cfg, cmd, self._state)
+        except Exception as e:
+            print(f"[local-agent] worker error command_id={cmd.get('id')}: {e}", file=sys.stderr)
+        finally:
+            with self._cond:
+                self._running_ids.discard(cmd["id"])
+                self._busy_sessions.discard(cmd["session_id"])
+                project = self._project_key(cmd)
+                self._running_by_project[project] -= 1
+                if not self._running_by_project[project]:
+                    del self._running_by_project[project]
+                self._inflight -= 1
+                self._start_runnable()
+                self._cond.notify_all()
+
+
+class Presence:
+    """
+    Tracks claim-next long-polls, which the backend counts as heartbeats, so the
+    heartbeat thread only speaks up when the main loop is not polling (e.g. every
+    slot is busy running commands).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._polling = 0
+        self._last_poll_end = 0.0
+
+    def begin_poll(self) -> None:
+        with self._lock:
+            self._polling += 1
+
+    def end_poll(self, *, reached_backend: bool) -> None:
+        with self._lock:
+            self._polling -= 1
+            if reached_backend:
+                self._last_poll_end = time.monotonic()
+
+    def needs_heartbeat(self, interval_s: float) -> bool:
+        with self._lock:
+            return self._polling == 0 and time.monotonic() - self._last_poll_end >= interval_s
+
+
+# Running commands are re-announced this often, renewing their leases; the backend
+# releases a command whose lease (DISPATCH_COMMAND_LEASE_SECONDS, default 120) runs out.
+COMMAND_HEARTBEAT_S = 30.0
+
+
+def _heartbeat_forever(
+    cfg: Config, instance_id: str, stop: threading.Event, presence: Presence, pool: CommandPool
+) -> None:
+    # Runs on its own thread so long commands never delay heartbeats.
+    last_command_beat = 0.0
+    while not stop.is_set():
+        running = pool.running_ids()
+        commands_due = bool(running) and time.monotonic() - last_command_beat >= COMMAND_HEARTBEAT_S
+        if not commands_due and not presence.needs_heartbeat(cfg.heartbeat_interval_s):
+            stop.wait(cfg.heartbeat_interval_s)
+            continue
+        try:
+            _http_json(
+                method="POST",
+                url=f"{cfg.backend_url}/api/agent/local/heartbeat",
+                body={"instance_id": instance_id, "status": "online", "running_command_ids": running},
+                auth_token=cfg.auth_token,
+                agent_token=cfg.agent_token,
+                retries=0,  # the next beat is the retry
+            )
+            if running:
+                last_command_beat = time.monotonic()
+        except Exception as e:
+            print(f"[local-agent] heartbeat failed: {e}", file=sys.stderr)
+        stop.wait(cfg.heartbeat_interval_s)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Dispatch local agent daemon (terminal bridge)")
     parser.add_argument("--backend-url", required=True, help="Backend base URL, e.g. http://localhost:8000")
@@ -108,6 +621,12 @@ def main() -> int:
         default=None,
         help="Stable token for this device/project (defaults to HOSTNAME-project)",
     )
+    parser.add_argument("--max-concurrent", type=int, default=4, help="Commands to run at once (default 4)")
+    parser.add_argument(
+        "--max-per-project", type=int, default=2, help="Commands to run at once per project (default 2)"
+    )
+    parser.add_argument("--http-timeout", type=float, default=30.0, help="Backend request timeout in seconds")
+    parser.add_argument("--http-retries", type=int, default=2, help="Retries for failed backend requests")
     args = parser.parse_args()
 
     project_path = os.path.abspath(args.project_path) if args.project_path else None
@@ -124,7 +643,15 @@ def main() -> int:
         auth_token=args.auth_token,
         agent_token=args.agent_token,
         instance_token=instance_token,
+        max_concurrent=max(1, args.max_concurrent),
+        max_per_project=max(1, args.max_per_project),
+        http_timeout_s=args.http_timeout,
+        http_retries=max(0, args.http_retries),
     )
+    _http.timeout_s = cfg.http_timeout_s
+    _http.retries = cfg.http_retries
+    # Enough idle sockets for every command's log uploader plus heartbeat and claims.
+    _http.max_idle = max(cfg.http_pool_size, cfg.max_concurrent + 2)
 
     print(f"[local-agent] backend={cfg.backend_url} project_id={cfg.project_id} project_path={cfg.project_path}")
 
@@ -163,26 +690,19 @@ def main() -> int:
         print(f"[local-agent] registered project_id={cfg.project_id}")
     print(f"[local-agent] instance_id={instance_id}")
 
-    last_heartbeat = 0.0
-    next_sequence_by_command: dict[str, int] = {}
-    session_cwd: dict[str, str] = {}
+    stop = threading.Event()
+    presence = Presence()
+    pool = CommandPool(cfg)
+    threading.Thread(
+        target=_heartbeat_forever, args=(cfg, instance_id, stop, presence, pool), name="heartbeat", daemon=True
+    ).start()
+    print(f"[local-agent] max_concurrent={cfg.max_concurrent} max_per_project={cfg.max_per_project}")
     idle_polls = 0
 
     while True:
-        now = time.time()
-        if now - last_heartbeat >= cfg.heartbeat_interval_s:
-            try:
-                _http_json(
-                    method="POST",
-                    url=f"{cfg.backend_url}/api/agent/local/heartbeat",
-                    body={"instance_id": instance_id, "status": "online"},
-                    auth_token=cfg.auth_token,
-                    agent_token=cfg.agent_token,
-                )
-            except Exception as e:
-                print(f"[local-agent] heartbeat failed: {e}", file=sys.stderr)
-            last_heartbeat = now
-
+        # Only claim when a slot is free; claimed commands are "running" server-side.
+        pool.wait_for_capacity()
+        presence.begin_poll()
         try:
             claim = _http_json(
                 method="POST",
@@ -190,12 +710,16 @@ def main() -> int:
                 body={"instance_id": instance_id, "wait_seconds": cfg.claim_wait_seconds},
                 auth_token=cfg.auth_token,
                 agent_token=cfg.agent_token,
-                timeout_s=max(30, cfg.claim_wait_seconds + 10),
+                timeout_s=max(cfg.http_timeout_s, cfg.claim_wait_seconds + 10),
+                retries=0,
+                idempotent=False,  # a lost response may still have claimed a command
             )
         except Exception as e:
+            presence.end_poll(reached_backend=False)
             print(f"[local-agent] claim-next failed: {e}", file=sys.stderr)
             time.sleep(2)
             continue
+        presence.end_poll(reached_backend=True)
 
         cmd = claim.get("command") if isinstance(claim, dict) else None
         if not cmd:
@@ -205,112 +729,12 @@ def main() -> int:
             time.sleep(sleep_s)
             continue
 
-        command_id = cmd.get("id")
-        session_id = cmd.get("session_id")
-        command_text = cmd.get("command") or ""
-        if not command_id or not command_text or not session_id:
+        if not cmd.get("id") or not cmd.get("command") or not cmd.get("session_id"):
             time.sleep(cfg.poll_interval_s)
             continue
 
         idle_polls = 0
-
-        # Use project_path from the command if available, then cfg, then home directory.
-        cmd_project_path = cmd.get("project_path") or cfg.project_path or os.path.expanduser("~")
-        if cmd_project_path and os.path.isdir(cmd_project_path):
-            effective_project_path = cmd_project_path
-        else:
-            effective_project_path = cfg.project_path or os.path.expanduser("~")
-            if cmd_project_path and not os.path.isdir(cmd_project_path):
-                os.makedirs(cmd_project_path, exist_ok=True)
-                effective_project_path = cmd_project_path
-
-        print(f"[local-agent] running command_id={command_id} cwd={effective_project_path} cmd={command_text!r}")
-
-        cwd = session_cwd.get(session_id) or effective_project_path
-        stdout = ""
-        stderr = ""
-        exit_code = 0
-
-        try:
-            # Make `cd` persistent across commands (Cursor-like terminal semantics).
-            # When there is no fixed project root, use the effective path as the boundary.
-            cd_root = cfg.project_path or effective_project_path
-            if _is_cd_command(command_text):
-                ok, new_cwd, msg = _apply_cd(command_text, cwd, cd_root)
-                if ok:
-                    session_cwd[session_id] = new_cwd
-                    stdout = msg
-                    exit_code = 0
-                else:
-                    stderr = msg
-                    exit_code = 1
-            else:
-                # Execute command (non-interactive) inside the session cwd.
-                # Ensure full user PATH is available (nohup can strip it).
-                env = os.environ.copy()
-                home = os.path.expanduser("~")
-                extra_paths = [
-                    f"{home}/.local/bin",
-                    f"{home}/.cargo/bin",
-                    "/usr/local/bin",
-                    "/opt/homebrew/bin",
-                ]
-                current_path = env.get("PATH", "")
-                for p in extra_paths:
-                    if p not in current_path:
-                        current_path = f"{p}:{current_path}"
-                env["PATH"] = current_path
-
-                proc = subprocess.Popen(
-                    command_text,
-                    cwd=cwd,
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    env=env,
-                )
-                stdout, stderr = proc.communicate()
-                exit_code = int(proc.returncode or 0)
-        except Exception as e:
-            stderr = f"Agent error: {e}"
-            exit_code = -1
-            print(f"[local-agent] execution error command_id={command_id}: {e}", file=sys.stderr)
-
-        # Stream logs (chunked) — always runs, even after errors
-        seq = next_sequence_by_command.get(command_id, 0)
-        try:
-            for stream_name, text_data in (("stdout", stdout), ("stderr", stderr)):
-                chunks = _chunk_text(text_data, cfg.log_chunk_bytes)
-                if chunks:
-                    _http_json(
-                        method="POST",
-                        url=f"{cfg.backend_url}/api/agent/local/commands/{command_id}/append-logs",
-                        body={"sequence_start": seq, "stream": stream_name, "chunks": chunks},
-                        auth_token=cfg.auth_token,
-                        agent_token=cfg.agent_token,
-                    )
-                    seq += len(chunks)
-        except Exception as e:
-            print(f"[local-agent] append-logs failed: {e}", file=sys.stderr)
-
-        next_sequence_by_command[command_id] = seq
-
-        # Always report completion — never leave a command stuck as "running"
-        status = "completed" if exit_code == 0 else "failed"
-        try:
-            _http_json(
-                method="POST",
-                url=f"{cfg.backend_url}/api/agent/local/commands/{command_id}/complete",
-                body={"status": status, "exit_code": exit_code},
-                auth_token=cfg.auth_token,
-                agent_token=cfg.agent_token,
-            )
-        except Exception as e:
-            print(f"[local-agent] complete failed: {e}", file=sys.stderr)
-
-        print(f"[local-agent] done command_id={command_id} status={status} exit_code={exit_code}")
-
+        pool.submit(cmd)
 
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -3,6 +3,7 @@ Stub copilot agent module.
 TODO: Implement actual Claude Code orchestration logic.
 """
 
+from database import models
 from database.supabase_client import get_sb
 
 
@@ -24,6 +25,7 @@ def set_terminal_access(user_id: str, granted: bool) -> None:
         {"user_id": user_id, "terminal_access": granted},
         on_conflict="user_id",
     ).execute()
+    models.invalidate_user_preferences(user_id)
 
 
 def get_terminal_access(user_id: str) -> bool:
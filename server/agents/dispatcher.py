@@ -16,6 +16,7 @@ import time
 
 from agents.command_builder import build_provider_command, normalize_provider
 from database import models
+from database.unit_of_work import memoized, writes
 
 logger = logging.getLogger("dispatch.dispatcher")
 
@@ -161,12 +162,14 @@ def dispatch_task(task_id: str, intent_data: dict, terminal_granted: bool) -> di
     }
 
 
+@writes("user_preferences")
 def set_terminal_access(user_id: str, granted: bool) -> None:
     """Persist whether a user has granted terminal access."""
     from agents.copilot_agent import set_terminal_access as _set
     _set(user_id, granted)
 
 
+@memoized("user_preferences")
 def get_terminal_access(user_id: str) -> bool:
     """Read whether a user has granted terminal access."""
     from agents.copilot_agent import get_terminal_access as _get
@@ -0,0 +1,83 @@
+# server/database/async_models.py
+"""
+Awaitable access to database.models for async route handlers.
+
+supabase-py does blocking HTTP, so calling models directly from an `async def`
+route stalls the whole event loop (long-polls included) for the duration of each
+PostgREST round trip. Every call made through this module runs on a dedicated,
+bounded thread pool instead:
+
+    from database import async_models as adb
+    project = await adb.get_project(project_id)
+    row = await adb.run(_require_project_owner, user_id, project_id)
+
+Attributes are looked up on database.models at call time, so patching
+`database.models.<name>` in tests keeps working. Pool size comes from
+DISPATCH_DB_MAX_WORKERS (default 32); calls beyond that queue for a worker
+rather than opening more concurrent PostgREST connections.
+
+Inside a request, calls also go through the request's unit of work
+(database/unit_of_work.py), which serves repeated @memoized reads from memory.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from database import models, unit_of_work
+
+T = TypeVar("T")
+
+MAX_WORKERS = max(1, int(os.environ.get("DISPATCH_DB_MAX_WORKERS", "32")))
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="db")
+    return _executor
+
+
+async def _run_in_pool(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+async def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the DB pool, preserving the caller's contextvars."""
+    uow = unit_of_work.current()
+    if uow is None:
+        return await _run_in_pool(fn, *args, **kwargs)
+    return await uow.call(fn, lambda: _run_in_pool(fn, *args, **kwargs), args, kwargs)
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def __getattr__(name: str) -> Callable[..., Any]:
+    if name.startswith("_"):
+        raise AttributeError(name)
+    if not callable(getattr(models, name, None)):
+        raise AttributeError(f"database.models has no function {name!r}")
+
+    async def call(*args: Any, **kwargs: Any) -> Any:
+        return await run(getattr(models, name), *args, **kwargs)
+
+    call.__name__ = name
+    return call
@@ -0,0 +1,101 @@
+# server/database/cache.py
+"""Small in-process caches shared by the auth and data-access layers."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded mapping whose entries expire individually.
+    Least recently used entries are evicted first once `maxsize` is reached.
+    """
+
+    def __init__(self, *, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires <= now:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, *, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.pop(key)
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Drop every entry for which predicate(key, value) is true. Returns the number dropped."""
+        with self._lock:
+            doomed = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in doomed:
+                del self._data[k]
+        return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class SizedTTLCache(TTLCache):
+    """
+    TTLCache that also bounds the total size (e.g. bytes) of its values: least
+    recently used entries are evicted once the sizes add up to more than `maxbytes`.
+    A value bigger than `maxbytes` on its own is not kept.
+    """
+
+    def __init__(self, *, maxsize: int = 1024, ttl: float = 60.0, maxbytes: int) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.maxbytes = maxbytes
+        self._sizes: dict[Hashable, int] = {}
+
+    def set(self, key: Hashable, value: Any, *, size: int, ttl: float | None = None) -> None:
+        if size > self.maxbytes:
+            self.pop(key)
+            return
+        super().set(key, value, ttl=ttl)
+        with self._lock:
+            # Entries dropped by get(), pop() or maxsize since the last set() give their bytes back here.
+            self._sizes = {k: s for k, s in self._sizes.items() if k in self._data}
+            if key in self._data:
+                self._sizes[key] = size
+            total = sum(self._sizes.values())
+            while total > self.maxbytes:
+                evicted, _ = self._data.popitem(last=False)
+                total -= self._sizes.pop(evicted, 0)
+
+    def size(self) -> int:
+        """Total size of the entries held."""
+        with self._lock:
+            return sum(s for k, s in self._sizes.items() if k in self._data)
@@ -0,0 +1,120 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/database/change_counter.py
+"""
+Version tokens for polled read endpoints (ETag / If-None-Match).
+
+Writers in database.models call bump(scope, user_id) after changing data a
+dashboard view renders; a read endpoint builds its ETag from the counters of
+the scopes it reads, for that user, before touching the database. A matching
+If-None-Match therefore proves nothing the view depends on has changed, and the
+endpoint answers 304 without a PostgREST round trip.
+
+Scopes: "commands" (terminal_commands + sidecar risk), "sessions",
+"conversation", "executions" (agent_executions + tasks) and "projects".
+A write that does not know its user bumps the scope for everyone.
+
+Counters live in this process. Tokens carry a per-process epoch, so a token
+minted by another worker (or before a restart) never matches; bumps are also
+published through database.command_events, so with the postgres backend every
+worker sees every write. Tokens additionally roll over every
+DISPATCH_ETAG_MAX_AGE_S seconds (default 60), which bounds staleness from
+writes that bypass models (SQL, a lost notification).
+"""
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+from database import command_events as _events
+
+SCOPES = ("commands", "sessions", "conversation", "executions", "projects")
+MAX_AGE_S = max(1.0, float(os.environ.get("DISPATCH_ETAG_MAX_AGE_S", "60")))
+
+_KEY_PREFIX = "changed:"
+_ALL_USERS = "*"
+
+_epoch = secrets.token_hex(4)
+_lock = threading.Lock()
+# (scope, user_id or "*") -> counter
+_counters: dict[tuple[str, str], int] = {}
+_observing = False
+
+
+def _apply(scope: str, user_id: str) -> None:
+    with _lock:
+        _counters[(scope, user_id)] = _counters.get((scope, user_id), 0) + 1
+
+
+def _on_keys(keys: list) -> None:
+    for key in keys:
+        if isinstance(key, str) and key.startswith(_KEY_PREFIX):
+            scope, _, user_id = key[len(_KEY_PREFIX):].partition(":")
+            _apply(scope, user_id or _ALL_USERS)
+
+
+def _ensure_observing() -> None:
+    global _observing
+    if not _observing:
+        with _lock:
+            if _observing:
+                return
+            _observing = True
+        _events.get_hub().observe(_on_keys)
+
+
+def bump(*scopes: str, user_id: str | None = None) -> None:
+    """Record a write to `scopes` for `user_id` (or for every user when None). Never raises."""
+    uid = user_id or _ALL_USERS
+    for scope in scopes:
+        # Applied locally right away so this worker's next read sees its own write.
+        _apply(scope, uid)
+    try:
+        _ensure_observing()
+        _events.get_hub().publish([f"{_KEY_PREFIX}{scope}:{uid}" for scope in scopes])
+    except Exception:
+        pass
+
+
+def bump_rows(*scopes: str, rows) -> None:
+    """bump() for each user_id in PostgREST result rows; for everyone if none is known."""
+    user_ids = {r.get("user_id") for r in rows if isinstance(r, dict)} if isinstance(rows, list) else set()
+    user_ids.discard(None)
+    if not user_ids:
+        bump(*scopes)
+    for uid in user_ids:
+        bump(*scopes, user_id=uid)
+
+
+def etag(user_id: str, scopes: tuple[str, ...], *parts: object) -> str:
+    """Weak ETag for a view of `scopes` for `user_id`; `parts` are its query parameters."""
+    _ensure_observing()
+    with _lock:
+        counts = [(_counters.get((s, user_id), 0), _counters.get((s, _ALL_USERS), 0)) for s in scopes]
+    bucket = int(time.time() // MAX_AGE_S)
+    raw = repr((user_id, scopes, counts, bucket, parts)).encode("utf-8")
+    return f'W/"{_epoch}-{hashlib.sha1(raw).hexdigest()[:20]}"'
+
+
+def matches(if_none_match: str | None, tag: str) -> bool:
+    """RFC 9110 weak comparison of an If-None-Match header against `tag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def reset() -> None:
+    """Forget all counters (tests)."""
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,259 @@
+# server/database/command_events.py
+"""
+Wake-up notifications for parked claim-next long-polls.
+
+Writers publish string keys (``user:<id>``, ``device:<id>``, ``instance:<id>``)
+whenever a terminal command becomes claimable; long-polls subscribe to the keys
+that concern them and only hit the database when woken (or on a slow safety
+re-poll). Delivery is best-effort: a lost wake-up only delays a claim until the
+next re-poll, it never loses a command.
+
+Backends:
+  - local    (default) in-process only; correct for a single worker.
+  - postgres LISTEN/NOTIFY so every worker sees every publish.
+             Set DISPATCH_EVENTS_BACKEND=postgres and DISPATCH_EVENTS_DSN
+             (falls back to SUPABASE_DB_URL / DATABASE_URL).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Callable, Iterable
+
+logger = logging.getLogger("callstack.events")
+
+Deliver = Callable[[list], None]
+
+
+def user_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def device_key(device_id: str) -> str:
+    return f"device:{device_id}"
+
+
+def instance_key(instance_id: str) -> str:
+    return f"instance:{instance_id}"
+
+
+class LocalBackend:
+    """Delivers publishes straight back to the hub of this process."""
+
+    def __init__(self) -> None:
+        self._deliver: Deliver | None = None
+
+    def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    def publish(self, keys: list) -> None:
+        if self._deliver is not None:
+            self._deliver(keys)
+
+    def close(self) -> None:
+        self._deliver = None
+
+
+class PostgresBackend:
+    """Fans publishes out to every worker through Postgres LISTEN/NOTIFY."""
+
+    channel = "dispatch_command_events"
+
+    def __init__(self, dsn: str) -> None:
+        self._dsn = dsn
+        self._deliver: Deliver | None = None
+        self._stop = threading.Event()
+        self._publish_lock = threading.Lock()
+        self._publish_conn = None
+        self._thread: threading.Thread | None = None
+
+    def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        self._thread = threading.Thread(target=self._listen_forever, name="command-events-listen", daemon=True)
+        self._thread.start()
+
+    def _listen_forever(self) -> None:
+        import psycopg
+
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self._dsn, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {self.channel}")
+                    backoff = 1.0
+                    while not self._stop.is_set():
+                        for note in conn.notifies(timeout=5.0):
+                            try:
+                                keys = json.loads(note.payload)
+                            except ValueError:
+                                continue
+                            if self._deliver is not None and isinstance(keys, list):
+                                self._deliver(keys)
+            except Exception as e:
+                logger.warning("command events listener error err=%r; reconnecting in %.0fs", e, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def publish(self, keys: list) -> None:
+        import psycopg
+
+        payload = json.dumps(keys)
+        with self._publish_lock:
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = psycopg.connect(self._dsn, autocommit=True)
+                self._publish_conn.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+            except Exception:
+                self._publish_conn = None
+                raise
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._publish_lock:
+            if self._publish_conn is not None:
+                try:
+                    self._publish_conn.close()
+                except Exception:
+                    pass
+                self._publish_conn = None
+
+
+class Subscription:
+    """A set of keys a single coroutine is parked on. Create inside the event loop."""
+
+    def __init__(self, hub: "CommandEventHub", keys: list) -> None:
+        self._hub = hub
+        self.keys = keys
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def _wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Loop already closed; the subscriber is gone.
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a publish on any subscribed key. Returns False on timeout."""
+        if timeout <= 0:
+            return False
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+    def close(self) -> None:
+        self._hub._unregister(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CommandEventHub:
+    def __init__(self, backend=None) -> None:
+        self._lock = threading.Lock()
+        self._subs: dict[str, set] = {}
+        self._observers: list[Deliver] = []
+        self._backend = backend or LocalBackend()
+        self._backend.start(self._deliver)
+
+    def subscribe(self, keys: Iterable[str]) -> Subscription:
+        sub = Subscription(self, [k for k in keys if k])
+        with self._lock:
+            for k in sub.keys:
+                self._subs.setdefault(k, set()).add(sub)
+        return sub
+
+    def _unregister(self, sub: Subscription) -> None:
+        with self._lock:
+            for k in sub.keys:
+                bucket = self._subs.get(k)
+                if bucket is None:
+                    continue
+                bucket.discard(sub)
+                if not bucket:
+                    del self._subs[k]
+
+    def observe(self, fn: Deliver) -> None:
+        """Call `fn(keys)` for every delivered publish, e.g. to keep per-worker state in sync."""
+        with self._lock:
+            self._observers.append(fn)
+
+    def _deliver(self, keys: list) -> None:
+        with self._lock:
+            targets = set()
+            for k in keys:
+                targets.update(self._subs.get(k, ()))
+            observers = list(self._observers)
+        for sub in targets:
+            sub._wake()
+        for fn in observers:
+            try:
+                fn(keys)
+            except Exception as e:
+                logger.warning("command events observer failed err=%r", e)
+
+    def publish(self, keys: Iterable[str]) -> None:
+        """Wake every subscriber (in any worker) parked on one of `keys`. Never raises."""
+        key_list = [k for k in keys if k]
+        if not key_list:
+            return
+        try:
+            self._backend.publish(key_list)
+        except Exception as e:
+            logger.warning("command events publish failed, delivering locally only err=%r", e)
+            self._deliver(key_list)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._subs.values())
+
+    def close(self) -> None:
+        self._backend.close()
+
+
+_hub: CommandEventHub | None = None
+_hub_lock = threading.Lock()
+
+
+def _backend_from_env():
+    kind = os.environ.get("DISPATCH_EVENTS_BACKEND", "local").strip().lower()
+    if kind == "postgres":
+        dsn = (
+            os.environ.get("DISPATCH_EVENTS_DSN")
+            or os.environ.get("SUPABASE_DB_URL")
+            or os.environ.get("DATABASE_URL")
+        )
+        if dsn:
+            return PostgresBackend(dsn)
+        logger.warning("DISPATCH_EVENTS_BACKEND=postgres but no DSN set; using local backend")
+    return LocalBackend()
+
+
+def get_hub() -> CommandEventHub:
+    """Return the process-wide hub, creating it (and its backend) on first use."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = CommandEventHub(_backend_from_env())
+    return _hub
+
+
+def notify_command_queued(*, user_id: str | None, instance_id: str | None = None, device_ids: Iterable[str] = ()) -> None:
+    keys = []
+    if user_id:
+        keys.append(user_key(user_id))
+    if instance_id:
+        keys.append(instance_key(instance_id))
+    keys.extend(device_key(d) for d in device_ids if d)
+    get_hub().publish(keys)
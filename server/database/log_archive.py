@@ -0,0 +1,71 @@
+# server/database/log_archive.py
+"""
+Compacted layout for a finished command's terminal output.
+
+terminal_logs holds one row per chunk (at most 4000 bytes each). Once a command
+has been finished for a while, database.models.compact_terminal_logs() replaces
+those rows with one terminal_log_archives row per stream:
+
+  data       the stream's chunks, UTF-8 encoded and concatenated in sequence
+             order, gzip-compressed, base64-encoded (PostgREST speaks JSON)
+  sequences  [[sequence, byte_length], ...] in the same order, so the original
+             rows can be rebuilt exactly and interleaved with the other stream
+
+gzip rather than zstd: it is in the standard library on every Python we support,
+and terminal output compresses well with either.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+
+ENCODING = "gzip"
+
+
+def pack(command_id: str, rows: list[dict]) -> list[dict]:
+    """terminal_log_archives rows (one per stream) for a command's terminal_logs rows."""
+    by_stream: dict[str, list[dict]] = {}
+    for row in sorted(rows, key=lambda r: r["sequence"]):
+        by_stream.setdefault(row.get("stream") or "stdout", []).append(row)
+    archives = []
+    for stream, chunks in by_stream.items():
+        parts = [(r.get("chunk") or "").encode("utf-8") for r in chunks]
+        raw = b"".join(parts)
+        archives.append({
+            "command_id": command_id,
+            "stream": stream,
+            "encoding": ENCODING,
+            "data": base64.b64encode(gzip.compress(raw)).decode("ascii"),
+            "sequences": [[r["sequence"], len(p)] for r, p in zip(chunks, parts)],
+            "chunk_count": len(parts),
+            "raw_bytes": len(raw),
+        })
+    return archives
+
+
+def unpack(archives: list[dict]) -> list[dict]:
+    """terminal_logs-shaped rows (with byte_offset), ordered by sequence, from a command's archive rows."""
+    rows = []
+    for archive in archives:
+        encoding = archive.get("encoding") or ENCODING
+        if encoding != ENCODING:
+            raise ValueError(f"unsupported terminal log archive encoding: {encoding}")
+        raw = gzip.decompress(base64.b64decode(archive["data"]))
+        offset = 0
+        for sequence, length in archive.get("sequences") or []:
+            rows.append({
+                "id": f"{archive['command_id']}:{sequence}",
+                "command_id": archive["command_id"],
+                "sequence": sequence,
+                "stream": archive["stream"],
+                "chunk": raw[offset:offset + length].decode("utf-8"),
+                "created_at": archive.get("created_at"),
+            })
+            offset += length
+    rows.sort(key=lambda r: r["sequence"])
+    # byte_offset is over the whole output (both streams, in sequence order), as in terminal_logs.
+    total = 0
+    for row in rows:
+        row["byte_offset"] = total
+        total += len(row["chunk"].encode("utf-8"))
+    return rows
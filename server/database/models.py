@@ -4,6 +4,15 @@ from __future__ import annotations
 """Database operations via Supabase PostgREST client."""
 from database.supabase_client import get_sb
 from database import sidecar_store as _sidecar
+from database import command_events as _events
+from database import change_counter as _changes
+from database.cache import SizedTTLCache, TTLCache
+from database import pagination
+from database import log_archive
+from database.unit_of_work import memoized, writes
+from database.touch_buffer import TouchBuffer
+from postgrest.types import CountMethod, ReturnMethod
+import bisect
 import uuid
 import json
 from datetime import datetime, timezone, timedelta
@@ -12,6 +21,9 @@ import secrets
 import logging
 import os
 import re
+import threading
+import time
+from typing import NamedTuple
 
 logger = logging.getLogger("callstack.db")
 
@@ -52,28 +64,97 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+# Buffered last_used_at / last_heartbeat writes; see flush_pending_touches().
+_touches = TouchBuffer()
+_TOUCH_FLUSH_CHUNK = 200
+
+
+def _touch_at() -> str:
+    # Whole seconds, so rows touched in the same second share one UPDATE.
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+
+# RPCs that PostgREST reported as missing (migration not applied yet), with the time
+# we noticed. Re-probed after _MISSING_RPC_RETRY_S so a later migration is picked up.
+_missing_rpcs: dict[str, float] = {}
+_MISSING_RPC_RETRY_S = 300.0
+_RPC_UNAVAILABLE = object()
+
+
+def _is_missing_function_error(exc: Exception) -> bool:
+    msg = str(exc)
+    return "PGRST202" in msg or "42883" in msg or "Could not find the function" in msg
+
+
+def _call_rpc_rows(fn: str, params: dict, *, strict: bool = False):
+    """
+    Call a Postgres function via PostgREST. Returns its rows, or _RPC_UNAVAILABLE on failure.
+
+    With strict=True only a missing function yields _RPC_UNAVAILABLE; any other error
+    is re-raised, for calls whose fallback must not run if the RPC may have committed
+    (a timeout after a claim already moved a command to running).
+    """
+    noticed = _missing_rpcs.get(fn)
+    if noticed is not None and time.monotonic() - noticed < _MISSING_RPC_RETRY_S:
+        return _RPC_UNAVAILABLE
+    sb = get_sb()
+    try:
+        res = sb.rpc(fn, params).execute()
+    except Exception as e:
+        if _is_missing_function_error(e):
+            _missing_rpcs[fn] = time.monotonic()
+            logger.warning("rpc %s not deployed; using multi-step fallback", fn)
+        elif strict:
+            raise
+        else:
+            logger.warning("rpc %s failed err=%r; using multi-step fallback", fn, e)
+        return _RPC_UNAVAILABLE
+    _missing_rpcs.pop(fn, None)
+    data = getattr(res, "data", None)
+    if data is None:
+        return []
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return data
+    return _RPC_UNAVAILABLE
+
+
 # ==================== USERS ====================
 
+# user_id -> (email, phone_number, telegram_chat_id) this worker last wrote or saw written.
+# upsert_user is called on every /transcribe, /transcribe-text and telegram message.
+_known_users = TTLCache(maxsize=16384, ttl=600.0)
+
+
+@writes("users")
 def upsert_user(user_id: str, email: str, phone_number: str | None = None, telegram_chat_id: str | None = None):
-    sb = get_sb()
-    # Check if user already exists — if so, just update.
-    existing = _execute_single(sb.table("users").select("id").eq("id", user_id))
-    if existing:
-        update = {"email": email}
-        if phone_number:
-            update["phone_number"] = phone_number
-        if telegram_chat_id:
-            update["telegram_chat_id"] = str(telegram_chat_id)
-        sb.table("users").update(update).eq("id", user_id).execute()
-    else:
-        data = {"id": user_id, "email": email}
-        if phone_number:
-            data["phone_number"] = phone_number
-        if telegram_chat_id:
-            data["telegram_chat_id"] = str(telegram_chat_id)
-        sb.table("users").insert(data).execute()
+    telegram_chat_id = str(telegram_chat_id) if telegram_chat_id else None
+    known = _known_users.get(user_id)
+    if known is not None:
+        known_email, known_phone, known_telegram = known
+        if (
+            known_email == email
+            and (not phone_number or known_phone == phone_number)
+            and (not telegram_chat_id or known_telegram == telegram_chat_id)
+        ):
+            return
+    # One round trip: insert, or update the given columns if the row exists.
+    # Columns left out (phone/telegram when not provided) keep their stored values.
+    data = {"id": user_id, "email": email}
+    if phone_number:
+        data["phone_number"] = phone_number
+    if telegram_chat_id:
+        data["telegram_chat_id"] = telegram_chat_id
+    sb = get_sb()
+    sb.table("users").upsert(data, on_conflict="id").execute()
+    if known is not None:
+        phone_number = phone_number or known[1]
+        telegram_chat_id = telegram_chat_id or known[2]
+    _known_users.set(user_id, (email, phone_number, telegram_chat_id))
     logger.debug("upsert_user user_id=%s email=%r phone=%r telegram=%r", user_id, email, phone_number, telegram_chat_id)
 
+@memoized("users")
 def get_user_id_by_telegram_chat_id(chat_id: str | int) -> str | None:
     """Look up a user by their telegram chat_id."""
     sb = get_sb()
@@ -90,6 +171,7 @@ def update_user_phone_number(user_id: str, phone_number: str) -> None:
     sb = get_sb()
     try:
         sb.table("users").update({"phone_number": phone_number}).eq("id", user_id).execute()
+        _known_users.pop(user_id)
         logger.debug("update_user_phone_number user_id=%s phone=%r", user_id, phone_number)
     except Exception as e:
         err_str = str(e).lower()
@@ -110,6 +192,7 @@ def get_user_phone_number(user_id: str) -> str | None:
 
 # ==================== PROJECTS ====================
 
+@writes("projects")
 def create_project(user_id, name, file_path=None):
     sb = get_sb()
     project_id = str(uuid.uuid4())
@@ -127,77 +210,124 @@ def create_project(user_id, name, file_path=None):
     if file_path:
         link_device_project_local_path_if_missing_for_user_devices(user_id=user_id, project_id=project_id, local_path=file_path)
 
+    _changes.bump("projects", user_id=user_id)
     logger.debug("create_project id=%s user_id=%s name=%r", project_id, user_id, name)
     return project_id
 
 
+@writes("projects")
 def touch_project(project_id: str):
     sb = get_sb()
     sb.table("projects").update({"last_accessed": _now_iso()}).eq("id", project_id).execute()
     logger.debug("touch_project project_id=%s", project_id)
 
 
-def delete_project(project_id: str):
-    """Delete a project and its related data (tasks, sessions, commands, logs)."""
+# Ids per in.() filter in the delete_project fallback: bounds both the request URL
+# and the rows one statement deletes. Logs are many per command, so batch smaller.
+_DELETE_BATCH = 200
+_DELETE_LOGS_BATCH = 50
+
+
+def _delete_rows(table: str, column: str, ids: list, counts: dict, *, batch: int = _DELETE_BATCH) -> None:
+    """DELETE FROM table WHERE column IN ids, `batch` ids per statement; adds the row count to counts[table]."""
     sb = get_sb()
-    # Delete in dependency order.
-    # Terminal logs → commands → sessions
+    for i in range(0, len(ids), batch):
+        res = (
+            sb.table(table)
+            .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+            .in_(column, ids[i:i + batch])
+            .execute()
+        )
+        n = getattr(res, "count", None)
+        counts[table] = counts.get(table, 0) + (n if isinstance(n, int) else 0)
+        logger.info("delete_project %s deleted=%s/%s ids", table, min(i + batch, len(ids)), len(ids))
+
+
+def _select_ids(table: str, column: str, values: list) -> list:
+    sb = get_sb()
+    ids: list = []
+    for i in range(0, len(values), _DELETE_BATCH):
+        res = sb.table(table).select("id").in_(column, values[i:i + _DELETE_BATCH]).execute()
+        ids.extend(r["id"] for r in (res.data or []))
+    return ids
+
+
+def _delete_project_fallback(project_id: str) -> dict:
+    sb = get_sb()
+    counts: dict = {}
+    # Delete in dependency order: logs -> commands -> sessions, executions -> tasks,
+    # and the project row last so a failed run can simply be retried.
     sessions_res = sb.table("terminal_sessions").select("id").eq("project_id", project_id).execute()
     session_ids = [s["id"] for s in (sessions_res.data or [])]
-    # Conversation turns + state (must precede terminal_commands due to FK on command_id)
+    cmd_ids = _select_ids("terminal_commands", "session_id", session_ids)
+    # Legacy Supabase conversation tables (must precede terminal_commands due to FK on command_id).
     try:
         sb.table("conversation_turns").delete().eq("project_id", project_id).execute()
-    except Exception:
-        pass
-    try:
         sb.table("conversation_state").delete().eq("project_id", project_id).execute()
+        _delete_rows("conversation_turns", "command_id", cmd_ids, {})
     except Exception:
         pass
-    if session_ids:
-        cmds_res = sb.table("terminal_commands").select("id").in_("session_id", session_ids).execute()
-        cmd_ids = [c["id"] for c in (cmds_res.data or [])]
-        if cmd_ids:
-            # Also clean up any conversation_turns referencing these commands
-            try:
-                sb.table("conversation_turns").delete().in_("command_id", cmd_ids).execute()
-            except Exception:
-                pass
-            sb.table("terminal_logs").delete().in_("command_id", cmd_ids).execute()
-            sb.table("terminal_commands").delete().in_("id", cmd_ids).execute()
-        sb.table("terminal_sessions").delete().in_("id", session_ids).execute()
-    # Tasks + agent executions
+    _delete_rows("terminal_logs", "command_id", cmd_ids, counts, batch=_DELETE_LOGS_BATCH)
     tasks_res = sb.table("tasks").select("id").eq("project_id", project_id).execute()
     task_ids = [t["id"] for t in (tasks_res.data or [])]
-    if task_ids:
-        sb.table("agent_executions").delete().in_("task_id", task_ids).execute()
-    sb.table("tasks").delete().eq("project_id", project_id).execute()
-    # Instances (local agent registrations)
+    _delete_rows("agent_executions", "task_id", task_ids, counts)
+    _delete_rows("tasks", "id", task_ids, counts)
+    for i in range(0, len(cmd_ids), _DELETE_BATCH):
+        sb.table("agent_executions").update({"terminal_command_id": None}).in_(
+            "terminal_command_id", cmd_ids[i:i + _DELETE_BATCH]
+        ).execute()
+    _delete_rows("terminal_commands", "id", cmd_ids, counts)
+    _delete_rows("terminal_sessions", "id", session_ids, counts)
+    # Instances (local agent registrations), device links, cursor context
     sb.table("instances").delete().eq("project_id", project_id).execute()
-    # Device project links
     sb.table("device_project_links").delete().eq("project_id", project_id).execute()
-    # Cursor context
     sb.table("cursor_context_snapshots").delete().eq("project_id", project_id).execute()
     # Project itself
     sb.table("projects").delete().eq("id", project_id).execute()
-    logger.debug("delete_project project_id=%s", project_id)
+    counts["command_ids"] = cmd_ids
+    return counts
+
+
+def delete_project(project_id: str) -> dict:
+    """
+    Delete a project and its related data (tasks, sessions, commands, logs), plus
+    the sidecar turns, dialogue state and risk rows of its commands.
 
+    One transaction via the delete_project_cascade RPC; without it, batched
+    deletes of at most _DELETE_BATCH ids each. Returns per-table row counts.
+    """
+    rows = _call_rpc_rows("delete_project_cascade", {"p_project_id": project_id})
+    if rows is _RPC_UNAVAILABLE:
+        counts = _delete_project_fallback(project_id)
+    else:
+        counts = dict(rows[0]) if rows and isinstance(rows[0], dict) else {}
+    cmd_ids = counts.pop("command_ids", None) or []
+    counts.update(_sidecar.delete_project_data(project_id=project_id, command_ids=cmd_ids))
+    _changes.bump(*_changes.SCOPES)
+    logger.info("delete_project project_id=%s counts=%s", project_id, counts)
+    return counts
 
+
+@memoized("projects")
 def get_user_projects(user_id):
     sb = get_sb()
     res = sb.table("projects").select("*").eq("user_id", user_id).order("last_accessed", desc=True).execute()
     return res.data or []
 
 
+@memoized("projects")
 def get_project_by_id(project_id):
     sb = get_sb()
     return _execute_single(sb.table("projects").select("*").eq("id", project_id))
 
 
+@memoized("projects")
 def get_project_by_name(user_id, name):
     sb = get_sb()
     return _execute_single(sb.table("projects").select("*").eq("user_id", user_id).ilike("name", name))
 
 
+@writes("projects")
 def upsert_project_by_name(*, user_id: str, name: str, file_path: str | None = None) -> dict:
     existing = get_project_by_name(user_id, name)
     if existing:
@@ -234,14 +364,25 @@ def upsert_project_by_name(*, user_id: str, name: str, file_path: str | None = N
     return p or {"id": project_id, "user_id": user_id, "name": name, "file_path": file_path}
 
 
+@memoized("projects", "tasks")
 def get_user_projects_with_task_counts(user_id):
     sb = get_sb()
     res = sb.rpc("get_user_projects_with_task_counts", {"p_user_id": user_id}).execute()
     return res.data or []
 
 
+# Preference rows are read on every transcribe / dispatch / unified command. Rows are
+# cached per worker and updated by the set_* functions below; writes made by another
+# worker show up here within _PREFS_CACHE_TTL_S.
+_PREFS_CACHE_TTL_S = 60.0
+_prefs_cache = TTLCache(maxsize=4096, ttl=_PREFS_CACHE_TTL_S)
+# Users whose user_preferences row is known to exist (the bootstrap upsert ran).
+_prefs_bootstrapped = TTLCache(maxsize=16384, ttl=3600.0)
+
 
 def _ensure_user_preferences_row(user_id: str) -> None:
+    if _prefs_bootstrapped.get(user_id):
+        return
     sb = get_sb()
     try:
         sb.table("user_preferences").upsert(
@@ -255,15 +396,38 @@ def _ensure_user_preferences_row(user_id: str) -> None:
             logger.warning("skip user_preferences bootstrap; users row missing for user_id=%s", user_id)
             return
         raise
+    _prefs_bootstrapped.set(user_id, True)
 
 
+@memoized("user_preferences")
 def get_user_preferences(user_id: str) -> dict:
+    cached = _prefs_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
     _ensure_user_preferences_row(user_id)
     sb = get_sb()
     row = _execute_single(sb.table("user_preferences").select("*").eq("user_id", user_id))
-    return row or {"user_id": user_id}
+    if not row:
+        return {"user_id": user_id}
+    _prefs_cache.set(user_id, row)
+    return dict(row)
+
+
+def invalidate_user_preferences(user_id: str) -> None:
+    """Drop the cached preference row (for writers outside the set_* functions)."""
+    _prefs_cache.pop(user_id)
 
 
+def _update_user_preferences(user_id: str, values: dict) -> None:
+    _ensure_user_preferences_row(user_id)
+    sb = get_sb()
+    sb.table("user_preferences").update(values).eq("user_id", user_id).execute()
+    cached = _prefs_cache.get(user_id)
+    if cached is not None:
+        _prefs_cache.set(user_id, {**cached, **values})
+
+
+@memoized("user_preferences")
 def get_default_provider_for_user(user_id: str) -> str:
     prefs = get_user_preferences(user_id)
     provider = (prefs.get("default_provider") or "cursor").strip().lower()
@@ -272,27 +436,27 @@ def get_default_provider_for_user(user_id: str) -> str:
     return provider
 
 
+@writes("user_preferences")
 def set_default_provider_for_user(user_id: str, provider: str) -> None:
     provider = (provider or "").strip().lower()
     if provider not in {"cursor", "claude", "shell"}:
         provider = "cursor"
-    _ensure_user_preferences_row(user_id)
-    sb = get_sb()
-    sb.table("user_preferences").update({"default_provider": provider}).eq("user_id", user_id).execute()
+    _update_user_preferences(user_id, {"default_provider": provider})
 
 
+@writes("user_preferences")
 def set_terminal_access_for_user(user_id: str, granted: bool) -> None:
-    _ensure_user_preferences_row(user_id)
-    sb = get_sb()
-    sb.table("user_preferences").update({"terminal_access_granted": granted}).eq("user_id", user_id).execute()
+    _update_user_preferences(user_id, {"terminal_access_granted": granted})
 
 
+@memoized("user_preferences")
 def get_terminal_access_for_user(user_id: str) -> bool:
     prefs = get_user_preferences(user_id)
     return bool(prefs.get("terminal_access_granted"))
 
 # ==================== PROJECT BASE PATH ====================
 
+@memoized("user_preferences")
 def get_project_base_path_for_user(user_id: str) -> str | None:
     prefs = get_user_preferences(user_id)
     base_path = prefs.get("project_base_path")
@@ -302,13 +466,10 @@ def get_project_base_path_for_user(user_id: str) -> str | None:
     return base_path if base_path else None
 
 
+@writes("user_preferences")
 def set_project_base_path_for_user(user_id: str, base_path: str | None) -> None:
-    _ensure_user_preferences_row(user_id)
     base_path = (base_path or "").strip()
-    sb = get_sb()
-    sb.table("user_preferences").update({
-        "project_base_path": base_path if base_path else None,
-    }).eq("user_id", user_id).execute()
+    _update_user_preferences(user_id, {"project_base_path": base_path if base_path else None})
 
 
 def _safe_project_folder_name(name: str) -> str:
@@ -334,6 +495,7 @@ def compute_default_project_file_path(base_path: str | None, project_name: str)
 
 # ==================== TASKS ====================
 
+@writes("tasks")
 def create_task(
     project_id,
     user_id,
@@ -361,6 +523,7 @@ def create_task(
     return task_id
 
 
+@writes("projects", "tasks")
 def log_agent_event_task(
     user_id: str,
     project_name: str | None,
@@ -399,9 +562,17 @@ def log_agent_event_task(
     return tid
 
 
-def get_user_tasks(user_id: str):
+def get_user_tasks(
+    user_id: str,
+    *,
+    limit: int | None = None,
+    cursor: str | None = None,
+    updated_since: str | None = None,
+):
+    """Newest-first tasks; see database/pagination.py for cursor / updated_since."""
     sb = get_sb()
-    res = sb.table("tasks").select("*, projects(name)").eq("user_id", user_id).order("created_at", desc=True).execute()
+    query = sb.table("tasks").select("*, projects(name)").eq("user_id", user_id)
+    res = pagination.apply(query, cursor=cursor, updated_since=updated_since, limit=limit).execute()
     raw_rows = res.data or []
     # Flatten: {projects: {name: "foo"}} -> {project_name: "foo"} (immutable reconstruction)
     result = []
@@ -469,9 +640,12 @@ def update_call_session(session_id, transcript, commands_executed):
     }).eq("id", session_id).execute()
 
 
-def get_user_call_history(user_id, limit=10):
+def get_user_call_history(user_id, limit=10, *, cursor: str | None = None, updated_since: str | None = None):
     sb = get_sb()
-    res = sb.table("call_sessions").select("*").eq("user_id", user_id).order("started_at", desc=True).limit(limit).execute()
+    query = sb.table("call_sessions").select("*").eq("user_id", user_id)
+    res = pagination.apply(
+        query, column="started_at", cursor=cursor, updated_since=updated_since, limit=limit
+    ).execute()
     return res.data or []
 
 
@@ -496,6 +670,7 @@ def create_agent_execution(
         "refined_prompt": refined_prompt,
         "status": status,
     }).execute()
+    _changes.bump("executions")
     logger.debug("create_agent_execution id=%s task_id=%s stage=%s", exec_id, task_id, stage)
     return exec_id
 
@@ -522,6 +697,7 @@ def update_agent_execution(
     if terminal_command_id is not None:
         data["terminal_command_id"] = terminal_command_id
     sb.table("agent_executions").update(data).eq("id", exec_id).execute()
+    _changes.bump("executions")
     logger.debug("update_agent_execution id=%s status=%s", exec_id, status)
 
 
@@ -543,6 +719,7 @@ def store_agent_feedback(
         "status": status,
         "completed_at": _now_iso(),
     }).execute()
+    _changes.bump("executions")
     logger.debug("store_agent_feedback task_id=%s status=%s", task_id, status)
 
 
@@ -558,16 +735,20 @@ def get_task_agent_status(task_id: str) -> dict:
     return _first_or_none(res) or {"status": "none", "stage": "none"}
 
 
-def get_user_agent_executions(user_id: str, limit: int = 20) -> list:
+def get_user_agent_executions(
+    user_id: str,
+    limit: int = 20,
+    *,
+    cursor: str | None = None,
+    updated_since: str | None = None,
+) -> list:
     sb = get_sb()
-    res = (
+    query = (
         sb.table("agent_executions")
         .select("*, tasks!inner(user_id, description, projects(name))")
         .eq("tasks.user_id", user_id)
-        .order("created_at", desc=True)
-        .limit(limit)
-        .execute()
     )
+    res = pagination.apply(query, cursor=cursor, updated_since=updated_since, limit=limit).execute()
     raw_rows = res.data or []
     # Flatten nested task/project info (immutable reconstruction)
     result = []
@@ -642,7 +823,17 @@ def get_instance_by_id(instance_id: str) -> dict | None:
     return _execute_single(sb.table("instances").select("*").eq("id", instance_id))
 
 
+def touch_instance_heartbeat(instance_id: str) -> None:
+    """Mark an instance online; buffered in memory and written by flush_pending_touches()."""
+    _touches.touch("instances", instance_id, column="last_heartbeat", at=_touch_at(), status="online")
+
+
 def update_instance_heartbeat(*, instance_id: str, status: str = "online") -> None:
+    if status == "online":
+        touch_instance_heartbeat(instance_id)
+        return
+    # Status transitions are written through so they are not reordered behind a buffered "online".
+    _touches.discard("instances", instance_id)
     sb = get_sb()
     sb.table("instances").update({
         "status": status,
@@ -700,12 +891,14 @@ def create_terminal_session(
         "name": name,
         "status": status,
     }).execute()
+    _changes.bump("sessions", user_id=user_id)
     return session_id
 
 
 def touch_terminal_session(session_id: str) -> None:
     sb = get_sb()
-    sb.table("terminal_sessions").update({"updated_at": _now_iso()}).eq("id", session_id).execute()
+    res = sb.table("terminal_sessions").update({"updated_at": _now_iso()}).eq("id", session_id).execute()
+    _changes.bump_rows("sessions", rows=res.data)
 
 
 def set_terminal_session_status(session_id: str, status: str, closed: bool = False) -> None:
@@ -713,15 +906,17 @@ def set_terminal_session_status(session_id: str, status: str, closed: bool = Fal
     data = {"status": status, "updated_at": _now_iso()}
     if closed:
         data["closed_at"] = _now_iso()
-    sb.table("terminal_sessions").update(data).eq("id", session_id).execute()
+    res = sb.table("terminal_sessions").update(data).eq("id", session_id).execute()
+    _changes.bump_rows("sessions", rows=res.data)
 
 
 def bind_terminal_session_instance(session_id: str, instance_id: str | None) -> None:
     sb = get_sb()
-    sb.table("terminal_sessions").update({
+    res = sb.table("terminal_sessions").update({
         "instance_id": instance_id,
         "updated_at": _now_iso(),
     }).eq("id", session_id).execute()
+    _changes.bump_rows("sessions", rows=res.data)
 
 
 def get_terminal_session(session_id: str) -> dict | None:
@@ -777,6 +972,9 @@ def create_terminal_command(
     )
     # Update session timestamp (non-transactional, cosmetic)
     sb.table("terminal_sessions").update({"updated_at": _now_iso()}).eq("id", session_id).execute()
+    _changes.bump("commands", "sessions", user_id=user_id)
+    if status == "queued":
+        _events.notify_command_queued(user_id=user_id)
     return command_id
 
 
@@ -848,16 +1046,22 @@ def list_recent_terminal_commands_for_user(
     *,
     user_id: str,
     limit: int = 100,
+    project_id: str | None = None,
+    cursor: str | None = None,
 ) -> list[dict]:
+    """
+    Newest-first commands, optionally for one project (filtered in the join, so a
+    project view still gets `limit` rows). `cursor` comes from pagination.next_cursor().
+    """
     sb = get_sb()
-    res = (
+    query = (
         sb.table("terminal_commands")
         .select("*, terminal_sessions!inner(project_id, name, projects(name))")
         .eq("user_id", user_id)
-        .order("created_at", desc=True)
-        .limit(limit)
-        .execute()
     )
+    if project_id:
+        query = query.eq("terminal_sessions.project_id", project_id)
+    res = pagination.apply(query, cursor=cursor, limit=limit).execute()
     raw_rows = res.data or []
     # Flatten nested session/project info (immutable reconstruction)
     result = []
@@ -876,57 +1080,219 @@ def list_recent_terminal_commands_for_user(
     return _sidecar.enrich_commands(result)
 
 
-def _expire_stale_running_commands(user_id: str, stale_minutes: int = 5) -> None:
-    """Mark commands stuck in 'running' for too long as failed."""
-    sb = get_sb()
-    from datetime import datetime, timezone, timedelta
-    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=stale_minutes)).isoformat()
-    stale_res = (
-        sb.table("terminal_commands")
-        .select("id")
-        .eq("user_id", user_id)
-        .eq("status", "running")
-        .lt("started_at", cutoff)
-        .execute()
+# A claim leases the command to its agent for COMMAND_LEASE_SECONDS. Heartbeats,
+# log appends and the renew endpoints extend the lease; the reaper in main requeues
+# (while attempts < COMMAND_MAX_ATTEMPTS) or fails commands whose lease ran out.
+# Requeueing re-runs a possibly half-executed command, so it is opt-in.
+COMMAND_LEASE_SECONDS = int(os.environ.get("DISPATCH_COMMAND_LEASE_SECONDS", "120"))
+COMMAND_MAX_ATTEMPTS = max(1, int(os.environ.get("DISPATCH_COMMAND_MAX_ATTEMPTS", "1")))
+# Rows claimed before leases existed have no lease_expires_at; they expire after this
+# long without a heartbeat. Deployments without the lease migrations fail running
+# commands this long after started_at.
+STALE_COMMAND_SECONDS = int(os.environ.get("DISPATCH_STALE_COMMAND_SECONDS", "300"))
+
+
+def _lease_expiry_at(now: datetime) -> str:
+    return (now + timedelta(seconds=COMMAND_LEASE_SECONDS)).isoformat()
+
+
+def _lease_expiry() -> str:
+    return _lease_expiry_at(datetime.now(timezone.utc))
+
+
+def _claim_payload() -> dict:
+    # Only the multi-step claims use this, i.e. deployments without the claim RPCs and
+    # so without the lease columns either: write only what the original schema has.
+    return {"status": "running", "started_at": _now_iso()}
+
+
+# When PostgREST reported the lease columns (last_heartbeat_at, lease_expires_at,
+# attempts) missing; re-probed after _MISSING_RPC_RETRY_S like _missing_rpcs.
+_lease_columns_missing_at: float | None = None
+
+
+def _is_missing_column_error(exc: Exception) -> bool:
+    msg = str(exc)
+    return "PGRST204" in msg or "42703" in msg
+
+
+def _note_lease_columns_missing() -> None:
+    global _lease_columns_missing_at
+    _lease_columns_missing_at = time.monotonic()
+    logger.warning("terminal_commands lease columns not deployed; lease writes disabled")
+
+
+def _leases_unavailable() -> bool:
+    """The lease migrations have not run: their reaper RPC or their columns were reported missing."""
+    now = time.monotonic()
+    return any(
+        noticed is not None and now - noticed < _MISSING_RPC_RETRY_S
+        for noticed in (_missing_rpcs.get("expire_stale_running_commands"), _lease_columns_missing_at)
     )
-    for cmd in (stale_res.data or []):
-        sb.table("terminal_commands").update({
-            "status": "failed",
-            "exit_code": -1,
-            "completed_at": _now_iso(),
-        }).eq("id", cmd["id"]).execute()
-        logger.warning("expired stale running command id=%s user=%s", cmd["id"], user_id)
-
-
-def _expire_stale_running_commands_for_sessions(session_ids: list[str], stale_minutes: int = 5) -> None:
-    """Mark commands stuck in 'running' for too long as failed, filtered by session IDs."""
-    if not session_ids:
+
+
+# command_id -> (lease deadline earned by its latest output, failed flushes so far),
+# written out by flush_pending_touches(). Not a TouchBuffer group: each row needs its
+# own value and the write must only land on commands that are still running.
+_pending_leases: dict[str, tuple[str, int]] = {}
+_pending_leases_lock = threading.Lock()
+# A lease write that failed this many flushes in a row is dropped; the next output queues a fresh one.
+_LEASE_FLUSH_ATTEMPTS = 3
+
+
+def _queue_lease(command_id: str, expiry: str, failures: int) -> None:
+    """Caller holds _pending_leases_lock."""
+    current = _pending_leases.get(command_id)
+    if current is None or expiry > current[0]:
+        _pending_leases[command_id] = (expiry, max(failures, current[1] if current else 0))
+
+
+def extend_command_lease(command_id: str) -> None:
+    """Output arrived for a running command: extend its lease (buffered, flushed with the touches)."""
+    if _leases_unavailable():
         return
+    # Whole seconds, so commands with output in the same second share one UPDATE.
+    expiry = _lease_expiry_at(datetime.now(timezone.utc).replace(microsecond=0))
+    with _pending_leases_lock:
+        _queue_lease(command_id, expiry, 0)
+
+
+def _flush_pending_leases() -> int:
+    global _pending_leases
+    with _pending_leases_lock:
+        pending, _pending_leases = _pending_leases, {}
+    if not pending or _leases_unavailable():
+        return 0
+    by_expiry: dict[str, list[str]] = {}
+    for command_id, (expiry, _) in pending.items():
+        by_expiry.setdefault(expiry, []).append(command_id)
+    sb = get_sb()
+    written = 0
+    for expiry, ids in by_expiry.items():
+        ids.sort()
+        for i in range(0, len(ids), _TOUCH_FLUSH_CHUNK):
+            chunk = ids[i:i + _TOUCH_FLUSH_CHUNK]
+            try:
+                # Never revive a requeued or finished command, never shorten a renewed lease.
+                (
+                    sb.table("terminal_commands")
+                    .update({"lease_expires_at": expiry})
+                    .in_("id", chunk)
+                    .eq("status", "running")
+                    .or_(f'lease_expires_at.is.null,lease_expires_at.lt."{expiry}"')
+                    .execute()
+                )
+                written += len(chunk)
+            except Exception as e:
+                if _is_missing_column_error(e):
+                    _note_lease_columns_missing()
+                    return written
+                logger.warning("lease flush failed rows=%s err=%r", len(chunk), e)
+                retry = [cid for cid in chunk if pending[cid][1] + 1 < _LEASE_FLUSH_ATTEMPTS]
+                if len(retry) < len(chunk):
+                    logger.warning("dropping lease writes after %s failed flushes rows=%s",
+                                   _LEASE_FLUSH_ATTEMPTS, len(chunk) - len(retry))
+                with _pending_leases_lock:
+                    for command_id in retry:
+                        _queue_lease(command_id, expiry, pending[command_id][1] + 1)
+    return written
+
+
+def renew_command_leases(*, user_id: str, command_ids: list[str]) -> list[str]:
+    """
+    Extend the leases of the caller's running `command_ids` in one UPDATE. Returns the
+    ids renewed; a missing id means the command is no longer running (expired, done).
+    """
+    if not command_ids:
+        return []
     sb = get_sb()
-    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=stale_minutes)).isoformat()
-    stale_res = (
+    if not _leases_unavailable():
+        try:
+            res = (
+                sb.table("terminal_commands")
+                .update({"last_heartbeat_at": _now_iso(), "lease_expires_at": _lease_expiry()})
+                .in_("id", command_ids)
+                .eq("user_id", user_id)
+                .eq("status", "running")
+                .execute()
+            )
+        except Exception as e:
+            if not _is_missing_column_error(e):
+                raise
+            _note_lease_columns_missing()
+        else:
+            rows = res.data if isinstance(res.data, list) else []
+            return [r["id"] for r in rows if isinstance(r, dict) and r.get("id")]
+    # No leases to extend; still tell the agent which of its commands are running.
+    res = (
         sb.table("terminal_commands")
         .select("id")
-        .in_("session_id", session_ids)
+        .in_("id", command_ids)
+        .eq("user_id", user_id)
         .eq("status", "running")
-        .lt("started_at", cutoff)
         .execute()
     )
-    for cmd in (stale_res.data or []):
-        sb.table("terminal_commands").update({
-            "status": "failed",
-            "exit_code": -1,
-            "completed_at": _now_iso(),
-        }).eq("id", cmd["id"]).execute()
-        logger.warning("expired stale running command id=%s (device path)", cmd["id"])
+    return [r["id"] for r in res.data or [] if r.get("id")]
+
+
+def expire_stale_running_commands(
+    *,
+    stale_seconds: int = STALE_COMMAND_SECONDS,
+    max_attempts: int = COMMAND_MAX_ATTEMPTS,
+) -> list[dict]:
+    """
+    Requeue (attempts < max_attempts) or fail every running command whose lease has
+    expired, set-based. Returns the affected rows with their new status.
+    """
+    rows = _call_rpc_rows(
+        "expire_stale_running_commands",
+        {"p_stale_seconds": stale_seconds, "p_max_attempts": max_attempts},
+        strict=True,
+    )
+    if rows is _RPC_UNAVAILABLE:
+        # The RPC and the lease columns come from the same migrations, so without it only
+        # started_at is there to go by: fail what has run longer than stale_seconds, as
+        # claims did before leases.
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)).isoformat()
+        res = (
+            get_sb().table("terminal_commands")
+            .update({"status": "failed", "exit_code": -1, "completed_at": _now_iso()})
+            .eq("status", "running")
+            .lt("started_at", cutoff)
+            .execute()
+        )
+        rows = res.data if isinstance(res.data, list) else []
+    if rows:
+        _changes.bump_rows("commands", rows=rows)
+        requeued = [r for r in rows if r.get("status") == "queued"]
+        for uid in {r.get("user_id") for r in requeued if r.get("user_id")}:
+            _events.notify_command_queued(user_id=uid)
+        logger.warning(
+            "expired command leases requeued=%s failed=%s",
+            [r.get("id") for r in requeued],
+            [r.get("id") for r in rows if r.get("status") != "queued"],
+        )
+    return rows
+
+
+def _claimed(cmd: dict | None) -> dict | None:
+    """Pass a freshly claimed command through, recording the queued -> running change."""
+    if cmd:
+        _changes.bump("commands", user_id=cmd.get("user_id"))
+    return cmd
 
 
 def claim_next_queued_command_for_user(*, user_id: str) -> dict | None:
     """Claim the oldest queued command across ALL of the user's projects."""
-    sb = get_sb()
+    rows = _call_rpc_rows(
+        "claim_next_queued_command_for_user",
+        {"p_user_id": user_id, "p_lease_seconds": COMMAND_LEASE_SECONDS},
+        strict=True,
+    )
+    if rows is not _RPC_UNAVAILABLE:
+        return _claimed(_sidecar.enrich_command(rows[0])) if rows else None
 
-    # Expire any commands stuck as "running" for too long.
-    _expire_stale_running_commands(user_id)
+    sb = get_sb()
 
     # Find the oldest queued command belonging to this user.
     cmd_res = (
@@ -942,10 +1308,7 @@ def claim_next_queued_command_for_user(*, user_id: str) -> dict | None:
         return None
 
     # Claim it (update only if still queued).
-    sb.table("terminal_commands").update({
-        "status": "running",
-        "started_at": _now_iso(),
-    }).eq("id", cmd["id"]).eq("status", "queued").execute()
+    sb.table("terminal_commands").update(_claim_payload()).eq("id", cmd["id"]).eq("status", "queued").execute()
 
     # Re-fetch to confirm claim.
     verified = _execute_single(sb.table("terminal_commands").select("*").eq("id", cmd["id"]))
@@ -962,11 +1325,19 @@ def claim_next_queued_command_for_user(*, user_id: str) -> dict | None:
             if proj_row:
                 verified["project_path"] = proj_row.get("file_path")
 
-    return _sidecar.enrich_command(verified)
+    return _claimed(_sidecar.enrich_command(verified))
 
 
 def claim_next_queued_command_for_instance(*, instance_id: str) -> dict | None:
     """Claim the oldest queued terminal command for a particular instance."""
+    rows = _call_rpc_rows(
+        "claim_next_queued_command",
+        {"p_instance_id": instance_id, "p_lease_seconds": COMMAND_LEASE_SECONDS},
+        strict=True,
+    )
+    if rows is not _RPC_UNAVAILABLE:
+        return _claimed(_sidecar.enrich_command(rows[0])) if rows else None
+
     sb = get_sb()
 
     # Find all sessions assigned to this instance.
@@ -998,20 +1369,17 @@ def claim_next_queued_command_for_instance(*, instance_id: str) -> dict | None:
         return None
 
     command_id = cmd["id"]
-    sb.table("terminal_commands").update({
-        "status": "running",
-        "started_at": _now_iso(),
-    }).eq("id", command_id).eq("status", "queued").execute()
+    sb.table("terminal_commands").update(_claim_payload()).eq("id", command_id).eq("status", "queued").execute()
 
     verify_res = sb.table("terminal_commands").select("*").eq("id", command_id).maybe_single().execute()
     verified = verify_res.data if verify_res else None
     if not verified or verified.get("status") != "running":
         return None
 
-    return {
-        **verified,
+    return _claimed({
+        **(_sidecar.enrich_command(verified) or verified),
         "project_id": session_project_map.get(cmd["session_id"]),
-    }
+    })
 
 
 def complete_terminal_command(
@@ -1021,11 +1389,12 @@ def complete_terminal_command(
     exit_code: int | None = None,
 ) -> None:
     sb = get_sb()
-    sb.table("terminal_commands").update({
+    res = sb.table("terminal_commands").update({
         "status": status,
         "exit_code": exit_code,
         "completed_at": _now_iso(),
     }).eq("id", command_id).execute()
+    _changes.bump_rows("commands", rows=res.data)
 
 
 def update_terminal_command_for_approval(
@@ -1050,7 +1419,11 @@ def update_terminal_command_for_approval(
         if uid_row:
             _sidecar.reset_command_risk_pending(command_id=command_id, user_id=uid_row["user_id"])
     res = sb.table("terminal_commands").select("*").eq("id", command_id).limit(1).execute()
-    return _sidecar.enrich_command(_first_or_none(res))
+    row = _first_or_none(res)
+    _changes.bump_rows("commands", rows=[row] if row else None)
+    if status == "queued" and row:
+        _events.notify_command_queued(user_id=row.get("user_id"))
+    return _sidecar.enrich_command(row)
 
 
 def update_command_risk_assessment(
@@ -1081,6 +1454,7 @@ def update_command_risk_assessment(
         risk_reason=risk_reason,
         plain_summary=plain_summary,
     )
+    _changes.bump("commands", user_id=uid)
 
 
 def append_terminal_log_chunk(
@@ -1090,15 +1464,59 @@ def append_terminal_log_chunk(
     stream: str,
     chunk: str,
 ) -> None:
+    append_terminal_log_chunks(command_id=command_id, sequence_start=sequence, stream=stream, chunks=[chunk])
+
+
+# Rows per multi-row insert; keeps a single PostgREST request body bounded.
+_LOG_INSERT_BATCH = 500
+# Set once PostgREST reports the (command_id, sequence) unique index is missing.
+_log_upsert_unavailable = False
+
+
+def _is_missing_conflict_target_error(exc: Exception) -> bool:
+    msg = str(exc)
+    return "42P10" in msg or "no unique or exclusion constraint" in msg
+
+
+def append_terminal_log_chunks(
+    *,
+    command_id: str,
+    sequence_start: int,
+    stream: str,
+    chunks: list[str],
+) -> int:
+    """
+    Store `chunks` as sequences sequence_start, sequence_start + 1, ... in as few
+    requests as possible. Rows whose (command_id, sequence) already exists are skipped,
+    so a client retrying the same batch does not duplicate output. Returns the next sequence.
+    """
+    global _log_upsert_unavailable
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "command_id": command_id,
+            "sequence": sequence_start + i,
+            "stream": stream,
+            "chunk": chunk,
+        }
+        for i, chunk in enumerate(chunks)
+    ]
     sb = get_sb()
-    log_id = str(uuid.uuid4())
-    sb.table("terminal_logs").insert({
-        "id": log_id,
-        "command_id": command_id,
-        "sequence": sequence,
-        "stream": stream,
-        "chunk": chunk,
-    }).execute()
+    for i in range(0, len(rows), _LOG_INSERT_BATCH):
+        batch = rows[i:i + _LOG_INSERT_BATCH]
+        if not _log_upsert_unavailable:
+            try:
+                sb.table("terminal_logs").upsert(
+                    batch, on_conflict="command_id,sequence", ignore_duplicates=True
+                ).execute()
+                continue
+            except Exception as e:
+                if not _is_missing_conflict_target_error(e):
+                    raise
+                _log_upsert_unavailable = True
+                logger.warning("terminal_logs unique index missing; appending without dedupe")
+        sb.table("terminal_logs").insert(batch).execute()
+    return sequence_start + len(rows)
 
 
 def get_terminal_logs_for_command(
@@ -1106,7 +1524,17 @@ def get_terminal_logs_for_command(
     command_id: str,
     after_sequence: int | None = None,
     limit: int = 200,
+    compacted: bool = False,
 ) -> list[dict]:
+    """
+    `compacted`: the command's logs_compacted_at is set, so its output lives in
+    terminal_log_archives instead (callers already hold the command row). The same
+    applies to the other terminal log readers below.
+    """
+    if compacted:
+        archived = _archived_log(command_id)
+        start = bisect.bisect_right(archived.sequences, after_sequence) if after_sequence is not None else 0
+        return archived.rows[start:start + limit]
     sb = get_sb()
     query = sb.table("terminal_logs").select("*").eq("command_id", command_id)
     if after_sequence is not None:
@@ -1115,6 +1543,277 @@ def get_terminal_logs_for_command(
     return res.data or []
 
 
+def _chunk_bytes(row: dict) -> int:
+    return len((row.get("chunk") or "").encode("utf-8"))
+
+
+# Most chunks a line-based tail reads back through before giving up on finding
+# enough newlines (output such as progress bars may have none).
+_TAIL_MAX_CHUNKS = 2000
+
+
+def _from_last_lines(rows: list[dict], lines: int) -> list[dict]:
+    """The suffix of `rows` holding the last `lines` lines; the first row is trimmed to a line start."""
+    remaining = lines
+    for i in range(len(rows) - 1, -1, -1):
+        chunk = rows[i].get("chunk") or ""
+        # The output's own trailing newline ends the last line; it does not start a new one.
+        end = len(chunk) - 1 if i == len(rows) - 1 and chunk.endswith("\n") else len(chunk)
+        pos = chunk.rfind("\n", 0, end)
+        while pos != -1:
+            remaining -= 1
+            if remaining == 0:
+                head, rest = chunk[:pos + 1], chunk[pos + 1:]
+                first = dict(rows[i], chunk=rest)
+                if first.get("byte_offset") is not None:
+                    first["byte_offset"] += len(head.encode("utf-8"))
+                return ([first] if rest else []) + rows[i + 1:]
+            pos = chunk.rfind("\n", 0, pos)
+    return rows
+
+
+def get_terminal_log_tail(
+    *,
+    command_id: str,
+    chunks: int | None = None,
+    lines: int | None = None,
+    compacted: bool = False,
+) -> list[dict]:
+    """
+    The end of a command's output, oldest first: the last `chunks` chunks, or the
+    chunks holding the last `lines` lines (the first one trimmed to a line start).
+    Reads pages backward from the newest sequence, so it costs the tail, not the log.
+    """
+    if compacted:
+        rows = _archived_log(command_id).rows
+        rows = rows[-chunks:] if lines is None else rows[-_TAIL_MAX_CHUNKS:]
+        return rows if lines is None else _from_last_lines(rows, lines)
+    sb = get_sb()
+    want = chunks if lines is None else _TAIL_MAX_CHUNKS
+    page = want if lines is None else _LOG_READ_PAGE // 5
+    newest_first: list[dict] = []
+    newlines = 0
+    while len(newest_first) < want:
+        query = sb.table("terminal_logs").select("*").eq("command_id", command_id)
+        if newest_first:
+            query = query.lt("sequence", newest_first[-1]["sequence"])
+        batch = query.order("sequence", desc=True).limit(min(page, want - len(newest_first))).execute().data or []
+        newest_first.extend(batch)
+        if lines is not None:
+            newlines += sum((r.get("chunk") or "").count("\n") for r in batch)
+            if newlines > lines:
+                break
+        if len(batch) < page:
+            break
+    rows = newest_first[::-1]
+    return rows if lines is None else _from_last_lines(rows, lines)
+
+
+def get_terminal_log_range(
+    *,
+    command_id: str,
+    byte_start: int,
+    byte_end: int | None = None,
+    limit: int = 200,
+    compacted: bool = False,
+) -> list[dict]:
+    """
+    Up to `limit` chunks overlapping bytes [byte_start, byte_end) of a command's
+    output, oldest first. Rows carry byte_offset, so callers can cut exact bytes.
+    """
+    if compacted:
+        archived = _archived_log(command_id)
+        rows = []
+        i = max(bisect.bisect_right(archived.offsets, byte_start) - 1, 0)
+        while i < len(archived.rows) and len(rows) < limit:
+            r = archived.rows[i]
+            if byte_end is not None and r["byte_offset"] >= byte_end:
+                break
+            if r["byte_offset"] + _chunk_bytes(r) > byte_start:
+                rows.append(r)
+            i += 1
+        return rows
+    sb = get_sb()
+    first = (
+        sb.table("terminal_logs")
+        .select("sequence")
+        .eq("command_id", command_id)
+        .lte("byte_offset", byte_start)
+        .order("byte_offset", desc=True)
+        .limit(1)
+        .execute()
+        .data
+    )
+    if first:
+        query = sb.table("terminal_logs").select("*").eq("command_id", command_id).gte("sequence", first[0]["sequence"])
+        if byte_end is not None:
+            query = query.lt("byte_offset", byte_end)
+        return query.order("sequence").limit(limit).execute().data or []
+    return []
+
+
+def get_terminal_log_size(command_id: str, *, compacted: bool = False) -> dict:
+    """{"chunks", "bytes"} of a command's output so far; bytes is None for rows written before byte offsets."""
+    if compacted:
+        return _archived_log_size(command_id)
+    sb = get_sb()
+    res = sb.table("terminal_logs").select("*").eq("command_id", command_id).order("sequence", desc=True).limit(1).execute()
+    last = (res.data or [None])[0]
+    if last is None:
+        return {"chunks": 0, "bytes": 0}
+    offset = last.get("byte_offset")
+    return {
+        "chunks": last["sequence"] + 1,
+        "bytes": offset + _chunk_bytes(last) if offset is not None else None,
+    }
+
+
+# Finished commands' chunks are merged into terminal_log_archives this long after
+# completed_at (late appends from a retrying agent land well within it).
+LOG_COMPACT_AFTER_SECONDS = int(os.environ.get("DISPATCH_LOG_COMPACT_AFTER_SECONDS", "600"))
+# Output of commands finished longer ago than this is dropped; 0 keeps it forever.
+LOG_RETENTION_DAYS = float(os.environ.get("DISPATCH_LOG_RETENTION_DAYS", "0"))
+# Commands compacted per compact_terminal_logs() call.
+LOG_COMPACT_BATCH = 50
+_LOG_READ_PAGE = 1000
+
+class _ArchivedLog(NamedTuple):
+    """A compacted command's decoded output, with its sequences and byte offsets for bisecting."""
+
+    rows: list[dict]
+    sequences: list[int]
+    offsets: list[int]
+
+
+_NO_ARCHIVE = _ArchivedLog([], [], [])
+
+# command_id -> _ArchivedLog. Archives never change once written, so a command's is
+# decoded once and shared by every page, tail and range read of it. Bounded by the
+# archives' raw output bytes; decoded rows take a few times that in memory.
+_LOG_ARCHIVE_CACHE_BYTES = int(float(os.environ.get("DISPATCH_LOG_ARCHIVE_CACHE_MB", "64")) * 1024 * 1024)
+_log_archive_cache = SizedTTLCache(maxsize=256, ttl=300.0, maxbytes=_LOG_ARCHIVE_CACHE_BYTES)
+
+
+def _archived_log(command_id: str) -> _ArchivedLog:
+    cached = _log_archive_cache.get(command_id)
+    if cached is not None:
+        return cached
+    sb = get_sb()
+    try:
+        res = sb.table("terminal_log_archives").select("*").eq("command_id", command_id).execute()
+    except Exception as e:
+        logger.debug("terminal_log_archives read failed command_id=%s err=%r", command_id, e)
+        return _NO_ARCHIVE
+    archives = res.data or []
+    if not archives:
+        return _NO_ARCHIVE
+    rows = log_archive.unpack(archives)
+    archived = _ArchivedLog(rows, [r["sequence"] for r in rows], [r["byte_offset"] for r in rows])
+    _log_archive_cache.set(command_id, archived, size=sum(a.get("raw_bytes") or 0 for a in archives))
+    return archived
+
+
+def _archived_log_size(command_id: str) -> dict:
+    """get_terminal_log_size() of a compacted command, from the archive index without decoding the output."""
+    cached = _log_archive_cache.get(command_id)
+    if cached is not None:
+        if not cached.rows:
+            return {"chunks": 0, "bytes": 0}
+        last = cached.rows[-1]
+        return {"chunks": last["sequence"] + 1, "bytes": last["byte_offset"] + _chunk_bytes(last)}
+    sb = get_sb()
+    try:
+        res = sb.table("terminal_log_archives").select("raw_bytes,sequences").eq("command_id", command_id).execute()
+    except Exception as e:
+        logger.debug("terminal_log_archives read failed command_id=%s err=%r", command_id, e)
+        return {"chunks": 0, "bytes": 0}
+    archives = res.data or []
+    last_sequence = max((a["sequences"][-1][0] for a in archives if a.get("sequences")), default=-1)
+    return {"chunks": last_sequence + 1, "bytes": sum(a.get("raw_bytes") or 0 for a in archives)}
+
+
+def _live_terminal_logs(command_id: str) -> list[dict]:
+    sb = get_sb()
+    rows: list[dict] = []
+    while True:
+        query = sb.table("terminal_logs").select("*").eq("command_id", command_id)
+        if rows:
+            query = query.gt("sequence", rows[-1]["sequence"])
+        page = query.order("sequence").limit(_LOG_READ_PAGE).execute().data or []
+        rows.extend(page)
+        if len(page) < _LOG_READ_PAGE:
+            return rows
+
+
+def _uncompacted_commands(*, before: datetime, since: datetime | None = None, limit: int) -> list[str]:
+    """Ids of finished, not yet compacted commands with since <= completed_at < before, oldest first."""
+    if limit <= 0:
+        return []
+    sb = get_sb()
+    query = (
+        sb.table("terminal_commands")
+        .select("id")
+        .is_("logs_compacted_at", "null")
+        .lt("completed_at", before.isoformat())
+    )
+    if since is not None:
+        query = query.gte("completed_at", since.isoformat())
+    res = query.order("completed_at").limit(limit).execute()
+    return [r["id"] for r in (res.data or [])]
+
+
+def compact_terminal_logs(
+    *,
+    compact_after_seconds: int | None = None,
+    retention_days: float | None = None,
+    limit: int = LOG_COMPACT_BATCH,
+) -> dict:
+    """
+    Merge the terminal_logs rows of up to `limit` commands finished more than
+    compact_after_seconds ago into one gzip archive per stream, and drop output
+    older than retention_days (archived or not). Safe to re-run after a crash at
+    any step: the archive is written before the chunks are deleted, and a command
+    is only marked compacted after both. Returns counts for logging.
+    """
+    if compact_after_seconds is None:
+        compact_after_seconds = LOG_COMPACT_AFTER_SECONDS
+    if retention_days is None:
+        retention_days = LOG_RETENTION_DAYS
+    now = datetime.now(timezone.utc)
+    keep_after = now - timedelta(days=retention_days) if retention_days > 0 else None
+    compact_before = now - timedelta(seconds=compact_after_seconds)
+    # Split by retention in the query rather than by parsing completed_at here.
+    drop_before = min(keep_after, compact_before) if keep_after is not None else None
+    doomed = _uncompacted_commands(before=drop_before, limit=limit) if drop_before is not None else []
+    to_archive = _uncompacted_commands(before=compact_before, since=drop_before, limit=limit - len(doomed))
+    sb = get_sb()
+    counts = {"compacted": 0, "dropped": 0, "archives_expired": 0}
+    for command_id, expired in [(c, True) for c in doomed] + [(c, False) for c in to_archive]:
+        if not expired:
+            rows = _live_terminal_logs(command_id)
+            if rows:
+                sb.table("terminal_log_archives").upsert(
+                    log_archive.pack(command_id, rows), on_conflict="command_id,stream"
+                ).execute()
+        sb.table("terminal_logs").delete(returning=ReturnMethod.minimal).eq("command_id", command_id).execute()
+        sb.table("terminal_commands").update({"logs_compacted_at": now.isoformat()}).eq("id", command_id).execute()
+        counts["dropped" if expired else "compacted"] += 1
+    if keep_after is not None:
+        res = (
+            sb.table("terminal_log_archives")
+            .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+            .lt("created_at", keep_after.isoformat())
+            .execute()
+        )
+        n = getattr(res, "count", None)
+        counts["archives_expired"] = n if isinstance(n, int) else 0
+        if counts["archives_expired"]:
+            _log_archive_cache.clear()
+    if any(counts.values()):
+        logger.info("compact_terminal_logs %s", counts)
+    return counts
+
+
 def add_conversation_turn(
     *,
     user_id: str,
@@ -1125,7 +1824,7 @@ def add_conversation_turn(
     turn_type: str,
     content: str,
 ) -> dict:
-    return _sidecar.add_conversation_turn(
+    turn = _sidecar.add_conversation_turn(
         user_id=user_id,
         project_id=project_id,
         session_id=session_id,
@@ -1134,6 +1833,8 @@ def add_conversation_turn(
         turn_type=turn_type,
         content=content,
     )
+    _changes.bump("conversation", user_id=user_id)
+    return turn
 
 
 def list_conversation_turns_for_user(*, user_id: str, project_id: str | None = None, limit: int = 100) -> list[dict]:
@@ -1170,6 +1871,14 @@ def claim_next_queued_command_for_device(*, device_id: str) -> dict | None:
     Returns the command dict with project_id and local_path attached.
     Uses an RPC function for atomicity, falling back to a two-step approach.
     """
+    rows = _call_rpc_rows(
+        "claim_next_queued_command_for_device",
+        {"p_device_id": device_id, "p_lease_seconds": COMMAND_LEASE_SECONDS},
+        strict=True,
+    )
+    if rows is not _RPC_UNAVAILABLE:
+        return _claimed(_sidecar.enrich_command(rows[0])) if rows else None
+
     sb = get_sb()
     # Step 1: Find the oldest queued command linked to this device.
     # Get project IDs linked to this device first.
@@ -1190,9 +1899,6 @@ def claim_next_queued_command_for_device(*, device_id: str) -> dict | None:
     session_ids = [s["id"] for s in sessions]
     session_project_map = {s["id"]: s["project_id"] for s in sessions}
 
-    # Expire any commands stuck as "running" for too long in these sessions.
-    _expire_stale_running_commands_for_sessions(session_ids)
-
     # Find oldest queued command in those sessions.
     cmd_res = (
         sb.table("terminal_commands")
@@ -1210,10 +1916,7 @@ def claim_next_queued_command_for_device(*, device_id: str) -> dict | None:
     command_id = cmd["id"]
 
     # Step 2: Atomically claim it (update only if still queued).
-    sb.table("terminal_commands").update({
-        "status": "running",
-        "started_at": _now_iso(),
-    }).eq("id", command_id).eq("status", "queued").execute()
+    sb.table("terminal_commands").update(_claim_payload()).eq("id", command_id).eq("status", "queued").execute()
 
     # Re-fetch to confirm claim succeeded.
     verify_res = sb.table("terminal_commands").select("*").eq("id", command_id).limit(1).execute()
@@ -1223,15 +1926,21 @@ def claim_next_queued_command_for_device(*, device_id: str) -> dict | None:
 
     # Attach project_id and local_path.
     project_id = session_project_map.get(cmd["session_id"])
-    return {
+    return _claimed({
         **(_sidecar.enrich_command(verified) or verified),
         "project_id": project_id,
         "project_local_path": local_path_map.get(project_id),
-    }
+    })
 
 
 # ==================== AGENT TOKENS (Local Agent Pairing) ====================
 
+# token hash -> principal row. Short TTL bounds how long a token revoked from another
+# worker keeps working; revocations in this process invalidate immediately.
+_TOKEN_CACHE_TTL_S = 30.0
+_agent_token_cache = TTLCache(maxsize=4096, ttl=_TOKEN_CACHE_TTL_S)
+_device_token_cache = TTLCache(maxsize=4096, ttl=_TOKEN_CACHE_TTL_S)
+
 def _hash_agent_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
@@ -1265,26 +1974,28 @@ def list_agent_tokens(*, user_id: str) -> list[dict]:
 def revoke_agent_token(*, user_id: str, token_id: str) -> None:
     sb = get_sb()
     sb.table("agent_tokens").update({"revoked_at": _now_iso()}).eq("id", token_id).eq("user_id", user_id).execute()
+    _agent_token_cache.discard_where(lambda _, principal: principal["id"] == token_id)
 
 
 def get_user_id_for_agent_token(token: str) -> str | None:
-    sb = get_sb()
     token_hash = _hash_agent_token(token)
-    res = (
-        sb.table("agent_tokens")
-        .select("id, user_id")
-        .eq("token_hash", token_hash)
-        .is_("revoked_at", "null")
-        .limit(1)
-        .execute()
-    )
-    data = _first_or_none(res)
-    if not data:
-        return None
-    token_id = data["id"]
-    user_id = data["user_id"]
-    sb.table("agent_tokens").update({"last_used_at": _now_iso()}).eq("id", token_id).execute()
-    return user_id
+    data = _agent_token_cache.get(token_hash)
+    if data is None:
+        sb = get_sb()
+        res = (
+            sb.table("agent_tokens")
+            .select("id, user_id")
+            .eq("token_hash", token_hash)
+            .is_("revoked_at", "null")
+            .limit(1)
+            .execute()
+        )
+        data = _first_or_none(res)
+        if not data:
+            return None
+        _agent_token_cache.set(token_hash, data)
+    _touches.touch("agent_tokens", data["id"], column="last_used_at", at=_touch_at())
+    return data["user_id"]
 
 
 def _hash_device_token(token: str) -> str:
@@ -1343,18 +2054,50 @@ def complete_device_pairing(*, pairing_code: str, device_name: str | None = None
 
 
 def get_device_by_token(device_token: str) -> dict | None:
-    sb = get_sb()
     token_hash = _hash_device_token(device_token)
-    res = sb.table("companion_devices").select("*").eq("device_token_hash", token_hash).limit(1).execute()
-    return _first_or_none(res)
+    device = _device_token_cache.get(token_hash)
+    if device is None:
+        sb = get_sb()
+        res = sb.table("companion_devices").select("*").eq("device_token_hash", token_hash).limit(1).execute()
+        device = _first_or_none(res)
+        if not device:
+            return None
+        _device_token_cache.set(token_hash, device)
+    return dict(device)
 
 
 def touch_device_heartbeat(device_id: str) -> None:
-    sb = get_sb()
-    sb.table("companion_devices").update({
-        "status": "online",
-        "last_heartbeat": _now_iso(),
-    }).eq("id", device_id).execute()
+    _touches.touch("companion_devices", device_id, column="last_heartbeat", at=_touch_at(), status="online")
+
+
+def flush_pending_touches() -> int:
+    """
+    Write buffered last_used_at / last_heartbeat touches, one UPDATE per group and
+    timestamp, and buffered command lease extensions. Returns rows written.
+    """
+    written = _flush_pending_leases()
+    groups = _touches.drain()
+    if not groups:
+        return written
+    sb = get_sb()
+    failed = []
+    for table, column, values, rows in groups:
+        by_at: dict[str, list[str]] = {}
+        for row_id, at in rows.items():
+            by_at.setdefault(at, []).append(row_id)
+        for at, ids in by_at.items():
+            ids.sort()
+            for i in range(0, len(ids), _TOUCH_FLUSH_CHUNK):
+                chunk = ids[i:i + _TOUCH_FLUSH_CHUNK]
+                try:
+                    sb.table(table).update({**values, column: at}).in_("id", chunk).execute()
+                    written += len(chunk)
+                except Exception as e:
+                    logger.warning("touch flush failed table=%s rows=%s err=%r", table, len(chunk), e)
+                    failed.append((table, column, values, {r: at for r in chunk}))
+    if failed:
+        _touches.restore(failed)
+    return written
 
 
 def list_devices_for_user(user_id: str) -> list[dict]:
@@ -1488,4 +2231,8 @@ def delete_user_history(user_id: str) -> dict:
     """
     sb = get_sb()
     res = sb.rpc("delete_user_history", {"p_user_id": user_id}).execute()
+    _known_users.pop(user_id)
+    _prefs_cache.pop(user_id)
+    _prefs_bootstrapped.pop(user_id)
+    _changes.bump(*_changes.SCOPES, user_id=user_id)
     return res.data if res.data else {}
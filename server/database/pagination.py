@@ -0,0 +1,77 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/database/pagination.py
+"""
+Keyset (cursor) pagination and delta-sync helpers for list endpoints.
+
+Lists are read newest-first on (<column> DESC, id DESC); a cursor is the
+(<column>, id) of the last row a client has seen, encoded as an opaque url-safe
+token, and the next page is "rows strictly past the cursor". PostgREST serves
+that from the (user_id, <column>) index however deep the client pages, unlike
+OFFSET.
+
+Delta mode (`updated_since`) instead returns rows with updated_at >= since in
+ascending (updated_at, id) order, paged the same way, so a client can apply
+changes in order and resume from the last cursor.
+"""
+
+import base64
+import json
+
+
+def encode_cursor(sort_value: str, row_id: str) -> str:
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Inverse of encode_cursor(); raises ValueError for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(sort_value, str) or not isinstance(row_id, str):
+        raise ValueError("Invalid cursor")
+    return sort_value, row_id
+
+
+def _quote(value: str) -> str:
+    # Values inside or=(...) containing , . : ( ) must be double-quoted.
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def keyset_filter(cursor: str, *, column: str = "created_at", descending: bool = True) -> str:
+    """PostgREST `or` expression selecting rows past `cursor` in (column, id) order."""
+    sort_value, row_id = decode_cursor(cursor)
+    op = "lt" if descending else "gt"
+    value, rid = _quote(sort_value), _quote(row_id)
+    return f"{column}.{op}.{value},and({column}.eq.{value},id.{op}.{rid})"
+
+
+def sort_column(column: str, updated_since: str | None) -> str:
+    """The column a list is ordered by: `column` normally, updated_at in delta mode."""
+    return "updated_at" if updated_since else column
+
+
+def apply(query, *, column: str = "created_at", cursor: str | None = None,
+          updated_since: str | None = None, limit: int | None = None):
+    """Add delta filter, keyset filter, ordering and limit to a PostgREST select."""
+    descending = not updated_since
+    column = sort_column(column, updated_since)
+    if updated_since:
+        query = query.gte("updated_at", updated_since)
+    if cursor:
+        query = query.or_(keyset_filter(cursor, column=column, descending=descending))
+    query = query.order(column, desc=descending).order("id", desc=descending)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def next_cursor(rows: list[dict], limit: int, column: str = "created_at") -> str | None:
+    """Cursor for the page after `rows`, or None when this page was the last one."""
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor(str(last[column]), str(last["id"]))
@@ -10,6 +10,7 @@ from __future__ import annotations
 import json
 import os
 import sqlite3
+import threading
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
@@ -25,14 +26,42 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+# One connection per thread (sqlite3 connections are not shareable across threads by
+# default), reused for the life of the thread so its statement cache stays warm.
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready: set[str] = set()
+
+
 def _conn() -> sqlite3.Connection:
-    path = _sidecar_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    c = sqlite3.connect(str(path))
+    """Return this thread's connection to the sidecar DB, opening it on first use.
+
+    Use as `with _conn() as c:`; the block is one transaction (commit on success,
+    rollback on error). The connection itself stays open.
+    """
+    path = str(_sidecar_path())
+    c = getattr(_local, "conn", None)
+    if c is not None and _local.path == path:
+        return c
+    if c is not None:
+        c.close()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    c = sqlite3.connect(path, timeout=5.0, cached_statements=256)
     c.row_factory = sqlite3.Row
+    c.execute("PRAGMA synchronous=NORMAL")
+    _ensure_schema(c, path)
+    _local.conn, _local.path = c, path
     return c
 
 
+def close_connection() -> None:
+    """Close the calling thread's connection (it is reopened on next use)."""
+    c = getattr(_local, "conn", None)
+    if c is not None:
+        c.close()
+        _local.conn = _local.path = None
+
+
 def _init(c: sqlite3.Connection) -> None:
     c.executescript(
         """
@@ -70,17 +99,24 @@ def _init(c: sqlite3.Connection) -> None:
         );
         """
     )
-    c.commit()
 
 
-def _ensure(c: sqlite3.Connection) -> None:
-    _init(c)
-    cols = {
-        r["name"] for r in c.execute("PRAGMA table_info(command_risk)").fetchall()
-    }
-    if "plain_summary" not in cols:
-        c.execute("ALTER TABLE command_risk ADD COLUMN plain_summary TEXT")
+def _ensure_schema(c: sqlite3.Connection, path: str) -> None:
+    """Create/migrate the schema and switch to WAL, once per DB file per process."""
+    if path in _schema_ready:
+        return
+    with _schema_lock:
+        if path in _schema_ready:
+            return
+        c.execute("PRAGMA journal_mode=WAL")
+        _init(c)
+        cols = {
+            r["name"] for r in c.execute("PRAGMA table_info(command_risk)").fetchall()
+        }
+        if "plain_summary" not in cols:
+            c.execute("ALTER TABLE command_risk ADD COLUMN plain_summary TEXT")
         c.commit()
+        _schema_ready.add(path)
 
 
 def _project_key(project_id: str | None) -> str:
@@ -110,7 +146,6 @@ def add_conversation_turn(
         "created_at": _now_iso(),
     }
     with _conn() as c:
-        _ensure(c)
         c.execute(
             """INSERT INTO conversation_turns
             (id, user_id, project_id, session_id, command_id, role, turn_type, content, created_at)
@@ -127,13 +162,11 @@ def add_conversation_turn(
                 row["created_at"],
             ),
         )
-        c.commit()
     return row
 
 
 def list_conversation_turns_for_user(*, user_id: str, project_id: str | None = None, limit: int = 100) -> list[dict]:
     with _conn() as c:
-        _ensure(c)
         if project_id is not None:
             cur = c.execute(
                 """SELECT * FROM conversation_turns WHERE user_id = ? AND project_id = ?
@@ -152,7 +185,6 @@ def list_conversation_turns_for_user(*, user_id: str, project_id: str | None = N
 def get_conversation_state(*, user_id: str, project_id: str | None) -> dict | None:
     pk = _project_key(project_id)
     with _conn() as c:
-        _ensure(c)
         cur = c.execute(
             "SELECT * FROM conversation_state WHERE user_id = ? AND project_id = ?",
             (user_id, pk),
@@ -177,7 +209,6 @@ def upsert_conversation_state(
     ctx = json.dumps(context_json or {})
     now = _now_iso()
     with _conn() as c:
-        _ensure(c)
         c.execute(
             """INSERT INTO conversation_state (user_id, project_id, state, active_command_id, context_json, updated_at)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -188,7 +219,6 @@ def upsert_conversation_state(
               updated_at = excluded.updated_at""",
             (user_id, pk, state, active_command_id, ctx, now),
         )
-        c.commit()
     out = get_conversation_state(user_id=user_id, project_id=project_id)
     return out or {
         "id": f"{user_id}:{pk}",
@@ -214,7 +244,6 @@ def set_command_risk(
         level = "WARNING"
     now = _now_iso()
     with _conn() as c:
-        _ensure(c)
         c.execute(
             """INSERT INTO command_risk (command_id, user_id, risk_level, risk_reason, plain_summary, updated_at)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -226,7 +255,6 @@ def set_command_risk(
               user_id = excluded.user_id""",
             (command_id, user_id, level, risk_reason, plain_summary, now),
         )
-        c.commit()
 
 
 def reset_command_risk_pending(*, command_id: str, user_id: str) -> None:
@@ -241,19 +269,55 @@ def reset_command_risk_pending(*, command_id: str, user_id: str) -> None:
 
 def get_command_risk(command_id: str) -> dict | None:
     with _conn() as c:
-        _ensure(c)
         cur = c.execute("SELECT * FROM command_risk WHERE command_id = ?", (command_id,))
         r = cur.fetchone()
     return dict(r) if r else None
 
 
-def enrich_command(cmd: dict | None) -> dict | None:
-    if not cmd:
-        return None
-    cid = cmd.get("id")
-    if not cid:
-        return cmd
-    r = get_command_risk(cid)
+# Stay well under SQLITE_MAX_VARIABLE_NUMBER (999 on older builds).
+_IN_CHUNK = 500
+
+
+def get_command_risks(command_ids: list[str]) -> dict[str, dict]:
+    """Risk rows for many commands in one query per chunk, keyed by command_id."""
+    ids = list(dict.fromkeys(cid for cid in command_ids if cid))
+    out: dict[str, dict] = {}
+    if not ids:
+        return out
+    with _conn() as c:
+        for i in range(0, len(ids), _IN_CHUNK):
+            chunk = ids[i:i + _IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cur = c.execute(f"SELECT * FROM command_risk WHERE command_id IN ({placeholders})", chunk)
+            for r in cur.fetchall():
+                out[r["command_id"]] = dict(r)
+    return out
+
+
+def delete_project_data(*, project_id: str, command_ids: list[str]) -> dict[str, int]:
+    """Purge a deleted project's turns, dialogue state and command risk rows in one transaction."""
+    ids = list(dict.fromkeys(cid for cid in command_ids if cid))
+    counts = {"conversation_turns": 0, "conversation_state": 0, "command_risk": 0}
+    with _conn() as c:
+        counts["conversation_turns"] += c.execute(
+            "DELETE FROM conversation_turns WHERE project_id = ?", (project_id,)
+        ).rowcount
+        counts["conversation_state"] += c.execute(
+            "DELETE FROM conversation_state WHERE project_id = ?", (project_id,)
+        ).rowcount
+        for i in range(0, len(ids), _IN_CHUNK):
+            chunk = ids[i:i + _IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            counts["conversation_turns"] += c.execute(
+                f"DELETE FROM conversation_turns WHERE command_id IN ({placeholders})", chunk
+            ).rowcount
+            counts["command_risk"] += c.execute(
+                f"DELETE FROM command_risk WHERE command_id IN ({placeholders})", chunk
+            ).rowcount
+    return counts
+
+
+def _with_risk(cmd: dict, r: dict | None) -> dict:
     if r:
         return {
             **cmd,
@@ -264,9 +328,21 @@ def enrich_command(cmd: dict | None) -> dict | None:
     return {**cmd, "risk_level": "PENDING", "risk_reason": None, "plain_summary": None}
 
 
+def enrich_command(cmd: dict | None) -> dict | None:
+    if not cmd:
+        return None
+    cid = cmd.get("id")
+    if not cid:
+        return cmd
+    return _with_risk(cmd, get_command_risk(cid))
+
+
 def enrich_commands(commands: list[dict]) -> list[dict]:
+    risks = get_command_risks([c.get("id") for c in commands if c])
     out: list[dict] = []
     for c in commands:
-        enriched = enrich_command(dict(c))
-        out.append(enriched if enriched is not None else c)
+        if not c or not c.get("id"):
+            out.append(c)
+            continue
+        out.append(_with_risk(dict(c), risks.get(c["id"])))
     return out
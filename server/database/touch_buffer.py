@@ -0,0 +1,64 @@
+# server/database/touch_buffer.py
+"""
+Write-behind buffer for "last seen" timestamps.
+
+Agents and companion devices bump `last_used_at` / `last_heartbeat` on nearly
+every request. Those writes only need to be roughly fresh, so they are recorded
+here and written out in one UPDATE ... WHERE id IN (...) per (table, column,
+extra values) group by database.models.flush_pending_touches().
+"""
+from __future__ import annotations
+
+import threading
+from typing import Iterable
+
+# (table, column, frozenset of extra column values) -> {row_id: iso timestamp}
+GroupKey = tuple
+
+
+class TouchBuffer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: dict[GroupKey, dict[str, str]] = {}
+
+    def touch(self, table: str, row_id: str, *, column: str, at: str, **values) -> None:
+        """Record that `row_id` was seen at `at`; later touches of the same row win."""
+        key = (table, column, frozenset(values.items()))
+        with self._lock:
+            for other_key, rows in self._pending.items():
+                if other_key[0] == table and other_key != key:
+                    rows.pop(row_id, None)
+            bucket = self._pending.setdefault(key, {})
+            if at > bucket.get(row_id, ""):
+                bucket[row_id] = at
+
+    def discard(self, table: str, row_id: str) -> None:
+        """Forget pending touches for a row, e.g. before a direct write of the same columns."""
+        with self._lock:
+            for (t, _, _), rows in self._pending.items():
+                if t == table:
+                    rows.pop(row_id, None)
+
+    def drain(self) -> list[tuple[str, str, dict, dict[str, str]]]:
+        """Take everything pending as (table, column, extra values, {row_id: at}) groups."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [(t, c, dict(v), rows) for (t, c, v), rows in pending.items() if rows]
+
+    def restore(self, groups: Iterable[tuple[str, str, dict, dict[str, str]]]) -> None:
+        """Put groups back after a failed flush without clobbering newer touches."""
+        for table, column, values, rows in groups:
+            for row_id, at in rows.items():
+                key = (table, column, frozenset(values.items()))
+                with self._lock:
+                    if any(row_id in r for k, r in self._pending.items() if k[0] == table):
+                        continue
+                    self._pending.setdefault(key, {})[row_id] = at
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(rows) for rows in self._pending.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
@@ -0,0 +1,97 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/database/unit_of_work.py
+"""
+Request-scoped identity map for calls made through database.async_models.
+
+A single /transcribe request reads the user's project list up to three times
+and re-reads preferences along the way. Inside a unit of work, reads marked
+@memoized hit PostgREST once per distinct argument tuple. Any other call made
+through async_models counts as a write and evicts cached reads:
+
+  - @writes("projects", ...) evicts only reads that touch one of those tables
+  - a call with no marker (including test doubles) evicts everything
+
+The request middleware in main.py opens one unit of work per HTTP request;
+outside of one (background tasks, scripts, streaming bodies after the response
+has started) every call goes straight to the database.
+"""
+
+import contextvars
+import copy
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator
+
+_current: contextvars.ContextVar[UnitOfWork | None] = contextvars.ContextVar("dispatch_unit_of_work", default=None)
+
+
+def memoized(*tables: str) -> Callable:
+    """Mark a pure read over `tables` as safe to serve from the request's identity map."""
+    def mark(fn: Callable) -> Callable:
+        fn._uow = ("read", frozenset(tables))
+        return fn
+    return mark
+
+
+def writes(*tables: str) -> Callable:
+    """Mark a call that modifies `tables`; cached reads over other tables survive it."""
+    def mark(fn: Callable) -> Callable:
+        fn._uow = ("write", frozenset(tables))
+        return fn
+    return mark
+
+
+class UnitOfWork:
+    def __init__(self) -> None:
+        self._entries: dict[tuple, tuple[frozenset, Any]] = {}
+        # Bumped by every write, so a read that raced one is not stored.
+        self._generation = 0
+        self.closed = False
+        self.hits = 0
+
+    def invalidate(self, tables: frozenset | None = None) -> None:
+        self._generation += 1
+        if tables is None:
+            self._entries.clear()
+        elif tables:
+            self._entries = {k: v for k, v in self._entries.items() if not (v[0] & tables)}
+
+    async def call(self, fn: Callable, invoke: Callable[[], Awaitable[Any]], args: tuple, kwargs: dict) -> Any:
+        mark = getattr(fn, "_uow", None)
+        kind, tables = mark if isinstance(mark, tuple) else (None, None)
+        if kind != "read":
+            try:
+                return await invoke()
+            finally:
+                self.invalidate(tables if kind == "write" else None)
+
+        key = (getattr(fn, "__module__", None), getattr(fn, "__qualname__", repr(fn)), args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return await invoke()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+        generation = self._generation
+        value = await invoke()
+        if generation == self._generation and not self.closed:
+            self._entries[key] = (tables, copy.deepcopy(value))
+        return value
+
+
+def current() -> UnitOfWork | None:
+    uow = _current.get()
+    return None if uow is None or uow.closed else uow
+
+
+@contextmanager
+def begin() -> Iterator[UnitOfWork]:
+    uow = UnitOfWork()
+    token = _current.set(uow)
+    try:
+        yield uow
+    finally:
+        uow.closed = True
+        _current.reset(token)
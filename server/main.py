@@ -8,17 +8,18 @@ import threading
 import time
 import uuid
 import re
+from contextlib import asynccontextmanager
 from typing import Annotated, Union, Optional, Literal
 from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Depends, BackgroundTasks
 from fastapi import Response, Request
+from fastapi.responses import StreamingResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi.middleware.cors import CORSMiddleware
 from services.transcription import transcribe_file
-from supabase import create_client, Client
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timezone
 
 # NEW: load server/.env when running locally (uvicorn doesn't auto-load it)
 try:
@@ -98,13 +99,91 @@ if DEVELOPMENT_MODE:
 
 # --- LOCAL IMPORTS ---
 from database import models
+from database import async_models as adb
+from database import command_events
+from database import unit_of_work
+from database import pagination
+from database import change_counter
 from services.llm import parse_intent
 from services import phone_verification
+from services.auth_verifier import AuthError, TokenVerifier
+from services import log_stream
+from services.request_decompression import GzipRequestMiddleware
 from services.telegram import send_telegram_message
 from agents.dispatcher import dispatch_task as agent_dispatch_task
 from agents.dispatcher import set_terminal_access, get_terminal_access
 
-app = FastAPI(title="Dispatch API")
+# Agent/device "last seen" writes are buffered in models and written out on this cadence.
+TOUCH_FLUSH_SECONDS = float(os.environ.get("DISPATCH_TOUCH_FLUSH_SECONDS", "5"))
+
+
+# Commands whose lease ran out are requeued or failed by this periodic sweep, not by claims.
+REAPER_INTERVAL_SECONDS = float(os.environ.get("DISPATCH_REAPER_INTERVAL_SECONDS", "30"))
+
+# Finished commands' log chunks are compacted (and old output dropped) on this cadence.
+LOG_COMPACTION_INTERVAL_SECONDS = float(os.environ.get("DISPATCH_LOG_COMPACTION_INTERVAL_SECONDS", "300"))
+
+
+async def _flush_touches_forever() -> None:
+    while True:
+        await asyncio.sleep(TOUCH_FLUSH_SECONDS)
+        try:
+            await adb.run(models.flush_pending_touches)
+        except Exception as e:
+            logger.warning("touch flush error err=%r", e)
+
+
+async def _reap_stale_commands_forever() -> None:
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+        try:
+            expired = await adb.run(models.expire_stale_running_commands)
+        except Exception as e:
+            logger.warning("stale command reaper error err=%r", e)
+            continue
+        for row in expired:
+            if row.get("status") != "queued":
+                log_stream.get_hub().publish_complete(row["id"], status="failed", exit_code=-1)
+
+
+async def _compact_logs_forever() -> None:
+    while True:
+        await asyncio.sleep(LOG_COMPACTION_INTERVAL_SECONDS)
+        try:
+            # Drain the backlog one bounded batch at a time.
+            while True:
+                counts = await adb.run(models.compact_terminal_logs)
+                if counts["compacted"] + counts["dropped"] < models.LOG_COMPACT_BATCH:
+                    break
+        except Exception as e:
+            logger.warning("log compaction error err=%r", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background = [
+        asyncio.create_task(_flush_touches_forever()),
+        asyncio.create_task(_reap_stale_commands_forever()),
+        asyncio.create_task(_compact_logs_forever()),
+    ]
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        for task in background:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await adb.run(models.flush_pending_touches)
+        except Exception as e:
+            logger.warning("final touch flush error err=%r", e)
+        adb.shutdown(wait=False)
+
+
+app = FastAPI(title="Dispatch API", lifespan=lifespan)
 
 # --- RATE LIMITING ---
 limiter = Limiter(key_func=get_remote_address)
@@ -114,6 +193,13 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 # --- CONFIG ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL") or os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_SERVICE_KEY") or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+# Safety re-poll for claim-next long-polls; normal wake-ups come from command events.
+CLAIM_REPOLL_SECONDS = float(os.environ.get("DISPATCH_CLAIM_REPOLL_SECONDS", "10"))
+# Upper bound on command ids accepted per heartbeat (one UPDATE ... WHERE id IN (...)).
+MAX_HEARTBEAT_COMMANDS = 64
+# Live log streams re-check the DB after this long without a local publish (keepalive +
+# catch-up for output appended through another worker).
+LOG_STREAM_IDLE_SECONDS = float(os.environ.get("DISPATCH_LOG_STREAM_IDLE_SECONDS", "5"))
 
 logger.info(
     "startup env development=%s supabase_url_set=%s service_key_set=%s",
@@ -128,7 +214,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Log-Total-Chunks", "X-Log-Total-Bytes"],
 )
+# The local agent gzips large log uploads.
+app.add_middleware(GzipRequestMiddleware)
 
 # --- 1. DATABASE (Supabase — no local init needed) ---
 
@@ -178,10 +267,32 @@ async def request_trace_middleware(request, call_next):
     response.headers["x-request-id"] = request_id
     return response
 
+
+@app.middleware("http")
+async def unit_of_work_middleware(request, call_next):
+    # Repeated model reads within one request are served once; see database/unit_of_work.py.
+    with unit_of_work.begin():
+        return await call_next(request)
+
 # --- 3. SECURITY ---
+_auth_verifier: TokenVerifier | None = None
+
+
+def _get_auth_verifier() -> TokenVerifier:
+    global _auth_verifier
+    if _auth_verifier is None:
+        _auth_verifier = TokenVerifier(
+            supabase_url=SUPABASE_URL,
+            service_key=SUPABASE_SERVICE_KEY,
+            jwt_secret=os.environ.get("SUPABASE_JWT_SECRET"),
+        )
+    return _auth_verifier
+
+
 def get_current_user(authorization: Annotated[Union[str, None], Header()] = None):
     """
-    Validates the Supabase JWT. Returns the Supabase User object.
+    Validates the Supabase JWT (locally when possible, see services/auth_verifier.py).
+    Returns an AuthenticatedUser with id/email/phone.
     In DEVELOPMENT_MODE: if a JWT is provided, use it; otherwise fall back to a mock user.
     """
     # If a real token is present, always honor it (even in dev mode)
@@ -195,16 +306,13 @@ def get_current_user(authorization: Annotated[Union[str, None], Header()] = None
                 detail="Supabase server env not configured (SUPABASE_URL/SUPABASE_SERVICE_KEY). Check server/.env loading.",
             )
 
+        if " " in authorization:
+            token = authorization.split(" ")[1]
+        else:
+            token = authorization
         try:
-            if " " in authorization:
-                token = authorization.split(" ")[1]
-            else:
-                token = authorization
-            supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-            user_response = supabase.auth.get_user(token)
-            u = user_response.user
-            return u
-        except Exception as e:
+            return _get_auth_verifier().verify(token)
+        except AuthError as e:
             logger.warning("supabase auth failed err=%r", e)
             raise HTTPException(status_code=401, detail="Invalid or Expired Token")
 
@@ -269,6 +377,8 @@ class RegisterLocalAgentRequest(BaseModel):
 class LocalAgentHeartbeatRequest(BaseModel):
     instance_id: str
     status: str = "online"
+    # Commands this agent is still executing; renews their leases.
+    running_command_ids: list[str] = []
 
 class CreateTerminalSessionRequest(BaseModel):
     project_id: str
@@ -350,6 +460,7 @@ class DeviceProjectLinkByNameRequest(BaseModel):
 
 class DeviceHeartbeatRequest(BaseModel):
     device_id: str
+    running_command_ids: list[str] = []
 
 
 class DeviceClaimRequest(BaseModel):
@@ -416,6 +527,59 @@ def _require_user_match(path_user_id: str, user_id: str) -> None:
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
+def _require_valid_cursor(cursor: str | None) -> None:
+    """Reject pagination cursors we did not issue. Raises 400 otherwise."""
+    if cursor:
+        try:
+            pagination.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _parse_updated_since(updated_since: str | None) -> str | None:
+    """Normalize an ISO-8601 `updated_since` to UTC. Raises 400 if it is not a timestamp."""
+    if not updated_since:
+        return None
+    # An unencoded "+00:00" arrives as " 00:00"; accept a trailing Z as well.
+    raw = updated_since.strip().replace(" ", "+").replace("Z", "+00:00")
+    try:
+        ts = datetime.fromisoformat(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid updated_since")
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat()
+
+
+def _page_info(rows: list[dict], limit: int, column: str, updated_since: str | None, synced_at: str) -> dict:
+    """next_cursor for the following page; synced_at is the next updated_since for delta clients."""
+    return {
+        "next_cursor": pagination.next_cursor(rows, limit, pagination.sort_column(column, updated_since)),
+        "synced_at": synced_at,
+    }
+
+
+async def _renew_lease(user_id: str, command_id: str) -> dict:
+    """Extend a running command's lease. Raises 409 once the agent no longer holds it."""
+    renewed = await adb.renew_command_leases(user_id=user_id, command_ids=[command_id])
+    if command_id not in renewed:
+        raise HTTPException(status_code=409, detail="Command is not running")
+    return {"success": True, "command_id": command_id, "lease_seconds": models.COMMAND_LEASE_SECONDS}
+
+
+def _not_modified(request: Request, response: Response, user_id: str, scopes: tuple[str, ...]) -> Response | None:
+    """
+    Set this view's ETag on `response`. Returns a bare 304 when If-None-Match already
+    carries it, before any database read; see database/change_counter.py.
+    """
+    tag = change_counter.etag(user_id, scopes, request.url.path, sorted(request.query_params.multi_items()))
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if change_counter.matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 def _require_device_owner(user_id: str, device_id: str) -> dict:
     """Fetch a device and assert it belongs to the authenticated user. Raises 404 otherwise."""
     devices = models.list_devices_for_user(user_id)
@@ -507,7 +671,7 @@ async def _background_security_scan(command_id: str, user_prompt: str, normalize
         risk_level = result["risk_level"]
         risk_reason = result["risk_reason"]
         plain_summary = result.get("plain_summary")
-        models.update_command_risk_assessment(
+        await adb.update_command_risk_assessment(
             command_id=command_id,
             risk_level=risk_level,
             risk_reason=risk_reason,
@@ -515,12 +679,12 @@ async def _background_security_scan(command_id: str, user_prompt: str, normalize
         )
         # Preserve old "safe command runs" behavior: auto-queue only when still awaiting approval.
         if (risk_level or "").strip().upper() == "SAFE":
-            cmd = models.get_terminal_command(command_id)
+            cmd = await adb.get_terminal_command(command_id)
             if cmd and cmd.get("status") == "pending_approval":
-                updated = models.update_terminal_command_for_approval(command_id=command_id, status="queued")
-                session = models.get_terminal_session(cmd["session_id"]) if cmd.get("session_id") else None
+                updated = await adb.update_terminal_command_for_approval(command_id=command_id, status="queued")
+                session = await adb.get_terminal_session(cmd["session_id"]) if cmd.get("session_id") else None
                 project_id = session.get("project_id") if session else None
-                models.add_conversation_turn(
+                await adb.add_conversation_turn(
                     user_id=cmd.get("user_id"),
                     project_id=project_id,
                     session_id=cmd.get("session_id"),
@@ -529,7 +693,7 @@ async def _background_security_scan(command_id: str, user_prompt: str, normalize
                     turn_type="approval_result",
                     content="Security scan marked this command safe. Running now.",
                 )
-                models.upsert_conversation_state(
+                await adb.upsert_conversation_state(
                     user_id=cmd.get("user_id"),
                     project_id=project_id,
                     state="idle",
@@ -540,7 +704,7 @@ async def _background_security_scan(command_id: str, user_prompt: str, normalize
     except Exception:
         logger.exception("security scan failed command_id=%s", command_id)
         try:
-            models.update_command_risk_assessment(
+            await adb.update_command_risk_assessment(
                 command_id=command_id,
                 risk_level="WARNING",
                 risk_reason="Security scan failed; review manually before approving.",
@@ -551,38 +715,38 @@ async def _background_security_scan(command_id: str, user_prompt: str, normalize
 
 @app.post("/api/settings/agent-tokens")
 async def create_agent_token(request: CreateAgentTokenRequest, user: dict = Depends(get_current_user)):
-    models.upsert_user(user_id=user.id, email=getattr(user, "email", None) or f"{user.id}@local", phone_number=getattr(user, "phone", None))
-    token = models.create_agent_token(user_id=user.id, label=request.label)
+    await adb.upsert_user(user_id=user.id, email=getattr(user, "email", None) or f"{user.id}@local", phone_number=getattr(user, "phone", None))
+    token = await adb.create_agent_token(user_id=user.id, label=request.label)
     return {"success": True, **token}
 
 
 @app.get("/api/settings/agent-tokens")
 async def list_agent_tokens(user: dict = Depends(get_current_user)):
-    tokens = models.list_agent_tokens(user_id=user.id)
+    tokens = await adb.list_agent_tokens(user_id=user.id)
     return {"success": True, "tokens": tokens}
 
 
 @app.delete("/api/settings/agent-tokens/{token_id}")
 async def revoke_agent_token(token_id: str, user: dict = Depends(get_current_user)):
-    models.revoke_agent_token(user_id=user.id, token_id=token_id)
+    await adb.revoke_agent_token(user_id=user.id, token_id=token_id)
     return {"success": True}
 
 
 @app.delete("/api/settings/history")
 async def delete_history(user: dict = Depends(get_current_user)):
-    counts = models.delete_user_history(user_id=user.id)
+    counts = await adb.delete_user_history(user_id=user.id)
     return {"success": True, "deleted": counts}
 
 
 @app.get("/api/settings/provider")
 async def get_provider_preference(user: dict = Depends(get_current_user)):
     # Ensure a users row exists so user_preferences FK constraints are satisfied.
-    models.upsert_user(
+    await adb.upsert_user(
         user_id=user.id,
         email=getattr(user, "email", None) or f"{user.id}@local",
         phone_number=getattr(user, "phone", None),
     )
-    provider = models.get_default_provider_for_user(user.id)
+    provider = await adb.get_default_provider_for_user(user.id)
     return {"success": True, "provider": provider}
 
 
@@ -591,18 +755,18 @@ async def set_provider_preference(
     request: UpdateProviderPreferenceRequest,
     user: dict = Depends(get_current_user),
 ):
-    models.upsert_user(
+    await adb.upsert_user(
         user_id=user.id,
         email=getattr(user, "email", None) or f"{user.id}@local",
         phone_number=getattr(user, "phone", None),
     )
-    models.set_default_provider_for_user(user.id, request.provider)
+    await adb.set_default_provider_for_user(user.id, request.provider)
     return {"success": True, "provider": request.provider}
 
 
 @app.get("/api/settings/project-base-path")
 async def get_project_base_path(user: dict = Depends(get_current_user)):
-    return {"success": True, "base_path": models.get_project_base_path_for_user(user.id)}
+    return {"success": True, "base_path": await adb.get_project_base_path_for_user(user.id)}
 
 
 @app.put("/api/settings/project-base-path")
@@ -610,8 +774,8 @@ async def set_project_base_path(
     request: UpdateProjectBasePathRequest,
     user: dict = Depends(get_current_user),
 ):
-    models.set_project_base_path_for_user(user.id, request.base_path)
-    return {"success": True, "base_path": models.get_project_base_path_for_user(user.id)}
+    await adb.set_project_base_path_for_user(user.id, request.base_path)
+    return {"success": True, "base_path": await adb.get_project_base_path_for_user(user.id)}
 
 
 @app.put("/api/settings/project-base-path")
@@ -619,8 +783,8 @@ async def set_project_base_path(
     request: UpdateProjectBasePathRequest,
     user: dict = Depends(get_current_user),
 ):
-    models.set_project_base_path_for_user(user.id, request.base_path)
-    return {"success": True, "base_path": models.get_project_base_path_for_user(user.id)}
+    await adb.set_project_base_path_for_user(user.id, request.base_path)
+    return {"success": True, "base_path": await adb.get_project_base_path_for_user(user.id)}
 
 
 import re as _re
@@ -647,7 +811,7 @@ async def verify_otp(request: VerifyOtpRequest, user: dict = Depends(get_current
     if not approved:
         return {"success": False, "error": "Invalid or expired verification code"}
     try:
-        models.update_user_phone_number(user.id, request.phone_number)
+        await adb.update_user_phone_number(user.id, request.phone_number)
     except ValueError as e:
         return {"success": False, "error": str(e)}
     return {"success": True}
@@ -655,24 +819,24 @@ async def verify_otp(request: VerifyOtpRequest, user: dict = Depends(get_current
 
 @app.get("/api/phone/status")
 async def phone_status(user: dict = Depends(get_current_user)):
-    phone_number = models.get_user_phone_number(user.id)
+    phone_number = await adb.get_user_phone_number(user.id)
     return {"has_phone": bool(phone_number)}
 
 
 @app.post("/api/device/pair/start")
 async def start_device_pairing(request: DevicePairStartRequest, user: dict = Depends(get_current_user)):
-    models.upsert_user(
+    await adb.upsert_user(
         user_id=user.id,
         email=getattr(user, "email", None) or f"{user.id}@local",
         phone_number=getattr(user, "phone", None),
     )
-    pairing = models.create_device_pairing(user_id=user.id, name=request.name, platform=request.platform)
+    pairing = await adb.create_device_pairing(user_id=user.id, name=request.name, platform=request.platform)
     return {"success": True, **pairing}
 
 
 @app.post("/api/device/pair/complete")
 async def complete_device_pairing(request: DevicePairCompleteRequest):
-    result = models.complete_device_pairing(
+    result = await adb.complete_device_pairing(
         pairing_code=request.pairing_code,
         device_name=request.name,
         platform=request.platform,
@@ -682,14 +846,14 @@ async def complete_device_pairing(request: DevicePairCompleteRequest):
 
     user_id = result["user_id"]
     device_id = result["device_id"]
-    user_projects = models.get_user_projects(user_id)
-    base_path = models.get_project_base_path_for_user(user_id)
+    user_projects = await adb.get_user_projects(user_id)
+    base_path = await adb.get_project_base_path_for_user(user_id)
     for proj in user_projects:
         local_path = proj.get("file_path") or models.compute_default_project_file_path(base_path, proj.get("name") or "")
         if local_path:
-            models.link_device_project(device_id=device_id, project_id=proj["id"], local_path=local_path)
+            await adb.link_device_project(device_id=device_id, project_id=proj["id"], local_path=local_path)
         else:
-            models.link_device_project(device_id=device_id, project_id=proj["id"])
+            await adb.link_device_project(device_id=device_id, project_id=proj["id"])
     logger.info(
         "device paired device_id=%s user_id=%s auto_linked_projects=%s",
         device_id, user_id, len(user_projects),
@@ -699,7 +863,7 @@ async def complete_device_pairing(request: DevicePairCompleteRequest):
 
 @app.get("/api/device")
 async def list_user_devices(user: dict = Depends(get_current_user)):
-    return {"success": True, "devices": models.list_devices_for_user(user.id)}
+    return {"success": True, "devices": await adb.list_devices_for_user(user.id)}
 
 
 @app.post("/api/device/{device_id}/projects")
@@ -708,9 +872,9 @@ async def link_device_to_project(
     request: DeviceProjectLinkRequest,
     user: dict = Depends(get_current_user),
 ):
-    _require_device_owner(user.id, device_id)
-    _require_project_owner(user.id, request.project_id)
-    linked = models.link_device_project(
+    await adb.run(_require_device_owner, user.id, device_id)
+    await adb.run(_require_project_owner, user.id, request.project_id)
+    linked = await adb.link_device_project(
         device_id=device_id,
         project_id=request.project_id,
         local_path=request.local_path,
@@ -720,19 +884,19 @@ async def link_device_to_project(
 
 @app.get("/api/device/{device_id}/projects")
 async def list_device_projects(device_id: str, user: dict = Depends(get_current_user)):
-    _require_device_owner(user.id, device_id)
-    return {"success": True, "links": models.get_device_project_links(device_id)}
+    await adb.run(_require_device_owner, user.id, device_id)
+    return {"success": True, "links": await adb.get_device_project_links(device_id)}
 
 
 @app.get("/api/device/my-projects")
 async def list_my_device_projects(device: dict = Depends(get_current_device)):
     """Device-token authenticated: returns project links for the calling device."""
-    return {"success": True, "links": models.get_device_project_links(device["id"])}
+    return {"success": True, "links": await adb.get_device_project_links(device["id"])}
 
 
 @app.get("/api/device/settings/project-base-path")
 async def get_device_project_base_path(device: dict = Depends(get_current_device)):
-    return {"success": True, "base_path": models.get_project_base_path_for_user(device["user_id"])}
+    return {"success": True, "base_path": await adb.get_project_base_path_for_user(device["user_id"])}
 
 
 @app.put("/api/device/settings/project-base-path")
@@ -740,8 +904,8 @@ async def set_device_project_base_path(
     request: UpdateProjectBasePathRequest,
     device: dict = Depends(get_current_device),
 ):
-    models.set_project_base_path_for_user(device["user_id"], request.base_path)
-    return {"success": True, "base_path": models.get_project_base_path_for_user(device["user_id"])}
+    await adb.set_project_base_path_for_user(device["user_id"], request.base_path)
+    return {"success": True, "base_path": await adb.get_project_base_path_for_user(device["user_id"])}
 
 
 @app.post("/api/device/link-project")
@@ -761,12 +925,12 @@ async def link_project_for_current_device(
     if not local_path:
         raise HTTPException(status_code=400, detail="local_path is required")
 
-    project = models.upsert_project_by_name(
+    project = await adb.upsert_project_by_name(
         user_id=device["user_id"],
         name=project_name,
         file_path=local_path,
     )
-    link = models.link_device_project(
+    link = await adb.link_device_project(
         device_id=device["id"],
         project_id=project["id"],
         local_path=local_path,
@@ -794,7 +958,7 @@ async def transcribe_audio(
         logger.info("transcribe start user_id=%s filename=%s", getattr(user, "id", None), file.filename)
 
         # Ensure a corresponding users row exists (id comes from Supabase)
-        models.upsert_user(
+        await adb.upsert_user(
             user_id=user.id,
             email=getattr(user, "email", None) or f"{user.id}@local",
             phone_number=getattr(user, "phone", None),
@@ -811,7 +975,7 @@ async def transcribe_audio(
         
         # B. Context
         logger.debug("transcribe step=b")
-        user_projects = models.get_user_projects(user.id)
+        user_projects = await adb.get_user_projects(user.id)
         logger.debug("transcribe projects_count=%s", len(user_projects))
         # C. Parse Intent
         logger.debug("transcribe step=c")
@@ -831,7 +995,7 @@ async def transcribe_audio(
         if intent_type == "create_project":
             new_project_name = project_name
             if new_project_name:
-                created["project_id"] = models.create_project(user.id, new_project_name)
+                created["project_id"] = await adb.create_project(user.id, new_project_name)
                 action_result = f"Successfully created project '{new_project_name}'."
                 logger.info("transcribe created_project_id=%s", created["project_id"])
             else:
@@ -840,11 +1004,11 @@ async def transcribe_audio(
         # --- HANDLER: CREATE TASK ---
         elif intent_type == "create_task":
             if project_name and task_description:
-                project = models.get_project_by_name(user.id, project_name)
+                project = await adb.get_project_by_name(user.id, project_name)
                 logger.debug("transcribe project_lookup found=%s", bool(project))
                 if project:
-                    models.touch_project(project["id"])
-                    created["task_id"] = models.create_task(
+                    await adb.touch_project(project["id"])
+                    created["task_id"] = await adb.create_task(
                         project_id=project["id"],
                         user_id=user.id,
                         description=task_description,
@@ -863,7 +1027,7 @@ async def transcribe_audio(
 
         # --- HANDLER: STATUS CHECK ---
         elif intent_type == "status_check":
-            projects_with_counts = models.get_user_projects_with_task_counts(user.id)
+            projects_with_counts = await adb.get_user_projects_with_task_counts(user.id)
             if not projects_with_counts:
                 action_result = "You don't have any projects yet. Try saying 'create a project called my-app'."
             else:
@@ -884,8 +1048,8 @@ async def transcribe_audio(
         # Store audit task (skip for create_project — the project IS the artifact)
         logged_task_id = None
         if intent_type != "create_project":
-            fresh_projects = models.get_user_projects(user.id)
-            logged_task_id = models.log_agent_event_task(
+            fresh_projects = await adb.get_user_projects(user.id)
+            logged_task_id = await adb.log_agent_event_task(
                 user_id=user.id,
                 project_name=project_name,
                 projects=fresh_projects,
@@ -901,7 +1065,7 @@ async def transcribe_audio(
         # --- D. DISPATCH TO AGENT PIPELINE (background) ---
         dispatch_task_id = created.get("task_id") or logged_task_id
         agent_status = None
-        terminal_granted = get_terminal_access(user.id)
+        terminal_granted = await adb.run(get_terminal_access, user.id)
         if intent_type in ("create_task", "create_project", "fix_bug") and dispatch_task_id:
             if background_tasks:
                 background_tasks.add_task(agent_dispatch_task, dispatch_task_id, intent_data, terminal_granted)
@@ -956,7 +1120,7 @@ async def transcribe_text(
             return {"status": "error", "message": "Empty text"}
 
         if body.project_id:
-            state = models.get_conversation_state(user_id=user.id, project_id=request.project_id)
+            state = await adb.get_conversation_state(user_id=user.id, project_id=request.project_id)
             if state and state.get("state") == "awaiting_approval" and state.get("active_command_id"):
                 fake = ContextualReplyRequest(project_id=body.project_id, reply=transcript_text)
                 resolved = await resolve_contextual_reply(fake, user)
@@ -968,13 +1132,13 @@ async def transcribe_text(
                     "resolution": resolved,
                 }
 
-        models.upsert_user(
+        await adb.upsert_user(
             user_id=user.id,
             email=getattr(user, "email", None) or f"{user.id}@local",
             phone_number=getattr(user, "phone", None),
         )
 
-        user_projects = models.get_user_projects(user.id)
+        user_projects = await adb.get_user_projects(user.id)
         intent_data = await parse_intent(transcript_text, user_projects) or {"intent": "unknown"}
 
         intent_type = intent_data.get("intent") or "unknown"
@@ -986,16 +1150,16 @@ async def transcribe_text(
 
         if intent_type == "create_project":
             if project_name:
-                created["project_id"] = models.create_project(user.id, project_name)
+                created["project_id"] = await adb.create_project(user.id, project_name)
                 action_result = f"Successfully created project '{project_name}'."
             else:
                 action_result = "I couldn't determine a project name."
         elif intent_type == "create_task":
             if project_name and task_description:
-                project = models.get_project_by_name(user.id, project_name)
+                project = await adb.get_project_by_name(user.id, project_name)
                 if project:
-                    models.touch_project(project["id"])
-                    created["task_id"] = models.create_task(
+                    await adb.touch_project(project["id"])
+                    created["task_id"] = await adb.create_task(
                         project_id=project["id"], user_id=user.id,
                         description=task_description, voice_command=transcript_text,
                         raw_transcript=transcript_text, intent_type=intent_type,
@@ -1006,7 +1170,7 @@ async def transcribe_text(
             else:
                 action_result = "I couldn't determine the project or task from your command."
         elif intent_type == "status_check":
-            projects_with_counts = models.get_user_projects_with_task_counts(user.id)
+            projects_with_counts = await adb.get_user_projects_with_task_counts(user.id)
             if not projects_with_counts:
                 action_result = "You don't have any projects yet."
             else:
@@ -1020,8 +1184,8 @@ async def transcribe_text(
         # Skip audit log for create_project (the project IS the artifact)
         logged_task_id = None
         if intent_type != "create_project":
-            fresh_projects = models.get_user_projects(user.id)
-            logged_task_id = models.log_agent_event_task(
+            fresh_projects = await adb.get_user_projects(user.id)
+            logged_task_id = await adb.log_agent_event_task(
                 user_id=user.id, project_name=project_name, projects=fresh_projects,
                 description=task_description or f"[{intent_type}] {transcript_text}",
                 raw_transcript=transcript_text, intent_type=intent_type,
@@ -1030,7 +1194,7 @@ async def transcribe_text(
 
         dispatch_task_id = created.get("task_id") or logged_task_id
         agent_status = None
-        terminal_granted = get_terminal_access(user.id)
+        terminal_granted = await adb.run(get_terminal_access, user.id)
         if intent_type in ("create_task", "create_project", "fix_bug") and dispatch_task_id:
             if background_tasks:
                 background_tasks.add_task(agent_dispatch_task, dispatch_task_id, intent_data, terminal_granted)
@@ -1041,7 +1205,7 @@ async def transcribe_text(
             "transcript": transcript_text,
             "intent": intent_data,
             "action_result": action_result,
-            "context_projects_count": len(models.get_user_projects(user.id)),
+            "context_projects_count": len(await adb.get_user_projects(user.id)),
             "created": created,
             "logged_task_id": logged_task_id,
             "agent_status": agent_status,
@@ -1097,13 +1261,13 @@ async def telegram_webhook(
         }
 
         created_user = False
-        user_id = models.get_user_id_by_telegram_chat_id(chat_id)
+        user_id = await adb.get_user_id_by_telegram_chat_id(chat_id)
         if not user_id:
             user_id = TELEGRAM_USER_MAP.get(str(chat_id))
         if not user_id:
             pseudo_user_id = f"tg_{chat_id}"
             pseudo_email = f"tg_{chat_id}@telegram.local"
-            models.upsert_user(
+            await adb.upsert_user(
                 user_id=pseudo_user_id,
                 email=pseudo_email,
                 telegram_chat_id=str(chat_id)
@@ -1137,7 +1301,7 @@ async def telegram_webhook(
         '''
             
         # 2. Re-use the existing transcribe_text logic for intent parsing
-        user_projects = models.get_user_projects(user_id)
+        user_projects = await adb.get_user_projects(user_id)
         intent_data = await parse_intent(text, user_projects) or {"intent": "unknown"}
         intent_type = intent_data.get("intent") or "unknown"
         project_name = intent_data.get("project_name")
@@ -1148,17 +1312,17 @@ async def telegram_webhook(
 
         if intent_type == "create_project":
             if project_name:
-                created["project_id"] = models.create_project(user_id, project_name)
+                created["project_id"] = await adb.create_project(user_id, project_name)
                 action_result = f"Successfully created project '{project_name}'."
             else:
                 action_result = "I couldn't determine a project name."
                 
         elif intent_type == "create_task":
             if project_name and task_description:
-                project = models.get_project_by_name(user_id, project_name)
+                project = await adb.get_project_by_name(user_id, project_name)
                 if project:
-                    models.touch_project(project["id"])
-                    created["task_id"] = models.create_task(
+                    await adb.touch_project(project["id"])
+                    created["task_id"] = await adb.create_task(
                         project_id=project["id"], user_id=user_id,
                         description=task_description, voice_command=text,
                         raw_transcript=text, intent_type=intent_type,
@@ -1170,7 +1334,7 @@ async def telegram_webhook(
                 action_result = "I couldn't determine the project or task from your command."
                 
         elif intent_type == "status_check":
-            projects_with_counts = models.get_user_projects_with_task_counts(user_id)
+            projects_with_counts = await adb.get_user_projects_with_task_counts(user_id)
             if not projects_with_counts:
                 action_result = "You don't have any projects yet."
             else:
@@ -1184,9 +1348,9 @@ async def telegram_webhook(
         # Audit/History
         logged_task_id = None
         if intent_type != "create_project":
-            fresh_projects = models.get_user_projects(user_id)
+            fresh_projects = await adb.get_user_projects(user_id)
             try:
-                logged_task_id = models.log_agent_event_task(
+                logged_task_id = await adb.log_agent_event_task(
                     user_id=user_id, project_name=project_name, projects=fresh_projects,
                     description=task_description or f"[{intent_type}] {text}",
                     raw_transcript=text, intent_type=intent_type,
@@ -1198,7 +1362,7 @@ async def telegram_webhook(
 
         # Dispatch Task
         dispatch_task_id = created.get("task_id") or logged_task_id
-        terminal_granted = models.get_terminal_access_for_user(user_id)
+        terminal_granted = await adb.get_terminal_access_for_user(user_id)
         if intent_type in ("create_task", "fix_bug") and dispatch_task_id:
             background_tasks.add_task(agent_dispatch_task, dispatch_task_id, intent_data, terminal_granted)
             
@@ -1219,50 +1383,61 @@ async def telegram_webhook(
 # --- 6. CRUD ENDPOINTS (For Dashboard) ---
 
 @app.get("/api/dashboard/{user_id}")
-async def get_dashboard(user_id: str, user: dict = Depends(get_current_user)):
+async def get_dashboard(
+    user_id: str,
+    limit: int = 100,
+    cursor: str | None = None,
+    updated_since: str | None = None,
+    user: dict = Depends(get_current_user),
+):
     _require_user_match(user_id, user.id)
-    projects = models.get_user_projects_with_task_counts(user_id)
-    tasks = models.get_user_tasks(user_id)
+    _require_valid_cursor(cursor)
+    since = _parse_updated_since(updated_since)
+    safe_limit = max(1, min(limit, 500))
+    synced_at = datetime.now(timezone.utc).isoformat()
+    projects = await adb.get_user_projects_with_task_counts(user_id)
+    tasks = await adb.get_user_tasks(user_id, limit=safe_limit, cursor=cursor, updated_since=since)
     logger.debug("dashboard user_id=%s projects=%s tasks=%s", user_id, len(projects), len(tasks))
     return {
         "success": True,
         "projects": projects,
         "tasks": tasks,
+        **_page_info(tasks, safe_limit, "created_at", since, synced_at),
     }
 
 @app.get("/api/projects/{user_id}")
 async def get_user_projects(user_id: str, user: dict = Depends(get_current_user)):
     _require_user_match(user_id, user.id)
-    return {"success": True, "projects": models.get_user_projects(user_id)}
+    return {"success": True, "projects": await adb.get_user_projects(user_id)}
 
 @app.post("/api/projects")
 async def create_project(request: CreateProjectRequest, user: dict = Depends(get_current_user)):
     _require_user_match(request.user_id, user.id)
-    models.upsert_user(user_id=user.id, email=getattr(user, "email", None) or f"{user.id}@local", phone_number=getattr(user, "phone", None))
-    pid = models.create_project(user.id, request.name, request.file_path)
+    await adb.upsert_user(user_id=user.id, email=getattr(user, "email", None) or f"{user.id}@local", phone_number=getattr(user, "phone", None))
+    pid = await adb.create_project(user.id, request.name, request.file_path)
     return {"success": True, "project_id": pid}
 
 @app.delete("/api/projects/{project_id}")
 async def delete_project(project_id: str, user: dict = Depends(get_current_user)):
-    _require_project_owner(user.id, project_id)
-    models.delete_project(project_id)
+    await adb.run(_require_project_owner, user.id, project_id)
+    await adb.delete_project(project_id)
     return {"success": True}
 
 @app.get("/api/projects/{project_id}/tasks")
 async def get_project_tasks(project_id: str, user: dict = Depends(get_current_user)):
-    _require_project_owner(user.id, project_id)
-    return {"success": True, "tasks": models.get_project_tasks(project_id)}
+    await adb.run(_require_project_owner, user.id, project_id)
+    return {"success": True, "tasks": await adb.get_project_tasks(project_id)}
 
 @app.post("/api/tasks")
 async def create_task(request: CreateTaskRequest, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
     if not request.user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
     _require_user_match(request.user_id, user.id)
-    _require_project_owner(user.id, request.project_id)
-    tid = models.create_task(request.project_id, request.user_id, request.description)
+    await adb.run(_require_project_owner, user.id, request.project_id)
+    tid = await adb.create_task(request.project_id, request.user_id, request.description)
 
     # Auto-dispatch if terminal access is granted
-    terminal_granted = get_terminal_access(request.user_id)
+    terminal_granted = await adb.run(get_terminal_access, request.user_id)
     if terminal_granted:
         intent_data = {
             "intent": "create_task",
@@ -1274,24 +1449,34 @@ async def create_task(request: CreateTaskRequest, background_tasks: BackgroundTa
 
 @app.patch("/api/tasks/{task_id}")
 async def update_task(task_id: str, request: UpdateTaskRequest, user: dict = Depends(get_current_user)):
-    _require_task_owner(user.id, task_id)
-    models.update_task_status(task_id, request.status)
+    await adb.run(_require_task_owner, user.id, task_id)
+    await adb.update_task_status(task_id, request.status)
     return {"success": True, "message": "Task updated"}
 
 @app.get("/api/call-sessions/{user_id}")
-async def get_call_history(user_id: str, user: dict = Depends(get_current_user)):
+async def get_call_history(
+    user_id: str,
+    limit: int = 20,
+    cursor: str | None = None,
+    updated_since: str | None = None,
+    user: dict = Depends(get_current_user),
+):
     _require_user_match(user_id, user.id)
-    sessions = models.get_user_call_history(user_id, limit=20)
-    return {"success": True, "sessions": sessions}
+    _require_valid_cursor(cursor)
+    since = _parse_updated_since(updated_since)
+    safe_limit = max(1, min(limit, 200))
+    synced_at = datetime.now(timezone.utc).isoformat()
+    sessions = await adb.get_user_call_history(user_id, limit=safe_limit, cursor=cursor, updated_since=since)
+    return {"success": True, "sessions": sessions, **_page_info(sessions, safe_limit, "started_at", since, synced_at)}
 
 # --- 7. AGENT PIPELINE ENDPOINTS ---
 
 @app.get("/api/agent/status/{task_id}")
 async def get_agent_status(task_id: str, user: dict = Depends(get_current_user)):
     """Get agent pipeline status for a specific task."""
-    _require_task_owner(user.id, task_id)
-    executions = models.get_agent_executions(task_id)
-    latest = models.get_task_agent_status(task_id)
+    await adb.run(_require_task_owner, user.id, task_id)
+    executions = await adb.get_agent_executions(task_id)
+    latest = await adb.get_task_agent_status(task_id)
     return {
         "success": True,
         "task_id": task_id,
@@ -1301,13 +1486,31 @@ async def get_agent_status(task_id: str, user: dict = Depends(get_current_user))
 
 
 @app.get("/api/agent/executions/{user_id}")
-async def get_user_agent_executions(user_id: str, user: dict = Depends(get_current_user)):
-    """Get all agent executions for a user."""
+async def get_user_agent_executions(
+    request: Request,
+    response: Response,
+    user_id: str,
+    limit: int = 20,
+    cursor: str | None = None,
+    updated_since: str | None = None,
+    user: dict = Depends(get_current_user),
+):
+    """Get a user's agent executions, newest first (or changed since `updated_since`)."""
     _require_user_match(user_id, user.id)
-    executions = models.get_user_agent_executions(user_id)
+    _require_valid_cursor(cursor)
+    since = _parse_updated_since(updated_since)
+    not_modified = _not_modified(request, response, user.id, ("executions", "projects"))
+    if not_modified is not None:
+        return not_modified
+    safe_limit = max(1, min(limit, 200))
+    synced_at = datetime.now(timezone.utc).isoformat()
+    executions = await adb.get_user_agent_executions(
+        user_id, limit=safe_limit, cursor=cursor, updated_since=since
+    )
     return {
         "success": True,
         "executions": executions,
+        **_page_info(executions, safe_limit, "created_at", since, synced_at),
     }
 
 
@@ -1315,7 +1518,7 @@ async def get_user_agent_executions(user_id: str, user: dict = Depends(get_curre
 @limiter.limit("30/minute")
 async def manually_dispatch_agent(request: Request, task_id: str, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
     """Manually trigger agent dispatch for a task."""
-    task_dict = _require_task_owner(user.id, task_id)
+    task_dict = await adb.run(_require_task_owner, user.id, task_id)
     intent_data = {
         "intent": task_dict.get("intent_type", "create_task"),
         "project_name": None,
@@ -1323,12 +1526,12 @@ async def manually_dispatch_agent(request: Request, task_id: str, background_tas
     }
     # Get project name
     if task_dict.get("project_id"):
-        project = models.get_project_by_id(task_dict["project_id"])
+        project = await adb.get_project_by_id(task_dict["project_id"])
         if project:
             intent_data["project_name"] = project["name"]
 
     user_id = task_dict.get("user_id", "")
-    terminal_granted = get_terminal_access(user_id)
+    terminal_granted = await adb.run(get_terminal_access, user_id)
     background_tasks.add_task(agent_dispatch_task, task_id, intent_data, terminal_granted)
     return {"success": True, "message": "Agent pipeline dispatched", "task_id": task_id, "terminal_access": terminal_granted}
 
@@ -1339,7 +1542,7 @@ async def manually_dispatch_agent(request: Request, task_id: str, background_tas
 async def grant_terminal_access(user_id: str, user: dict = Depends(get_current_user)):
     """User grants permission for auto-terminal execution."""
     _require_user_match(user_id, user.id)
-    set_terminal_access(user_id, True)
+    await adb.run(set_terminal_access, user_id, True)
     return {"success": True, "terminal_access": True, "message": "Terminal access granted. Tasks will auto-execute in terminal."}
 
 
@@ -1347,7 +1550,7 @@ async def grant_terminal_access(user_id: str, user: dict = Depends(get_current_u
 async def revoke_terminal_access(user_id: str, user: dict = Depends(get_current_user)):
     """User revokes terminal execution permission."""
     _require_user_match(user_id, user.id)
-    set_terminal_access(user_id, False)
+    await adb.run(set_terminal_access, user_id, False)
     return {"success": True, "terminal_access": False, "message": "Terminal access revoked."}
 
 
@@ -1355,10 +1558,33 @@ async def revoke_terminal_access(user_id: str, user: dict = Depends(get_current_
 async def check_terminal_access(user_id: str, user: dict = Depends(get_current_user)):
     """Check if user has granted terminal access."""
     _require_user_match(user_id, user.id)
-    granted = get_terminal_access(user_id)
+    granted = await adb.run(get_terminal_access, user_id)
     return {"success": True, "terminal_access": granted}
 
 
+async def _long_poll_claim(claim, *, keys: list[str], wait_s: float):
+    """
+    Try `claim` once, then park on command events for up to `wait_s` seconds.
+    Re-claims only when a matching command is queued, plus a slow safety re-poll
+    (CLAIM_REPOLL_SECONDS) in case a wake-up was published by a worker we cannot hear.
+    """
+    with command_events.get_hub().subscribe(keys) as sub:
+        # Subscribe before the first attempt so a command queued in between still wakes us.
+        cmd = await adb.run(claim)
+        if cmd or wait_s <= 0:
+            return cmd
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_s
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            await sub.wait(min(remaining, CLAIM_REPOLL_SECONDS))
+            cmd = await adb.run(claim)
+            if cmd:
+                return cmd
+
+
 @app.post("/api/device/heartbeat")
 async def device_heartbeat(
     request: DeviceHeartbeatRequest,
@@ -1367,6 +1593,10 @@ async def device_heartbeat(
     if request.device_id != device.get("id"):
         raise HTTPException(status_code=403, detail="Forbidden")
     models.touch_device_heartbeat(device["id"])
+    if request.running_command_ids:
+        await adb.renew_command_leases(
+            user_id=device["user_id"], command_ids=request.running_command_ids[:MAX_HEARTBEAT_COMMANDS]
+        )
     return {"success": True, "device_id": device["id"]}
 
 
@@ -1376,21 +1606,24 @@ async def device_claim_next(
     device: dict = Depends(get_current_device),
 ):
     wait_s = max(0, min(request.wait_seconds, 30))
+
+    def claim():
+        try:
+            return models.claim_next_queued_command_for_device(device_id=device["id"])
+        except Exception as exc:
+            logger.warning("device claim-next error device_id=%s err=%r", device["id"], exc)
+            return None
+
+    # A claim-next long-poll doubles as the heartbeat: the device is online while it waits.
+    models.touch_device_heartbeat(device["id"])
     try:
-        cmd = models.claim_next_queued_command_for_device(device_id=device["id"])
-    except Exception as exc:
-        logger.warning("device claim-next error device_id=%s err=%r", device["id"], exc)
-        cmd = None
-    if not cmd and wait_s > 0:
-        deadline = asyncio.get_running_loop().time() + wait_s
-        while asyncio.get_running_loop().time() < deadline:
-            await asyncio.sleep(0.5)
-            try:
-                cmd = models.claim_next_queued_command_for_device(device_id=device["id"])
-            except Exception:
-                cmd = None
-            if cmd:
-                break
+        cmd = await _long_poll_claim(
+            claim,
+            keys=[command_events.user_key(device["user_id"]), command_events.device_key(device["id"])],
+            wait_s=wait_s,
+        )
+    finally:
+        models.touch_device_heartbeat(device["id"])
     return {"success": True, "command": cmd}
 
 
@@ -1400,25 +1633,38 @@ async def device_append_logs(
     request: AppendTerminalLogsRequest,
     device: dict = Depends(get_current_device),
 ):
-    cmd = _require_terminal_command_owner(device["user_id"], command_id)
-    seq = request.sequence_start
-    for chunk in request.chunks:
-        models.append_terminal_log_chunk(command_id=command_id, sequence=seq, stream=request.stream, chunk=chunk)
-        seq += 1
+    cmd = await adb.run(_require_terminal_command_owner, device["user_id"], command_id)
+    seq = await adb.append_terminal_log_chunks(
+        command_id=command_id,
+        sequence_start=request.sequence_start,
+        stream=request.stream,
+        chunks=request.chunks,
+    )
+    log_stream.get_hub().publish_chunks(
+        command_id, sequence_start=request.sequence_start, stream=request.stream, chunks=request.chunks
+    )
     models.touch_device_heartbeat(device["id"])
+    models.extend_command_lease(command_id)
     return {"success": True, "command_id": cmd["id"], "next_sequence": seq}
 
 
+@app.post("/api/device/commands/{command_id}/renew")
+async def device_renew_command_lease(command_id: str, device: dict = Depends(get_current_device)):
+    models.touch_device_heartbeat(device["id"])
+    return await _renew_lease(device["user_id"], command_id)
+
+
 @app.post("/api/device/commands/{command_id}/complete")
 async def device_complete_command(
     command_id: str,
     request: CompleteTerminalCommandRequest,
     device: dict = Depends(get_current_device),
 ):
-    _require_terminal_command_owner(device["user_id"], command_id)
+    await adb.run(_require_terminal_command_owner, device["user_id"], command_id)
     if request.status not in ("completed", "failed", "cancelled"):
         raise HTTPException(status_code=400, detail="Invalid status")
-    models.complete_terminal_command(command_id=command_id, status=request.status, exit_code=request.exit_code)
+    await adb.complete_terminal_command(command_id=command_id, status=request.status, exit_code=request.exit_code)
+    log_stream.get_hub().publish_complete(command_id, status=request.status, exit_code=request.exit_code)
     models.touch_device_heartbeat(device["id"])
     return {"success": True}
 
@@ -1428,11 +1674,11 @@ async def upsert_cursor_context(
     request: CursorContextRequest,
     device: dict = Depends(get_current_device),
 ):
-    _require_project_owner(device["user_id"], request.project_id)
-    linked_projects = {row.get("project_id") for row in models.get_device_project_links(device["id"])}
+    await adb.run(_require_project_owner, device["user_id"], request.project_id)
+    linked_projects = {row.get("project_id") for row in await adb.get_device_project_links(device["id"])}
     if request.project_id not in linked_projects:
         raise HTTPException(status_code=403, detail="Device is not linked to this project")
-    context_id = models.save_cursor_context(
+    context_id = await adb.save_cursor_context(
         device_id=device["id"],
         project_id=request.project_id,
         file_path=request.file_path,
@@ -1449,16 +1695,16 @@ async def create_unified_command(
     background_tasks: BackgroundTasks,
     user: dict = Depends(get_current_user),
 ):
-    _require_project_owner(user.id, request.project_id)
+    await adb.run(_require_project_owner, user.id, request.project_id)
     from agents.command_builder import build_provider_command, normalize_provider
 
-    provider = normalize_provider(request.provider or models.get_default_provider_for_user(user.id))
+    provider = normalize_provider(request.provider or await adb.get_default_provider_for_user(user.id))
     prompt = request.prompt.strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt cannot be empty")
     if request.device_id:
-        _require_device_owner(user.id, request.device_id)
-        context = models.get_latest_cursor_context(device_id=request.device_id, project_id=request.project_id)
+        await adb.run(_require_device_owner, user.id, request.device_id)
+        context = await adb.get_latest_cursor_context(device_id=request.device_id, project_id=request.project_id)
         if context:
             file_path = context.get("file_path") or "(unknown file)"
             selection = (context.get("selection") or "").strip()
@@ -1470,13 +1716,13 @@ async def create_unified_command(
                 f"Diagnostics:\n{diagnostics or '(none)'}"
             )
 
-    session = models.get_or_create_terminal_session_for_project(
+    session = await adb.get_or_create_terminal_session_for_project(
         user_id=user.id,
         project_id=request.project_id,
         name=request.session_name or "Unified Session",
     )
     command = build_provider_command(provider=provider, prompt=prompt)
-    command_id = models.create_terminal_command(
+    command_id = await adb.create_terminal_command(
         session_id=session["id"],
         user_id=user.id,
         command=command,
@@ -1486,7 +1732,7 @@ async def create_unified_command(
         normalized_command=command,
         status="pending_approval",
     )
-    models.add_conversation_turn(
+    await adb.add_conversation_turn(
         user_id=user.id,
         project_id=request.project_id,
         session_id=session["id"],
@@ -1495,7 +1741,7 @@ async def create_unified_command(
         turn_type="approval_request",
         content=f"Proposed command ({provider}): {command}",
     )
-    models.upsert_conversation_state(
+    await adb.upsert_conversation_state(
         user_id=user.id,
         project_id=request.project_id,
         state="awaiting_approval",
@@ -1524,25 +1770,37 @@ async def create_unified_command(
 
 @app.get("/api/unified/timeline")
 async def get_unified_timeline(
+    request: Request,
+    response: Response,
     project_id: str | None = None,
     limit: int = 100,
+    cursor: str | None = None,
     user: dict = Depends(get_current_user),
 ):
     safe_limit = max(1, min(limit, 200))
-    rows = models.list_recent_terminal_commands_for_user(user_id=user.id, limit=safe_limit)
-    if project_id:
-        rows = [r for r in rows if r.get("project_id") == project_id]
-    return {"success": True, "commands": rows}
+    _require_valid_cursor(cursor)
+    not_modified = _not_modified(request, response, user.id, ("commands", "sessions", "projects"))
+    if not_modified is not None:
+        return not_modified
+    rows = await adb.list_recent_terminal_commands_for_user(
+        user_id=user.id, limit=safe_limit, project_id=project_id, cursor=cursor
+    )
+    return {"success": True, "commands": rows, "next_cursor": pagination.next_cursor(rows, safe_limit)}
 
 
 @app.get("/api/unified/conversation")
 async def get_unified_conversation(
+    request: Request,
+    response: Response,
     project_id: str | None = None,
     limit: int = 100,
     user: dict = Depends(get_current_user),
 ):
+    not_modified = _not_modified(request, response, user.id, ("conversation",))
+    if not_modified is not None:
+        return not_modified
     safe_limit = max(1, min(limit, 300))
-    rows = models.list_conversation_turns_for_user(user_id=user.id, project_id=project_id, limit=safe_limit)
+    rows = await adb.list_conversation_turns_for_user(user_id=user.id, project_id=project_id, limit=safe_limit)
     return {"success": True, "turns": rows}
 
 
@@ -1552,14 +1810,14 @@ async def approval_action(
     request: ApprovalActionRequest,
     user: dict = Depends(get_current_user),
 ):
-    cmd = _require_terminal_command_owner(user.id, command_id)
+    cmd = await adb.run(_require_terminal_command_owner, user.id, command_id)
     if cmd.get("status") not in ("pending_approval", "queued"):
         raise HTTPException(status_code=400, detail="Command is not awaiting approval")
     next_status = "queued" if request.action == "approve" else "cancelled"
-    updated = models.update_terminal_command_for_approval(command_id=command_id, status=next_status)
-    session = models.get_terminal_session(cmd["session_id"])
+    updated = await adb.update_terminal_command_for_approval(command_id=command_id, status=next_status)
+    session = await adb.get_terminal_session(cmd["session_id"])
     project_id = session.get("project_id") if session else None
-    models.add_conversation_turn(
+    await adb.add_conversation_turn(
         user_id=user.id,
         project_id=project_id,
         session_id=cmd.get("session_id"),
@@ -1568,7 +1826,7 @@ async def approval_action(
         turn_type="approval_result",
         content=f"Command {request.action}d.",
     )
-    models.upsert_conversation_state(
+    await adb.upsert_conversation_state(
         user_id=user.id,
         project_id=project_id,
         state="idle" if next_status != "pending_approval" else "awaiting_approval",
@@ -1585,7 +1843,7 @@ async def edit_pending_command(
     background_tasks: BackgroundTasks,
     user: dict = Depends(get_current_user),
 ):
-    cmd = _require_terminal_command_owner(user.id, command_id)
+    cmd = await adb.run(_require_terminal_command_owner, user.id, command_id)
     if cmd.get("status") not in ("pending_approval", "queued"):
         raise HTTPException(status_code=400, detail="Command cannot be edited in current state")
     from agents.command_builder import build_provider_command
@@ -1595,16 +1853,16 @@ async def edit_pending_command(
     if not new_prompt:
         raise HTTPException(status_code=400, detail="Prompt cannot be empty")
     new_command = build_provider_command(provider=provider, prompt=new_prompt)
-    updated = models.update_terminal_command_for_approval(
+    updated = await adb.update_terminal_command_for_approval(
         command_id=command_id,
         status="pending_approval",
         command=new_command,
         normalized_command=new_command,
         reset_risk_pending=True,
     )
-    session = models.get_terminal_session(cmd["session_id"])
+    session = await adb.get_terminal_session(cmd["session_id"])
     project_id = session.get("project_id") if session else None
-    models.add_conversation_turn(
+    await adb.add_conversation_turn(
         user_id=user.id,
         project_id=project_id,
         session_id=cmd.get("session_id"),
@@ -1613,7 +1871,7 @@ async def edit_pending_command(
         turn_type="approval_request",
         content=f"Edited command ready for approval: {new_command}",
     )
-    models.upsert_conversation_state(
+    await adb.upsert_conversation_state(
         user_id=user.id,
         project_id=project_id,
         state="awaiting_approval",
@@ -1629,16 +1887,16 @@ async def resolve_contextual_reply(
     request: ContextualReplyRequest,
     user: dict = Depends(get_current_user),
 ):
-    _require_project_owner(user.id, request.project_id)
+    await adb.run(_require_project_owner, user.id, request.project_id)
     reply = (request.reply or "").strip()
     if not reply:
         raise HTTPException(status_code=400, detail="Reply cannot be empty")
 
-    state = models.get_conversation_state(user_id=user.id, project_id=request.project_id)
+    state = await adb.get_conversation_state(user_id=user.id, project_id=request.project_id)
     ctx = _load_state_context(state)
     active_command_id = request.command_id or (state.get("active_command_id") if state else None)
     if not active_command_id:
-        models.add_conversation_turn(
+        await adb.add_conversation_turn(
             user_id=user.id,
             project_id=request.project_id,
             session_id=None,
@@ -1649,9 +1907,9 @@ async def resolve_contextual_reply(
         )
         return {"success": True, "intent": "unknown", "message": "No pending command"}
 
-    cmd = _require_terminal_command_owner(user.id, active_command_id)
+    cmd = await adb.run(_require_terminal_command_owner, user.id, active_command_id)
     intent = _classify_reply(reply)
-    models.add_conversation_turn(
+    await adb.add_conversation_turn(
         user_id=user.id,
         project_id=request.project_id,
         session_id=cmd.get("session_id"),
@@ -1668,15 +1926,15 @@ async def resolve_contextual_reply(
                 status_code=403,
                 detail="High-risk command: confirm with the Approve button in the app (voice approval disabled).",
             )
-        updated = models.update_terminal_command_for_approval(command_id=active_command_id, status="queued")
-        models.upsert_conversation_state(
+        updated = await adb.update_terminal_command_for_approval(command_id=active_command_id, status="queued")
+        await adb.upsert_conversation_state(
             user_id=user.id,
             project_id=request.project_id,
             state="idle",
             active_command_id=None,
             context_json={},
         )
-        models.add_conversation_turn(
+        await adb.add_conversation_turn(
             user_id=user.id,
             project_id=request.project_id,
             session_id=cmd.get("session_id"),
@@ -1688,15 +1946,15 @@ async def resolve_contextual_reply(
         return {"success": True, "intent": intent, "command": updated}
 
     if intent == "reject":
-        updated = models.update_terminal_command_for_approval(command_id=active_command_id, status="cancelled")
-        models.upsert_conversation_state(
+        updated = await adb.update_terminal_command_for_approval(command_id=active_command_id, status="cancelled")
+        await adb.upsert_conversation_state(
             user_id=user.id,
             project_id=request.project_id,
             state="idle",
             active_command_id=None,
             context_json={},
         )
-        models.add_conversation_turn(
+        await adb.add_conversation_turn(
             user_id=user.id,
             project_id=request.project_id,
             session_id=cmd.get("session_id"),
@@ -1712,13 +1970,13 @@ async def resolve_contextual_reply(
 
         provider = (ctx.get("provider") if isinstance(ctx, dict) else None) or cmd.get("provider") or "shell"
         edited_command = build_provider_command(provider=provider, prompt=reply)
-        updated = models.update_terminal_command_for_approval(
+        updated = await adb.update_terminal_command_for_approval(
             command_id=active_command_id,
             status="pending_approval",
             command=edited_command,
             normalized_command=edited_command,
         )
-        models.add_conversation_turn(
+        await adb.add_conversation_turn(
             user_id=user.id,
             project_id=request.project_id,
             session_id=cmd.get("session_id"),
@@ -1729,7 +1987,7 @@ async def resolve_contextual_reply(
         )
         return {"success": True, "intent": "contextual_reply", "command": updated}
 
-    models.add_conversation_turn(
+    await adb.add_conversation_turn(
         user_id=user.id,
         project_id=request.project_id,
         session_id=cmd.get("session_id"),
@@ -1754,13 +2012,13 @@ async def register_local_agent(
     """
     project_id = request.project_id
     if project_id:
-        _require_project_owner(agent_user_id, project_id)
+        await adb.run(_require_project_owner, agent_user_id, project_id)
     elif request.project_path is not None:
         # Create (or reuse) project automatically for minimal user friction
         inferred_name = (request.project_name or "").strip()
         if not inferred_name:
             inferred_name = os.path.basename(request.project_path.rstrip("/")) or "Local Project"
-        project = models.upsert_project_by_name(
+        project = await adb.upsert_project_by_name(
             user_id=agent_user_id,
             name=inferred_name,
             file_path=request.project_path,
@@ -1768,7 +2026,7 @@ async def register_local_agent(
         project_id = project["id"]
     # else: neither project_id nor project_path provided — register as project-agnostic instance
 
-    row = models.register_instance(
+    row = await adb.register_instance(
         user_id=agent_user_id,
         project_id=project_id,
         instance_token=request.instance_token,
@@ -1785,13 +2043,17 @@ async def local_agent_heartbeat(
     agent_user_id: str = Depends(get_current_agent_user_id),
 ):
     # Ensure the instance belongs to the same user (best-effort)
-    inst = models.get_instance_by_id(request.instance_id)
+    inst = await adb.get_instance_by_id(request.instance_id)
     if not inst:
         raise HTTPException(status_code=404, detail="Instance not found")
     if inst.get("user_id") and inst.get("user_id") != agent_user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    models.update_instance_heartbeat(instance_id=request.instance_id, status=request.status)
+    await adb.update_instance_heartbeat(instance_id=request.instance_id, status=request.status)
+    if request.running_command_ids:
+        await adb.renew_command_leases(
+            user_id=agent_user_id, command_ids=request.running_command_ids[:MAX_HEARTBEAT_COMMANDS]
+        )
     return {"success": True, "instance_id": request.instance_id, "status": request.status, "ts": datetime.utcnow().isoformat()}
 
 
@@ -1804,21 +2066,23 @@ async def local_agent_claim_next(
     Local helper pulls the next queued command for sessions bound to its instance.
     """
     # Basic ownership check
-    inst = models.get_instance_by_id(request.instance_id)
+    inst = await adb.get_instance_by_id(request.instance_id)
     if not inst:
         raise HTTPException(status_code=404, detail="Instance not found")
     if inst.get("user_id") and inst["user_id"] != agent_user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     wait_s = max(0, min(request.wait_seconds, 30))
-    cmd = models.claim_next_queued_command_for_user(user_id=agent_user_id)
-    if not cmd and wait_s > 0:
-        deadline = asyncio.get_running_loop().time() + wait_s
-        while asyncio.get_running_loop().time() < deadline:
-            await asyncio.sleep(0.5)
-            cmd = models.claim_next_queued_command_for_user(user_id=agent_user_id)
-            if cmd:
-                break
+    # Implicit heartbeat at both ends of the long-poll; agents skip /heartbeat while polling.
+    models.touch_instance_heartbeat(request.instance_id)
+    try:
+        cmd = await _long_poll_claim(
+            lambda: models.claim_next_queued_command_for_user(user_id=agent_user_id),
+            keys=[command_events.user_key(agent_user_id), command_events.instance_key(request.instance_id)],
+            wait_s=wait_s,
+        )
+    finally:
+        models.touch_instance_heartbeat(request.instance_id)
     return {"success": True, "command": cmd}
 
 
@@ -1828,46 +2092,70 @@ async def local_agent_append_logs(
     request: AppendTerminalLogsRequest,
     agent_user_id: str = Depends(get_current_agent_user_id),
 ):
-    _require_terminal_command_owner(agent_user_id, command_id)
-    seq = request.sequence_start
-    for chunk in request.chunks:
-        models.append_terminal_log_chunk(command_id=command_id, sequence=seq, stream=request.stream, chunk=chunk)
-        seq += 1
+    await adb.run(_require_terminal_command_owner, agent_user_id, command_id)
+    seq = await adb.append_terminal_log_chunks(
+        command_id=command_id,
+        sequence_start=request.sequence_start,
+        stream=request.stream,
+        chunks=request.chunks,
+    )
+    log_stream.get_hub().publish_chunks(
+        command_id, sequence_start=request.sequence_start, stream=request.stream, chunks=request.chunks
+    )
+    models.extend_command_lease(command_id)
     return {"success": True, "next_sequence": seq}
 
 
+@app.post("/api/agent/local/commands/{command_id}/renew")
+async def local_agent_renew_command_lease(
+    command_id: str,
+    agent_user_id: str = Depends(get_current_agent_user_id),
+):
+    return await _renew_lease(agent_user_id, command_id)
+
+
 @app.post("/api/agent/local/commands/{command_id}/complete")
 async def local_agent_complete_command(
     command_id: str,
     request: CompleteTerminalCommandRequest,
     agent_user_id: str = Depends(get_current_agent_user_id),
 ):
-    _require_terminal_command_owner(agent_user_id, command_id)
+    await adb.run(_require_terminal_command_owner, agent_user_id, command_id)
     if request.status not in ("completed", "failed", "cancelled"):
         raise HTTPException(status_code=400, detail="Invalid status")
-    models.complete_terminal_command(command_id=command_id, status=request.status, exit_code=request.exit_code)
+    await adb.complete_terminal_command(command_id=command_id, status=request.status, exit_code=request.exit_code)
+    log_stream.get_hub().publish_complete(command_id, status=request.status, exit_code=request.exit_code)
     return {"success": True}
 
 
 # --- 10. TERMINAL (WEB UI) ENDPOINTS ---
 
 @app.get("/api/terminal/sessions/{project_id}")
-async def list_terminal_sessions(project_id: str, user: dict = Depends(get_current_user)):
-    _require_project_owner(user.id, project_id)
-    sessions = models.list_terminal_sessions_for_project(user_id=user.id, project_id=project_id)
+async def list_terminal_sessions(
+    request: Request,
+    response: Response,
+    project_id: str,
+    user: dict = Depends(get_current_user),
+):
+    # The tag is scoped to user.id, so a 304 before the ownership check reveals nothing.
+    not_modified = _not_modified(request, response, user.id, ("sessions",))
+    if not_modified is not None:
+        return not_modified
+    await adb.run(_require_project_owner, user.id, project_id)
+    sessions = await adb.list_terminal_sessions_for_project(user_id=user.id, project_id=project_id)
     return {"success": True, "sessions": sessions}
 
 
 @app.post("/api/terminal/sessions")
 async def create_terminal_session(request: CreateTerminalSessionRequest, user: dict = Depends(get_current_user)):
-    _require_project_owner(user.id, request.project_id)
+    await adb.run(_require_project_owner, user.id, request.project_id)
 
     instance_id = request.instance_id
     if not instance_id:
-        active = models.get_active_instances_for_user(user.id, within_seconds=120)
+        active = await adb.get_active_instances_for_user(user.id, within_seconds=120)
         instance_id = active[0]["id"] if active else None
 
-    session_id = models.create_terminal_session(
+    session_id = await adb.create_terminal_session(
         user_id=user.id,
         project_id=request.project_id,
         name=request.name,
@@ -1879,24 +2167,24 @@ async def create_terminal_session(request: CreateTerminalSessionRequest, user: d
 
 @app.delete("/api/terminal/sessions/{session_id}")
 async def close_terminal_session(session_id: str, user: dict = Depends(get_current_user)):
-    _require_terminal_session_owner(user.id, session_id)
-    models.set_terminal_session_status(session_id, "closing", closed=False)
+    await adb.run(_require_terminal_session_owner, user.id, session_id)
+    await adb.set_terminal_session_status(session_id, "closing", closed=False)
     return {"success": True}
 
 
 @app.post("/api/terminal/sessions/{session_id}/commands")
 async def create_terminal_command(session_id: str, request: CreateTerminalCommandRequest, user: dict = Depends(get_current_user)):
-    session = _require_terminal_session_owner(user.id, session_id)
+    session = await adb.run(_require_terminal_session_owner, user.id, session_id)
     if not session.get("instance_id"):
         # Try to auto-bind to latest active instance for this user.
-        active = models.get_active_instances_for_user(user.id, within_seconds=180)
+        active = await adb.get_active_instances_for_user(user.id, within_seconds=180)
         if active:
-            models.bind_terminal_session_instance(session_id, active[0]["id"])
-            session = _require_terminal_session_owner(user.id, session_id)
+            await adb.bind_terminal_session_instance(session_id, active[0]["id"])
+            session = await adb.run(_require_terminal_session_owner, user.id, session_id)
         if not session.get("instance_id"):
             raise HTTPException(status_code=409, detail="No local agent connected for this session")
-    provider = (request.provider or models.get_default_provider_for_user(user.id)).strip().lower()
-    command_id = models.create_terminal_command(
+    provider = (request.provider or await adb.get_default_provider_for_user(user.id)).strip().lower()
+    command_id = await adb.create_terminal_command(
         session_id=session_id,
         user_id=user.id,
         command=request.command,
@@ -1910,23 +2198,150 @@ async def create_terminal_command(session_id: str, request: CreateTerminalComman
 
 @app.get("/api/terminal/sessions/{session_id}/commands")
 async def list_terminal_commands(session_id: str, user: dict = Depends(get_current_user)):
-    _require_terminal_session_owner(user.id, session_id)
-    cmds = models.list_terminal_commands_for_session(user_id=user.id, session_id=session_id, limit=200)
+    await adb.run(_require_terminal_session_owner, user.id, session_id)
+    cmds = await adb.list_terminal_commands_for_session(user_id=user.id, session_id=session_id, limit=200)
     return {"success": True, "commands": cmds}
 
 
+# Most chunks (or lines, for tail_lines) one logs request returns.
+MAX_LOG_PAGE = 1000
+
+
 @app.get("/api/terminal/commands/{command_id}/logs")
 async def get_terminal_command_logs(
     command_id: str,
+    response: Response,
     after_sequence: int | None = None,
     limit: int = 200,
+    tail: int | None = None,
+    tail_lines: int | None = None,
+    byte_start: int | None = None,
+    byte_end: int | None = None,
     user: dict = Depends(get_current_user),
 ):
-    _require_terminal_command_owner(user.id, command_id)
-    logs = models.get_terminal_logs_for_command(command_id=command_id, after_sequence=after_sequence, limit=limit)
+    """
+    A page of a command's output: the first `limit` chunks after `after_sequence`
+    (default), the last `tail` chunks, the last `tail_lines` lines, or the chunks
+    overlapping bytes [byte_start, byte_end). X-Log-Total-Chunks / X-Log-Total-Bytes
+    give the log's current size.
+    """
+    modes = [m for m in (after_sequence, tail, tail_lines, byte_start) if m is not None]
+    if len(modes) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of after_sequence, tail, tail_lines, byte_start")
+    if byte_end is not None and byte_start is None:
+        raise HTTPException(status_code=400, detail="byte_end requires byte_start")
+    if any(v is not None and v < 0 for v in (tail, tail_lines, byte_start, byte_end)):
+        raise HTTPException(status_code=400, detail="tail, tail_lines and byte offsets must not be negative")
+    cmd = await adb.run(_require_terminal_command_owner, user.id, command_id)
+    compacted = bool(cmd.get("logs_compacted_at"))
+    safe_limit = max(1, min(limit, MAX_LOG_PAGE))
+    if tail is not None:
+        page = adb.get_terminal_log_tail(
+            command_id=command_id, chunks=max(1, min(tail, MAX_LOG_PAGE)), compacted=compacted
+        )
+    elif tail_lines is not None:
+        page = adb.get_terminal_log_tail(
+            command_id=command_id, lines=max(1, min(tail_lines, MAX_LOG_PAGE)), compacted=compacted
+        )
+    elif byte_start is not None:
+        page = adb.get_terminal_log_range(
+            command_id=command_id, byte_start=byte_start, byte_end=byte_end, limit=safe_limit, compacted=compacted
+        )
+    else:
+        page = adb.get_terminal_logs_for_command(
+            command_id=command_id, after_sequence=after_sequence, limit=safe_limit, compacted=compacted
+        )
+    logs, size = await asyncio.gather(page, adb.get_terminal_log_size(command_id, compacted=compacted))
+    response.headers["X-Log-Total-Chunks"] = str(size["chunks"])
+    if size["bytes"] is not None:
+        response.headers["X-Log-Total-Bytes"] = str(size["bytes"])
     return {"success": True, "logs": logs}
 
 
+def _sse(event: str, data: dict, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _terminal_log_events(command_id: str, after_sequence: int, compacted: bool = False):
+    """
+    SSE body for a command's output: DB backlog first, then chunks pushed by append-logs
+    through the log_stream hub, then a final `end` event once the command completes.
+    `compacted` (logs_compacted_at is set) reads the backlog from the log archive.
+    Idle polls and gap catch-up go through the hub, which shares them between viewers.
+    """
+    page = 500
+    last = after_sequence
+
+    async def load(after: int):
+        rows = await adb.get_terminal_logs_for_command(
+            command_id=command_id, after_sequence=after, limit=page, compacted=compacted
+        )
+        if len(rows) == page:
+            return rows, None
+        cmd = await adb.get_terminal_command(command_id)
+        if cmd and cmd.get("status") in log_stream.TERMINAL_STATUSES:
+            return rows, {"status": cmd["status"], "exit_code": cmd.get("exit_code")}
+        return rows, None
+
+    with log_stream.get_hub().subscribe(command_id) as stream:
+        # Subscribed before the first DB read, so nothing appended in between is missed.
+        # max_age: None reads only the hub buffer; otherwise how stale a shared DB read may be.
+        max_age: float | None = 0.0
+        while True:
+            final = None
+            if max_age is not None:
+                rows, final = await stream.refresh(last, load, max_age=max_age)
+                for row in rows:
+                    if row["sequence"] > last:
+                        last = row["sequence"]
+                        yield _sse("log", row, last)
+                if len(rows) == page:
+                    max_age = 0.0
+                    continue
+
+            entries, gap = stream.read_after(last)
+            if gap and max_age is None:
+                max_age = 0.0
+                continue
+            for entry in entries:
+                last = entry["sequence"]
+                yield _sse("log", entry, last)
+
+            final = final or stream.final
+            if final:
+                if max_age is None:
+                    # Completion arrived through the hub; pick up anything written via another worker.
+                    max_age = 0.0
+                    continue
+                yield _sse("end", {"command_id": command_id, **final})
+                return
+
+            if await stream.wait(LOG_STREAM_IDLE_SECONDS):
+                max_age = None
+            else:
+                max_age = LOG_STREAM_IDLE_SECONDS
+                yield ": keepalive\n\n"
+
+
+@app.get("/api/terminal/commands/{command_id}/stream")
+async def stream_terminal_command_logs(
+    command_id: str,
+    after_sequence: int | None = None,
+    last_event_id: Annotated[Union[str, None], Header(alias="Last-Event-ID")] = None,
+    user: dict = Depends(get_current_user),
+):
+    """Server-Sent Events tail of a command's logs; resumes after `after_sequence` / Last-Event-ID."""
+    cmd = await adb.run(_require_terminal_command_owner, user.id, command_id)
+    if after_sequence is None:
+        after_sequence = int(last_event_id) if last_event_id and last_event_id.lstrip("-").isdigit() else -1
+    return StreamingResponse(
+        _terminal_log_events(command_id, after_sequence, bool(cmd.get("logs_compacted_at"))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/")
 async def root():
     return {"status": "Dispatch Agent is Listening..."}
@@ -1987,7 +2402,7 @@ async def twilio_recording(request: Request, background_tasks: BackgroundTasks):
             transcript = await transcribe_file(tmp.name)
 
         # Look up user by phone number
-        user_id = models.get_user_id_by_phone(caller_number)
+        user_id = await adb.get_user_id_by_phone(caller_number)
         if not user_id:
             logger.warning("twilio recording from unknown number=%s", caller_number)
             intent_data = await parse_intent(transcript, []) or {"intent": "unknown"}
@@ -1995,10 +2410,10 @@ async def twilio_recording(request: Request, background_tasks: BackgroundTasks):
             return Response(content=str(response), media_type="application/xml")
 
         # Save call session
-        call_session_id = models.create_call_session(user_id, caller_number)
-        user_projects = models.get_user_projects(user_id)
+        call_session_id = await adb.create_call_session(user_id, caller_number)
+        user_projects = await adb.get_user_projects(user_id)
         intent_data = await parse_intent(transcript, user_projects) or {"intent": "unknown"}
-        models.update_call_session(call_session_id, transcript, str(intent_data))
+        await adb.update_call_session(call_session_id, transcript, str(intent_data))
 
         intent_type = intent_data.get("intent", "unknown")
         task_description = intent_data.get("task_description") or transcript
@@ -2007,7 +2422,7 @@ async def twilio_recording(request: Request, background_tasks: BackgroundTasks):
         # Create a task from the voice command
         logged_task_id = None
         if intent_type != "unknown":
-            logged_task_id = models.log_agent_event_task(
+            logged_task_id = await adb.log_agent_event_task(
                 user_id=user_id,
                 project_name=project_name,
                 projects=user_projects,
@@ -2021,7 +2436,7 @@ async def twilio_recording(request: Request, background_tasks: BackgroundTasks):
 
         # Dispatch to agent pipeline if actionable
         if intent_type in ("create_task", "create_project", "fix_bug") and logged_task_id:
-            terminal_granted = get_terminal_access(user_id)
+            terminal_granted = await adb.run(get_terminal_access, user_id)
             background_tasks.add_task(agent_dispatch_task, logged_task_id, intent_data, terminal_granted)
             logger.info(
                 "twilio dispatch queued task_id=%s user=%s terminal=%s",
@@ -0,0 +1,86 @@
+"""
+Concurrent-request throughput of async routes that touch the database.
+
+Runs GET /api/projects/{user_id} in-process (ASGI transport, dev-mode auth) with
+models.get_user_projects replaced by a fake that blocks for --latency-ms, the
+way a PostgREST round trip through supabase-py does. Two modes are compared:
+
+  blocking  models called inline on the event loop (the old route behaviour)
+  offload   models called through database.async_models (current behaviour)
+
+Usage (from server/):
+    python scripts/bench_async_routes.py --requests 200 --concurrency 50 --latency-ms 40
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["DEVELOPMENT_MODE"] = "true"
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from database import async_models  # noqa: E402
+
+USER_ID = os.environ.get("DEV_USER_ID", "test-user-123")
+
+
+async def _run_inline(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+async def _bench(mode: str, n_requests: int, concurrency: int, latency_s: float) -> float:
+    def slow_projects(user_id):
+        time.sleep(latency_s)
+        return [{"id": "p1", "user_id": user_id, "name": "Proj"}]
+
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+    patches = [patch("database.models.get_user_projects", side_effect=slow_projects)]
+    if mode == "blocking":
+        patches.append(patch.object(async_models, "run", _run_inline))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def one():
+            async with sem:
+                resp = await client.get(f"/api/projects/{USER_ID}")
+                resp.raise_for_status()
+
+        for p in patches:
+            p.start()
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(n_requests)))
+            elapsed = time.perf_counter() - start
+        finally:
+            for p in reversed(patches):
+                p.stop()
+    return elapsed
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    print(f"requests={args.requests} concurrency={args.concurrency} latency={args.latency_ms:.0f}ms "
+          f"db_workers={async_models.MAX_WORKERS}")
+    for mode in ("blocking", "offload"):
+        elapsed = asyncio.run(_bench(mode, args.requests, args.concurrency, args.latency_ms / 1000.0))
+        print(f"{mode:9s} {elapsed:7.2f}s  {args.requests / elapsed:8.1f} req/s")
+    async_models.shutdown()
+
+
+if __name__ == "__main__":
+    main_cli()
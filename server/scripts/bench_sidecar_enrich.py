@@ -0,0 +1,67 @@
+"""
+Per-request cost of risk enrichment for a command list (e.g. /api/unified/timeline).
+
+Seeds a throwaway sidecar DB with risk rows, then times enriching --rows commands:
+
+  reconnect+per-row  a fresh connection and one SELECT per command (pre-pooling behaviour)
+  per-row            one SELECT per command on the pooled connection (N+1)
+  batched            sidecar_store.enrich_commands: one IN (...) query per 500 ids
+
+Usage (from server/):
+    python scripts/bench_sidecar_enrich.py --rows 200 --iterations 200
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import sidecar_store as store  # noqa: E402
+
+
+def _per_row(commands, reconnect: bool):
+    out = []
+    for c in commands:
+        if reconnect:
+            store.close_connection()
+        out.append(store.enrich_command(dict(c)))
+    return out
+
+
+def _time(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DISPATCH_SIDECAR_PATH"] = os.path.join(tmp, "bench_sidecar.db")
+        commands = [{"id": f"cmd-{i}", "command": "ls"} for i in range(args.rows)]
+        for c in commands[::2]:
+            store.set_command_risk(command_id=c["id"], user_id="u1", risk_level="SAFE", risk_reason=None)
+
+        cases = [
+            ("reconnect+per-row", lambda: _per_row(commands, reconnect=True), max(1, args.iterations // 10)),
+            ("per-row", lambda: _per_row(commands, reconnect=False), args.iterations),
+            ("batched", lambda: store.enrich_commands(commands), args.iterations),
+        ]
+        print(f"rows={args.rows}")
+        for name, fn, iterations in cases:
+            per_request = _time(fn, iterations)
+            print(f"{name:18s} {per_request * 1000:8.3f} ms/request  {per_request / args.rows * 1e6:7.2f} us/row")
+        store.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/services/auth_verifier.py
+"""
+Supabase access-token verification without a network hop per request.
+
+Tokens are checked locally, either against the project's HS256 JWT secret
+(SUPABASE_JWT_SECRET) or against the asymmetric signing keys published at
+`<SUPABASE_URL>/auth/v1/.well-known/jwks.json`. Verified users are cached by
+token hash until the token expires. The remote `auth.get_user` call is only
+made when no local key can check the token (no secret configured, or a `kid`
+that is still unknown after a JWKS refresh).
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import jwt
+
+from database.cache import TTLCache
+
+logger = logging.getLogger("dispatch.auth")
+
+_ASYMMETRIC_ALGS = ("RS256", "ES256")
+_JWKS_TTL_S = 600.0
+_JWKS_MIN_REFRESH_S = 60.0
+_REMOTE_RESULT_TTL_S = 300.0
+_LEEWAY_S = 10
+
+
+class AuthError(RuntimeError):
+    """Raised when a token is malformed, expired, or fails verification."""
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: str
+    email: str | None = None
+    phone: str | None = None
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _fetch_jwks(url: str) -> dict:
+    import httpx
+
+    resp = httpx.get(url, timeout=5.0)
+    resp.raise_for_status()
+    return resp.json()
+
+
+class TokenVerifier:
+    def __init__(
+        self,
+        *,
+        supabase_url: str,
+        service_key: str,
+        jwt_secret: str | None = None,
+        audience: str = "authenticated",
+        cache_size: int = 4096,
+        jwks_fetch: Callable[[str], dict] = _fetch_jwks,
+        remote_lookup: Callable[[str], Any] | None = None,
+    ) -> None:
+        self._supabase_url = supabase_url.rstrip("/")
+        self._service_key = service_key
+        self._jwt_secret = jwt_secret or None
+        self._audience = audience
+        self._cache = TTLCache(maxsize=cache_size, ttl=_REMOTE_RESULT_TTL_S)
+        self._jwks_fetch = jwks_fetch
+        self._remote_lookup = remote_lookup or self._supabase_get_user
+        self._jwks_lock = threading.Lock()
+        self._jwks: dict[str, jwt.PyJWK] = {}
+        self._jwks_fetched_at = 0.0
+        self._client = None
+
+    @property
+    def jwks_url(self) -> str:
+        return f"{self._supabase_url}/auth/v1/.well-known/jwks.json"
+
+    def verify(self, token: str) -> AuthenticatedUser:
+        key = _token_key(token)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise AuthError(f"malformed token: {e}") from e
+
+        alg = header.get("alg")
+        signing_key: Any = None
+        if alg == "HS256":
+            signing_key = self._jwt_secret
+        elif alg in _ASYMMETRIC_ALGS:
+            jwk = self._signing_key(header.get("kid"))
+            signing_key = jwk.key if jwk is not None else None
+        else:
+            raise AuthError(f"unsupported token algorithm {alg!r}")
+
+        if signing_key is None:
+            user, exp = self._verify_remote(token)
+        else:
+            user, exp = self._verify_local(token, signing_key, alg)
+
+        ttl = exp - time.time() if exp else _REMOTE_RESULT_TTL_S
+        self._cache.set(key, user, ttl=ttl)
+        return user
+
+    def invalidate(self, token: str) -> None:
+        self._cache.pop(_token_key(token))
+
+    def _verify_local(self, token: str, signing_key: Any, alg: str) -> tuple[AuthenticatedUser, float | None]:
+        try:
+            claims = jwt.decode(
+                token,
+                signing_key,
+                algorithms=[alg],
+                audience=self._audience,
+                leeway=_LEEWAY_S,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(f"token rejected: {e}") from e
+        user = AuthenticatedUser(
+            id=str(claims["sub"]),
+            email=claims.get("email") or None,
+            phone=claims.get("phone") or None,
+        )
+        return user, float(claims["exp"])
+
+    def _verify_remote(self, token: str) -> tuple[AuthenticatedUser, float | None]:
+        try:
+            u = self._remote_lookup(token)
+        except Exception as e:
+            raise AuthError(f"remote verification failed: {e!r}") from e
+        if u is None or not getattr(u, "id", None):
+            raise AuthError("remote verification returned no user")
+        user = AuthenticatedUser(
+            id=str(u.id),
+            email=getattr(u, "email", None) or None,
+            phone=getattr(u, "phone", None) or None,
+        )
+        # The token was accepted upstream; its exp only bounds how long we reuse that answer.
+        try:
+            exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.PyJWTError:
+            exp = None
+        if exp:
+            exp = min(float(exp), time.time() + _REMOTE_RESULT_TTL_S)
+        return user, exp
+
+    def _supabase_get_user(self, token: str) -> Any:
+        if self._client is None:
+            from supabase import create_client
+
+            self._client = create_client(self._supabase_url, self._service_key)
+        return self._client.auth.get_user(token).user
+
+    def _signing_key(self, kid: str | None) -> jwt.PyJWK | None:
+        now = time.monotonic()
+        with self._jwks_lock:
+            stale = now - self._jwks_fetched_at > _JWKS_TTL_S
+            unknown = kid not in self._jwks
+            may_refresh = now - self._jwks_fetched_at > _JWKS_MIN_REFRESH_S
+            if stale or (unknown and may_refresh):
+                self._refresh_jwks(now)
+            return self._jwks.get(kid)
+
+    def _refresh_jwks(self, now: float) -> None:
+        self._jwks_fetched_at = now
+        try:
+            data = self._jwks_fetch(self.jwks_url)
+        except Exception as e:
+            logger.warning("jwks fetch failed url=%s err=%r", self.jwks_url, e)
+            return
+        keys: dict[str, jwt.PyJWK] = {}
+        for raw in data.get("keys", []):
+            kid = raw.get("kid")
+            if not kid:
+                continue
+            try:
+                keys[kid] = jwt.PyJWK(raw)
+            except jwt.PyJWTError as e:
+                logger.debug("skipping unusable jwk kid=%s err=%r", kid, e)
+        self._jwks = keys
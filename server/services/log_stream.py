@@ -0,0 +1,227 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/services/log_stream.py
+"""
+In-process fan-out of terminal log chunks to live viewers.
+
+append-logs publishes each accepted batch once; every viewer of that command reads
+it from a shared, bounded per-command buffer instead of querying terminal_logs.
+Channels only exist while someone is watching, so publishing for an unwatched
+command is a dict lookup. Viewers that fall behind the buffer (or whose command
+is being written by another worker) catch up from the database; see
+LogStream.read_after() and LogStream.refresh(). Those database reads are shared
+per command, so an idle command costs one poll however many viewers it has.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Iterable, Tuple
+
+# load(after_sequence) -> (rows after it, {"status", "exit_code"} if the command has finished)
+Loader = Callable[[int], Awaitable[Tuple[list, "dict | None"]]]
+
+TERMINAL_STATUSES = frozenset({"completed", "failed", "cancelled", "rejected"})
+
+# Chunks kept per watched command; a viewer further behind than this re-reads from the DB.
+BUFFER_CHUNKS = 2000
+
+
+class _Channel:
+    def __init__(self, maxlen: int) -> None:
+        self.entries: deque[dict] = deque(maxlen=maxlen)
+        self.max_sequence = -1
+        self.final: dict | None = None
+        self.subscribers: set[LogStream] = set()
+        # (after_sequence, task) of the database read in flight, and
+        # (after_sequence, started, rows, final) of the last one that finished.
+        self.loading: tuple[int, asyncio.Future] | None = None
+        self.loaded: tuple[int, float, list, dict | None] | None = None
+
+
+class LogStream:
+    """One viewer's view of a command's live output. Create inside the event loop."""
+
+    def __init__(self, hub: "LogStreamHub", command_id: str) -> None:
+        self._hub = hub
+        self.command_id = command_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def _wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until new chunks or completion are published. Returns False on timeout."""
+        if timeout <= 0:
+            return False
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+    def read_after(self, sequence: int) -> tuple[list[dict], bool]:
+        """
+        Buffered chunks with sequence > `sequence`, in order, and whether a gap
+        precedes them (chunks the buffer no longer holds or never saw).
+        """
+        return self._hub._read_after(self.command_id, sequence)
+
+    async def refresh(self, sequence: int, load: Loader, *, max_age: float = 0.0) -> tuple[list, dict | None]:
+        """
+        load(sequence) through the hub: a read already in flight from at or before
+        `sequence` is joined rather than repeated, and so is one that finished less
+        than `max_age` seconds ago (or that saw the command finish). Rows may start
+        before `sequence`; callers skip what they already have.
+        """
+        return await self._hub._refresh(self.command_id, sequence, load, max_age)
+
+    @property
+    def final(self) -> dict | None:
+        """{"status", "exit_code"} once the command's completion has been published."""
+        return self._hub._final(self.command_id)
+
+    def close(self) -> None:
+        self._hub._unregister(self)
+
+    def __enter__(self) -> "LogStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class LogStreamHub:
+    def __init__(self, buffer_chunks: int = BUFFER_CHUNKS) -> None:
+        self._lock = threading.Lock()
+        self._channels: dict[str, _Channel] = {}
+        self._buffer_chunks = buffer_chunks
+
+    def subscribe(self, command_id: str) -> LogStream:
+        stream = LogStream(self, command_id)
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                channel = self._channels[command_id] = _Channel(self._buffer_chunks)
+            channel.subscribers.add(stream)
+        return stream
+
+    def _unregister(self, stream: LogStream) -> None:
+        with self._lock:
+            channel = self._channels.get(stream.command_id)
+            if channel is None:
+                return
+            channel.subscribers.discard(stream)
+            if not channel.subscribers:
+                del self._channels[stream.command_id]
+
+    def publish_chunks(self, command_id: str, *, sequence_start: int, stream: str, chunks: Iterable[str]) -> None:
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                return
+            for i, chunk in enumerate(chunks):
+                seq = sequence_start + i
+                # Retried batches re-publish sequences viewers already have.
+                if seq <= channel.max_sequence:
+                    continue
+                channel.entries.append({"command_id": command_id, "sequence": seq, "stream": stream, "chunk": chunk})
+                channel.max_sequence = seq
+            targets = list(channel.subscribers)
+        for s in targets:
+            s._wake()
+
+    def publish_complete(self, command_id: str, *, status: str, exit_code: int | None = None) -> None:
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                return
+            channel.final = {"status": status, "exit_code": exit_code}
+            targets = list(channel.subscribers)
+        for s in targets:
+            s._wake()
+
+    def _read_after(self, command_id: str, sequence: int) -> tuple[list[dict], bool]:
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                return [], False
+            entries = [e for e in channel.entries if e["sequence"] > sequence]
+        gap = bool(entries) and entries[0]["sequence"] != sequence + 1
+        return entries, gap
+
+    async def _refresh(self, command_id: str, sequence: int, load: Loader, max_age: float) -> tuple[list, dict | None]:
+        now = time.monotonic()
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                task = None
+            elif channel.loaded and channel.loaded[0] <= sequence and (
+                channel.loaded[3] is not None or now - channel.loaded[1] < max_age
+            ):
+                return channel.loaded[2], channel.loaded[3]
+            elif channel.loading and channel.loading[0] <= sequence:
+                task = channel.loading[1]
+            else:
+                task = asyncio.ensure_future(load(sequence))
+                channel.loading = (sequence, task)
+                task.add_done_callback(lambda t: self._loaded(command_id, sequence, now, t))
+        if task is None:
+            return await load(sequence)
+        # Shielded: one viewer disconnecting must not cancel a read others are waiting on.
+        return await asyncio.shield(task)
+
+    def _loaded(self, command_id: str, sequence: int, started: float, task: asyncio.Future) -> None:
+        """Keep a finished database read for the command's other viewers and wake them."""
+        with self._lock:
+            channel = self._channels.get(command_id)
+            if channel is None:
+                return
+            if channel.loading and channel.loading[1] is task:
+                channel.loading = None
+            if task.cancelled() or task.exception() is not None:
+                return
+            rows, final = task.result()
+            if not channel.loaded or channel.loaded[1] <= started:
+                channel.loaded = (sequence, started, rows, final)
+            known = {e["sequence"] for e in channel.entries}
+            new = [r for r in rows if r["sequence"] not in known]
+            if new:
+                merged = sorted([*channel.entries, *new], key=lambda e: e["sequence"])
+                channel.entries = deque(merged, maxlen=self._buffer_chunks)
+                channel.max_sequence = max(channel.max_sequence, merged[-1]["sequence"])
+            if not new and (final is None or channel.final):
+                return
+            if final is not None and not channel.final:
+                channel.final = dict(final)
+            targets = list(channel.subscribers)
+        for s in targets:
+            s._wake()
+
+    def _final(self, command_id: str) -> dict | None:
+        with self._lock:
+            channel = self._channels.get(command_id)
+            return dict(channel.final) if channel and channel.final else None
+
+    def channel_count(self) -> int:
+        with self._lock:
+            return len(self._channels)
+
+
+_hub: LogStreamHub | None = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> LogStreamHub:
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = LogStreamHub()
+    return _hub
@@ -0,0 +1,91 @@
+from __future__ import annotations  # Python 3.9 compatibility: allows X | Y union syntax
+
+# server/services/request_decompression.py
+"""
+ASGI middleware that accepts `Content-Encoding: gzip` request bodies.
+
+The local agent gzips large append-logs batches (build output compresses ~10x).
+Routes keep seeing plain JSON: the body is inflated here, the encoding header is
+dropped and Content-Length rewritten. Both the compressed upload (while it is
+received) and its inflated size are capped, so neither a large upload nor a small
+one that expands can grow into an arbitrarily large body.
+"""
+
+import os
+import zlib
+
+from starlette.responses import JSONResponse
+
+MAX_INFLATED_BYTES = int(os.environ.get("DISPATCH_MAX_INFLATED_BODY_BYTES", str(32 * 1024 * 1024)))
+MAX_COMPRESSED_BYTES = int(os.environ.get("DISPATCH_MAX_COMPRESSED_BODY_BYTES", str(8 * 1024 * 1024)))
+
+
+def _too_large() -> JSONResponse:
+    return JSONResponse({"detail": "Request body too large"}, status_code=413)
+
+
+class GzipRequestMiddleware:
+    def __init__(
+        self,
+        app,
+        max_inflated_bytes: int = MAX_INFLATED_BYTES,
+        max_compressed_bytes: int = MAX_COMPRESSED_BYTES,
+    ) -> None:
+        self.app = app
+        self.max_inflated_bytes = max_inflated_bytes
+        self.max_compressed_bytes = max_compressed_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = scope.get("headers") or []
+        encoding = next((v for k, v in headers if k == b"content-encoding"), b"").strip().lower()
+        if encoding != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        declared = next((v for k, v in headers if k == b"content-length"), b"")
+        if declared.isdigit() and int(declared) > self.max_compressed_bytes:
+            await _too_large()(scope, receive, send)
+            return
+        parts = []
+        received = 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return  # client went away mid-upload
+            part = message.get("body", b"")
+            received += len(part)
+            if received > self.max_compressed_bytes:
+                await _too_large()(scope, receive, send)
+                return
+            parts.append(part)
+            if not message.get("more_body", False):
+                break
+
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(b"".join(parts), self.max_inflated_bytes)
+            if inflater.unconsumed_tail:
+                await _too_large()(scope, receive, send)
+                return
+            body += inflater.flush()
+        except zlib.error:
+            await JSONResponse({"detail": "Invalid gzip request body"}, status_code=400)(scope, receive, send)
+            return
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in headers if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode("latin-1"))]
+        delivered = False
+
+        async def receive_inflated():
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_inflated, send)
@@ -5,9 +5,58 @@ import pytest
 from unittest.mock import patch
 
 
+# Embedded-resource filters ("terminal_sessions.project_id") follow this foreign key.
+_EMBED_FOREIGN_KEYS = {"terminal_sessions": "session_id", "projects": "project_id"}
+
+_COMPARE = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "is": lambda a, b: a is None if b == "null" else a == b,
+}
+
+
+def _split_logic_terms(expr: str) -> list[str]:
+    terms, depth, quoted, current = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            terms.append(current)
+            current = ""
+            continue
+        current += ch
+    terms.append(current)
+    return [t.strip() for t in terms if t.strip()]
+
+
+def _parse_logic(expr: str, combine=any):
+    """Predicate for a PostgREST logic tree such as `a.lt.1,and(a.eq.1,id.lt."x")`."""
+    preds = []
+    for term in _split_logic_terms(expr):
+        for name, fn in (("and(", all), ("or(", any)):
+            if term.startswith(name) and term.endswith(")"):
+                preds.append(_parse_logic(term[len(name):-1], fn))
+                break
+        else:
+            column, op, value = term.split(".", 2)
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+            preds.append(lambda row, c=column, o=op, v=value: _COMPARE[o](row.get(c), v))
+    return lambda row: combine(p(row) for p in preds)
+
+
 class FakeResult:
-    def __init__(self, data=None):
+    def __init__(self, data=None, count=None):
         self.data = data
+        self.count = count
 
 
 class FakeQuery:
@@ -18,11 +67,11 @@ class FakeQuery:
         self.selected = "*"
         self.filters: list[tuple[str, str, object]] = []
         self.limit_count: int | None = None
-        self.order_key: str | None = None
-        self.order_desc = False
+        self.orders: list[tuple[str, bool]] = []
         self.single = False
         self.upsert_data: dict | None = None
         self.upsert_conflict: str | None = None
+        self.upsert_ignore_duplicates = False
         self.insert_data: dict | None = None
         self.update_data: dict | None = None
 
@@ -54,13 +103,24 @@ class FakeQuery:
         self.filters.append(("gte", key, value))
         return self
 
+    def gt(self, key: str, value: object):
+        self.filters.append(("gt", key, value))
+        return self
+
     def lt(self, key: str, value: object):
         self.filters.append(("lt", key, value))
         return self
 
+    def lte(self, key: str, value: object):
+        self.filters.append(("lte", key, value))
+        return self
+
+    def or_(self, filters: str):
+        self.filters.append(("or", filters, _parse_logic(filters)))
+        return self
+
     def order(self, key: str, desc: bool = False):
-        self.order_key = key
-        self.order_desc = desc
+        self.orders.append((key, desc))
         return self
 
     def limit(self, n: int):
@@ -89,18 +149,31 @@ class FakeQuery:
         self.action = "delete"
         return self
 
-    def upsert(self, data: dict, on_conflict: str | None = None):
+    def upsert(self, data: dict | list[dict], on_conflict: str | None = None, ignore_duplicates: bool = False):
         self.action = "upsert"
         self.upsert_data = data
         self.upsert_conflict = on_conflict
+        self.upsert_ignore_duplicates = ignore_duplicates
         return self
 
     def execute(self):
         rows = list(self.db.get(self.table_name, []))
 
+        def resolve(row: dict, key: str):
+            if "." not in key:
+                return row.get(key)
+            table, column = key.split(".", 1)
+            fk = _EMBED_FOREIGN_KEYS.get(table, table.rstrip("s") + "_id")
+            related = next((r for r in self.db.get(table, []) if r.get("id") == row.get(fk)), None)
+            return related.get(column) if related else None
+
         def matches(row: dict) -> bool:
             for op, key, value in self.filters:
-                actual = row.get(key)
+                if op == "or":
+                    if not value(row):
+                        return False
+                    continue
+                actual = resolve(row, key)
                 if op == "eq" and actual != value:
                     return False
                 if op == "neq" and actual == value:
@@ -124,7 +197,11 @@ class FakeQuery:
                     return False
                 if op == "gte" and actual is not None and actual < value:
                     return False
-                if op == "lt" and actual is not None and actual >= value:
+                if op == "gt" and actual is not None and actual <= value:
+                    return False
+                if op == "lt" and (actual is None or actual >= value):
+                    return False
+                if op == "lte" and actual is not None and actual > value:
                     return False
                 if op == "range":
                     start, end = value, self.filters[-1][2] if self.filters else None
@@ -137,6 +214,9 @@ class FakeQuery:
         if self.action == "insert":
             if self.insert_data is None:
                 return FakeResult([])
+            if isinstance(self.insert_data, list):
+                self.db.setdefault(self.table_name, []).extend(dict(r) for r in self.insert_data)
+                return FakeResult(list(self.insert_data))
             self.db.setdefault(self.table_name, []).append(dict(self.insert_data))
             return FakeResult(self.insert_data)
 
@@ -151,28 +231,39 @@ class FakeQuery:
         if self.action == "delete":
             remaining = [row for row in rows if not matches(row)]
             self.db[self.table_name] = remaining
-            return FakeResult([])
+            return FakeResult([], count=len(rows) - len(remaining))
 
         if self.action == "upsert":
             if self.upsert_data is None:
                 return FakeResult([])
             conflict_keys = [k.strip() for k in (self.upsert_conflict or "").split(",") if k.strip()]
-            existing = None
-            if conflict_keys:
-                for row in rows:
-                    if all(row.get(key) == self.upsert_data.get(key) for key in conflict_keys):
-                        existing = row
-                        break
-            if existing:
-                existing.update(self.upsert_data)
-                return FakeResult(existing)
-            self.db.setdefault(self.table_name, []).append(dict(self.upsert_data))
-            return FakeResult(self.upsert_data)
+            batch = self.upsert_data if isinstance(self.upsert_data, list) else [self.upsert_data]
+            table = self.db.setdefault(self.table_name, [])
+            written = []
+            for data in batch:
+                existing = None
+                if conflict_keys:
+                    for row in table:
+                        if all(row.get(key) == data.get(key) for key in conflict_keys):
+                            existing = row
+                            break
+                if existing:
+                    if self.upsert_ignore_duplicates:
+                        continue
+                    existing.update(data)
+                    written.append(existing)
+                else:
+                    table.append(dict(data))
+                    written.append(data)
+            if isinstance(self.upsert_data, list):
+                return FakeResult(written)
+            return FakeResult(written[0] if written else None)
 
         if self.action == "select":
             results = [row for row in rows if matches(row)]
-            if self.order_key:
-                results.sort(key=lambda row: row.get(self.order_key), reverse=self.order_desc)
+            # Stable sorts from the last key to the first give a multi-column order.
+            for key, desc in reversed(self.orders):
+                results.sort(key=lambda row: row.get(key), reverse=desc)
             if self.limit_count is not None:
                 results = results[: self.limit_count]
 
@@ -199,8 +290,24 @@ class FakeQuery:
                         }
                         output.append(transformed)
                     return FakeResult(output)
-                keys = [part.strip().split("(")[0] for part in self.selected.replace("*", "").split(",") if part.strip()]
-                return FakeResult([{k: row.get(k) for k in keys if k in row} for row in results])
+                parts = _split_logic_terms(self.selected)
+                output = []
+                for row in results:
+                    out = dict(row) if "*" in parts else {}
+                    for part in parts:
+                        if part == "*":
+                            continue
+                        if "(" in part:
+                            # One level of embedding: rel(col, ...) resolved through its foreign key.
+                            rel = part.split("(")[0].split("!")[0]
+                            cols = [c.strip() for c in part[part.index("(") + 1:-1].split(",") if "(" not in c]
+                            fk = _EMBED_FOREIGN_KEYS.get(rel, rel.rstrip("s") + "_id")
+                            related = next((r for r in self.db.get(rel, []) if r.get("id") == row.get(fk)), None)
+                            out[rel] = {c: related.get(c) for c in cols} if related else None
+                        elif part in row:
+                            out[part] = row[part]
+                    output.append(out)
+                return FakeResult(output)
             return FakeResult(results)
 
         return FakeResult([])
@@ -220,27 +327,68 @@ class FakeTable:
     def update(self, data: dict):
         return FakeQuery(self.table_name, self.db, action="update").update(data)
 
-    def delete(self):
+    def delete(self, count=None, returning=None):
         return FakeQuery(self.table_name, self.db, action="delete")
 
-    def upsert(self, data: dict, on_conflict: str | None = None):
-        return FakeQuery(self.table_name, self.db, action="upsert").upsert(data, on_conflict=on_conflict)
+    def upsert(self, data: dict | list[dict], on_conflict: str | None = None, ignore_duplicates: bool = False):
+        return FakeQuery(self.table_name, self.db, action="upsert").upsert(
+            data, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates
+        )
+
+
+class FakeRpcCall:
+    def __init__(self, name: str, params: dict, handler):
+        self.name = name
+        self.params = params
+        self.handler = handler
+
+    def execute(self):
+        if self.handler is None:
+            # Mirrors PostgREST when a migration has not been applied.
+            raise Exception(f"PGRST202 Could not find the function public.{self.name}")
+        return FakeResult(self.handler(**self.params))
 
 
 class FakeSupabaseClient:
     def __init__(self):
         self._tables: dict[str, list[dict]] = {}
+        self.rpc_handlers: dict[str, object] = {}
 
     def table(self, table_name: str):
         return FakeTable(table_name, self._tables)
 
     def rpc(self, name: str, params: dict):
-        return FakeResult([])
+        return FakeRpcCall(name, params, self.rpc_handlers.get(name))
+
+
+@pytest.fixture(autouse=True)
+def _reset_model_caches(monkeypatch):
+    """Process-wide caches in models must not leak rows between tests."""
+    from database import change_counter, models
+
+    change_counter.reset()
+    # ETags otherwise roll over on a wall-clock boundary mid-test.
+    monkeypatch.setattr(change_counter, "MAX_AGE_S", 1e12)
+
+    models._agent_token_cache.clear()
+    models._device_token_cache.clear()
+    models._prefs_cache.clear()
+    models._known_users.clear()
+    models._prefs_bootstrapped.clear()
+    models._touches.clear()
+    models._pending_leases.clear()
+    models._lease_columns_missing_at = None
+    models._log_upsert_unavailable = False
+    models._log_archive_cache.clear()
+    yield
 
 
 @pytest.fixture
 def test_db():
     """Patch the Supabase client at the point where models import it."""
+    from database import models
+
+    models._missing_rpcs.clear()
     fake_sb = FakeSupabaseClient()
     with patch("database.supabase_client.get_sb", return_value=fake_sb), patch("database.supabase_client._client", fake_sb):
         yield fake_sb
@@ -60,10 +60,8 @@ def _make_command(command_id: str = "cmd-1") -> dict:
 def _sb_for_create_project(project_id: str = "proj-1"):
     """Build a mock Supabase that handles create_project + upsert_user calls."""
     sb = MagicMock()
-    # upsert_user: select existing → None (new user path), then insert
-    sb.table.return_value.select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = _result(None)
     sb.table.return_value.insert.return_value.execute.return_value = _result(None)
-    # create_project: insert
+    # upsert_user / create_project: upsert
     sb.table.return_value.upsert.return_value.execute.return_value = _result(None)
     # get_project_base_path_for_user (via get_user_preferences → upsert + select)
     prefs_result = _result({"user_id": USER_ID, "project_base_path": None})
@@ -0,0 +1,39 @@
+"""Tests for database/async_models.py."""
+from __future__ import annotations
+
+import contextvars
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from database import async_models as adb
+
+_request_id = contextvars.ContextVar("_request_id", default=None)
+
+
+class TestAsyncModels:
+    async def test_resolves_patched_models_function_at_call_time(self):
+        with patch("database.models.get_project_by_id", return_value={"id": "p1"}) as fn:
+            assert await adb.get_project_by_id("p1") == {"id": "p1"}
+        fn.assert_called_once_with("p1")
+
+    async def test_runs_off_the_event_loop_thread(self):
+        loop_thread = threading.get_ident()
+        worker_thread = await adb.run(threading.get_ident)
+        assert worker_thread != loop_thread
+
+    async def test_propagates_contextvars(self):
+        _request_id.set("req-1")
+        assert await adb.run(_request_id.get) == "req-1"
+
+    async def test_exceptions_propagate(self):
+        with patch("database.models.get_project_by_id", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError, match="boom"):
+                await adb.get_project_by_id("p1")
+
+    def test_unknown_or_private_names_raise_attribute_error(self):
+        with pytest.raises(AttributeError):
+            adb.no_such_function
+        with pytest.raises(AttributeError):
+            adb._first_or_none
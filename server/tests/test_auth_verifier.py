@@ -0,0 +1,162 @@
+"""Unit tests for services/auth_verifier.py and its use in get_current_user."""
+from __future__ import annotations
+
+import json
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+
+os.environ.setdefault("DEVELOPMENT_MODE", "true")
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+from services.auth_verifier import AuthenticatedUser, AuthError, TokenVerifier
+
+SECRET = "super-secret-jwt-key-for-tests-only-000"
+
+
+def _claims(**overrides):
+    claims = {
+        "sub": "user-1",
+        "email": "a@example.com",
+        "phone": "",
+        "aud": "authenticated",
+        "exp": int(time.time()) + 3600,
+    }
+    claims.update(overrides)
+    return claims
+
+
+def _verifier(**kwargs) -> TokenVerifier:
+    kwargs.setdefault("supabase_url", "https://proj.supabase.co")
+    kwargs.setdefault("service_key", "service-key")
+    kwargs.setdefault("jwks_fetch", MagicMock(return_value={"keys": []}))
+    kwargs.setdefault("remote_lookup", MagicMock(side_effect=AssertionError("remote lookup not expected")))
+    return TokenVerifier(**kwargs)
+
+
+# ==================== HS256 ====================
+
+
+class TestHs256:
+    def test_valid_token_verified_locally(self):
+        v = _verifier(jwt_secret=SECRET)
+        user = v.verify(jwt.encode(_claims(), SECRET, algorithm="HS256"))
+        assert user == AuthenticatedUser(id="user-1", email="a@example.com", phone=None)
+
+    def test_wrong_secret_rejected(self):
+        v = _verifier(jwt_secret=SECRET)
+        with pytest.raises(AuthError):
+            v.verify(jwt.encode(_claims(), "another-secret-another-secret-000", algorithm="HS256"))
+
+    def test_expired_token_rejected(self):
+        v = _verifier(jwt_secret=SECRET)
+        with pytest.raises(AuthError):
+            v.verify(jwt.encode(_claims(exp=int(time.time()) - 120), SECRET, algorithm="HS256"))
+
+    def test_wrong_audience_rejected(self):
+        v = _verifier(jwt_secret=SECRET)
+        with pytest.raises(AuthError):
+            v.verify(jwt.encode(_claims(aud="anon"), SECRET, algorithm="HS256"))
+
+    def test_malformed_token_rejected(self):
+        with pytest.raises(AuthError):
+            _verifier(jwt_secret=SECRET).verify("not-a-jwt")
+
+    def test_cache_hit_skips_decode(self):
+        v = _verifier(jwt_secret=SECRET)
+        token = jwt.encode(_claims(), SECRET, algorithm="HS256")
+        first = v.verify(token)
+        with patch("services.auth_verifier.jwt.decode", side_effect=AssertionError("decoded twice")):
+            assert v.verify(token) is first
+
+    def test_without_secret_falls_back_to_remote(self):
+        remote = MagicMock(return_value=SimpleNamespace(id="user-9", email="r@example.com", phone=None))
+        v = _verifier(remote_lookup=remote)
+        token = jwt.encode(_claims(), SECRET, algorithm="HS256")
+        assert v.verify(token).id == "user-9"
+        assert v.verify(token).id == "user-9"
+        remote.assert_called_once_with(token)
+
+    def test_remote_failure_raises_auth_error(self):
+        v = _verifier(remote_lookup=MagicMock(side_effect=RuntimeError("401")))
+        with pytest.raises(AuthError):
+            v.verify(jwt.encode(_claims(), SECRET, algorithm="HS256"))
+
+
+# ==================== JWKS ====================
+
+
+def _es256_jwk(kid: str):
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    public.update({"kid": kid, "alg": "ES256", "use": "sig"})
+    return private_key, public
+
+
+class TestJwks:
+    def test_token_verified_against_cached_jwks(self):
+        private_key, public = _es256_jwk("k1")
+        fetch = MagicMock(return_value={"keys": [public]})
+        v = _verifier(jwks_fetch=fetch)
+
+        for sub in ("u1", "u2"):
+            token = jwt.encode(_claims(sub=sub), private_key, algorithm="ES256", headers={"kid": "k1"})
+            assert v.verify(token).id == sub
+        fetch.assert_called_once_with("https://proj.supabase.co/auth/v1/.well-known/jwks.json")
+
+    def test_unknown_kid_refetch_is_rate_limited_then_remote(self):
+        private_key, public = _es256_jwk("k1")
+        fetch = MagicMock(return_value={"keys": [public]})
+        remote = MagicMock(return_value=SimpleNamespace(id="user-r", email=None, phone=None))
+        v = _verifier(jwks_fetch=fetch, remote_lookup=remote)
+
+        v.verify(jwt.encode(_claims(), private_key, algorithm="ES256", headers={"kid": "k1"}))
+        other_key, _ = _es256_jwk("k2")
+        token = jwt.encode(_claims(), other_key, algorithm="ES256", headers={"kid": "k2"})
+        assert v.verify(token).id == "user-r"
+        # The JWKS was fetched moments ago, so the unknown kid does not trigger another fetch.
+        assert fetch.call_count == 1
+        remote.assert_called_once_with(token)
+
+    def test_bad_signature_with_known_kid_rejected(self):
+        _, public = _es256_jwk("k1")
+        forged_key, _ = _es256_jwk("k1")
+        v = _verifier(jwks_fetch=MagicMock(return_value={"keys": [public]}))
+        with pytest.raises(AuthError):
+            v.verify(jwt.encode(_claims(), forged_key, algorithm="ES256", headers={"kid": "k1"}))
+
+
+# ==================== get_current_user ====================
+
+
+class TestGetCurrentUser:
+    def test_bearer_token_uses_verifier(self):
+        import main
+
+        verifier = MagicMock()
+        verifier.verify.return_value = AuthenticatedUser(id="user-1")
+        with patch.object(main, "_auth_verifier", verifier), \
+             patch.object(main, "SUPABASE_URL", "https://proj.supabase.co"), \
+             patch.object(main, "SUPABASE_SERVICE_KEY", "k"):
+            user = main.get_current_user("Bearer tok")
+        assert user.id == "user-1"
+        verifier.verify.assert_called_once_with("tok")
+
+    def test_rejected_token_is_401(self):
+        import main
+        from fastapi import HTTPException
+
+        verifier = MagicMock()
+        verifier.verify.side_effect = AuthError("bad")
+        with patch.object(main, "_auth_verifier", verifier), \
+             patch.object(main, "SUPABASE_URL", "https://proj.supabase.co"), \
+             patch.object(main, "SUPABASE_SERVICE_KEY", "k"):
+            with pytest.raises(HTTPException) as exc:
+                main.get_current_user("Bearer tok")
+        assert exc.value.status_code == 401
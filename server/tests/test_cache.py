@@ -0,0 +1,64 @@
+"""Unit tests for database/cache.py."""
+from __future__ import annotations
+
+from unittest.mock import patch
+
+from database.cache import SizedTTLCache, TTLCache
+
+
+class TestTTLCache:
+    def test_entries_expire_individually(self):
+        cache = TTLCache(ttl=10)
+        with patch("database.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=100)
+        with patch("database.cache.time.monotonic", return_value=150.0):
+            assert cache.get("a") is None
+            assert cache.get("b") == 2
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_non_positive_ttl_drops_entry(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.set("a", 2, ttl=0)
+        assert cache.get("a") is None
+
+    def test_discard_where(self):
+        cache = TTLCache()
+        cache.set("t1", "user-1")
+        cache.set("t2", "user-2")
+        assert cache.discard_where(lambda k, v: v == "user-1") == 1
+        assert len(cache) == 1
+
+
+class TestSizedTTLCache:
+    def test_evicts_least_recently_used_past_the_byte_budget(self):
+        cache = SizedTTLCache(maxbytes=10)
+        cache.set("a", 1, size=4)
+        cache.set("b", 2, size=4)
+        cache.get("a")
+        cache.set("c", 3, size=4)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        assert cache.size() == 8
+
+    def test_value_over_budget_is_not_kept(self):
+        cache = SizedTTLCache(maxbytes=10)
+        cache.set("a", 1, size=4)
+        cache.set("big", 2, size=11)
+        assert cache.get("big") is None and cache.get("a") == 1
+
+    def test_dropped_entries_free_their_bytes(self):
+        cache = SizedTTLCache(maxbytes=10)
+        cache.set("a", 1, size=8)
+        cache.pop("a")
+        cache.set("b", 2, size=8)
+        assert cache.get("b") == 2
@@ -0,0 +1,60 @@
+"""Tests for database/change_counter.py (version tokens for conditional GETs)."""
+from __future__ import annotations
+
+from database import change_counter, command_events
+
+
+class TestChangeCounter:
+    def test_tag_is_stable_until_a_scope_it_reads_changes(self):
+        tag = change_counter.etag("u1", ("commands", "sessions"), "/api/unified/timeline")
+        assert change_counter.etag("u1", ("commands", "sessions"), "/api/unified/timeline") == tag
+        change_counter.bump("conversation", user_id="u1")
+        assert change_counter.etag("u1", ("commands", "sessions"), "/api/unified/timeline") == tag
+        change_counter.bump("sessions", user_id="u1")
+        assert change_counter.etag("u1", ("commands", "sessions"), "/api/unified/timeline") != tag
+
+    def test_user_scoped_and_unscoped_bumps(self):
+        u1 = change_counter.etag("u1", ("executions",))
+        u2 = change_counter.etag("u2", ("executions",))
+        change_counter.bump("executions", user_id="u2")
+        assert change_counter.etag("u1", ("executions",)) == u1
+        assert change_counter.etag("u2", ("executions",)) != u2
+        u2 = change_counter.etag("u2", ("executions",))
+        change_counter.bump("executions")
+        assert change_counter.etag("u1", ("executions",)) != u1
+        assert change_counter.etag("u2", ("executions",)) != u2
+
+    def test_bump_rows_uses_row_owners(self):
+        u1 = change_counter.etag("u1", ("commands",))
+        u2 = change_counter.etag("u2", ("commands",))
+        change_counter.bump_rows("commands", rows=[{"id": "c1", "user_id": "u1"}])
+        assert change_counter.etag("u1", ("commands",)) != u1
+        assert change_counter.etag("u2", ("commands",)) == u2
+        change_counter.bump_rows("commands", rows=None)
+        assert change_counter.etag("u2", ("commands",)) != u2
+
+    def test_bumps_published_by_other_workers_apply(self):
+        tag = change_counter.etag("u1", ("commands",))
+        command_events.get_hub()._deliver(["changed:commands:u1", "user:u1"])
+        assert change_counter.etag("u1", ("commands",)) != tag
+
+    def test_matches_weak_and_lists(self):
+        tag = change_counter.etag("u1", ("commands",))
+        assert change_counter.matches(tag, tag)
+        assert change_counter.matches(tag[2:], tag)
+        assert change_counter.matches(f'W/"other", {tag}', tag)
+        assert change_counter.matches("*", tag)
+        assert not change_counter.matches('W/"other"', tag)
+        assert not change_counter.matches(None, tag)
+
+
+def test_model_writes_bump_the_owner(test_db):
+    from database import models
+
+    before = change_counter.etag("u1", ("commands", "sessions"))
+    session_id = models.create_terminal_session(user_id="u1", project_id="p1")
+    after_session = change_counter.etag("u1", ("commands", "sessions"))
+    command_id = models.create_terminal_command(session_id=session_id, user_id="u1", command="ls")
+    after_command = change_counter.etag("u1", ("commands", "sessions"))
+    models.complete_terminal_command(command_id=command_id, status="success", exit_code=0)
+    assert len({before, after_session, after_command, change_counter.etag("u1", ("commands", "sessions"))}) == 4
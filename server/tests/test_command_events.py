@@ -0,0 +1,122 @@
+"""
+Tests for database/command_events.py and the event-driven claim-next long-poll.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from unittest.mock import patch
+
+os.environ.setdefault("DEVELOPMENT_MODE", "true")
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+from database import command_events
+from database.command_events import CommandEventHub
+
+
+class TestCommandEventHub:
+    async def test_publish_wakes_matching_subscriber(self):
+        hub = CommandEventHub()
+        with hub.subscribe(["user:u1"]) as sub:
+            hub.publish(["user:u1"])
+            assert await sub.wait(1.0) is True
+
+    async def test_wait_times_out_without_publish(self):
+        hub = CommandEventHub()
+        with hub.subscribe(["user:u1"]) as sub:
+            hub.publish(["user:other"])
+            assert await sub.wait(0.05) is False
+
+    async def test_publish_from_worker_thread_wakes_loop(self):
+        hub = CommandEventHub()
+        with hub.subscribe(["device:d1"]) as sub:
+            t = threading.Thread(target=hub.publish, args=(["device:d1"],))
+            t.start()
+            assert await sub.wait(1.0) is True
+            t.join()
+
+    async def test_close_unregisters(self):
+        hub = CommandEventHub()
+        sub = hub.subscribe(["user:u1", "instance:i1"])
+        assert hub.subscriber_count() == 2
+        sub.close()
+        assert hub.subscriber_count() == 0
+
+    async def test_backend_failure_falls_back_to_local_delivery(self):
+        class BrokenBackend(command_events.LocalBackend):
+            def publish(self, keys):
+                raise RuntimeError("db down")
+
+        hub = CommandEventHub(BrokenBackend())
+        with hub.subscribe(["user:u1"]) as sub:
+            hub.publish(["user:u1"])
+            assert await sub.wait(1.0) is True
+
+
+class TestModelsPublish:
+    def test_create_queued_command_notifies_user(self, test_db):
+        from database import models
+
+        pid = models.create_project("user-1", "Proj")
+        sid = models.create_terminal_session(user_id="user-1", project_id=pid)
+        with patch("database.command_events.notify_command_queued") as notify:
+            models.create_terminal_command(session_id=sid, user_id="user-1", command="ls")
+        notify.assert_called_once_with(user_id="user-1")
+
+    def test_pending_approval_command_does_not_notify(self, test_db):
+        from database import models
+
+        pid = models.create_project("user-1", "Proj")
+        sid = models.create_terminal_session(user_id="user-1", project_id=pid)
+        with patch("database.command_events.notify_command_queued") as notify:
+            models.create_terminal_command(session_id=sid, user_id="user-1", command="ls", status="pending_approval")
+        notify.assert_not_called()
+
+    def test_approval_to_queued_notifies_user(self, test_db):
+        from database import models
+
+        pid = models.create_project("user-1", "Proj")
+        sid = models.create_terminal_session(user_id="user-1", project_id=pid)
+        cid = models.create_terminal_command(session_id=sid, user_id="user-1", command="ls", status="pending_approval")
+        with patch("database.command_events.notify_command_queued") as notify:
+            models.update_terminal_command_for_approval(command_id=cid, status="queued")
+        notify.assert_called_once_with(user_id="user-1")
+
+
+class TestLongPollClaim:
+    async def test_claims_once_when_woken(self):
+        from main import _long_poll_claim
+
+        calls = []
+        hub = command_events.get_hub()
+
+        def claim():
+            calls.append(1)
+            return {"id": "cmd-1"} if len(calls) > 1 else None
+
+        async def publish_later():
+            await asyncio.sleep(0.05)
+            hub.publish(["user:u-wake"])
+
+        task = asyncio.create_task(publish_later())
+        cmd = await _long_poll_claim(claim, keys=["user:u-wake"], wait_s=5)
+        await task
+        assert cmd == {"id": "cmd-1"}
+        assert len(calls) == 2
+
+    async def test_returns_none_after_wait_without_events(self):
+        import main
+
+        calls = []
+
+        def claim():
+            calls.append(1)
+            return None
+
+        with patch.object(main, "CLAIM_REPOLL_SECONDS", 10.0):
+            cmd = await main._long_poll_claim(claim, keys=["user:u-idle"], wait_s=0.1)
+        assert cmd is None
+        # Initial attempt plus one re-check at the deadline; no 0.5s polling.
+        assert len(calls) == 2
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from database import models
 
 
@@ -70,3 +72,37 @@ def test_cursor_context_save_and_load(test_db):
     assert latest is not None
     assert latest["file_path"] == "/tmp/proj/main.py"
 
+
+
+def test_device_heartbeats_are_coalesced_into_one_update(test_db):
+    devices = []
+    for name in ("A", "B"):
+        pairing = models.create_device_pairing(user_id="user-1", name=name, platform="darwin")
+        devices.append(models.complete_device_pairing(pairing_code=pairing["pairing_code"]))
+
+    with patch("database.models._touch_at", return_value="2026-01-01T00:00:00+00:00"):
+        for _ in range(3):
+            for d in devices:
+                models.touch_device_heartbeat(d["device_id"])
+                assert models.get_device_by_token(d["device_token"])["id"] == d["device_id"]
+
+    with patch.object(test_db, "table", wraps=test_db.table) as table:
+        assert models.flush_pending_touches() == 2
+    table.assert_called_once_with("companion_devices")
+
+
+def test_heartbeats_from_different_seconds_keep_their_own_time(test_db):
+    devices = []
+    for name in ("A", "B"):
+        pairing = models.create_device_pairing(user_id="user-1", name=name, platform="darwin")
+        devices.append(models.complete_device_pairing(pairing_code=pairing["pairing_code"]))
+    for d, at in zip(devices, ("2026-01-01T00:00:00+00:00", "2026-01-01T00:00:05+00:00")):
+        with patch("database.models._touch_at", return_value=at):
+            models.touch_device_heartbeat(d["device_id"])
+
+    assert models.flush_pending_touches() == 2
+    beats = {r["id"]: r["last_heartbeat"] for r in test_db._tables["companion_devices"]}
+    assert beats == {
+        devices[0]["device_id"]: "2026-01-01T00:00:00+00:00",
+        devices[1]["device_id"]: "2026-01-01T00:00:05+00:00",
+    }
@@ -0,0 +1,234 @@
+"""
+Tests for local-agent/dispatch_local_agent.py (loaded from its path; the agent is
+a standalone script, not a package).
+"""
+from __future__ import annotations
+
+import http.client
+import importlib.util
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+_AGENT_PATH = Path(__file__).resolve().parents[2] / "local-agent" / "dispatch_local_agent.py"
+_spec = importlib.util.spec_from_file_location("dispatch_local_agent", _AGENT_PATH)
+agent = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = agent  # dataclasses resolve annotations through sys.modules
+_spec.loader.exec_module(agent)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.seen.append((self.path, self.client_address[1], body))
+        payload = json.dumps({"ok": True}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        # Close without announcing it, as a server dropping an idle keep-alive socket does.
+        self.close_connection = self.path == "/drop"
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def backend():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.seen = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestHttpPool:
+    def test_connections_are_reused(self, backend):
+        server, url = backend
+        pool = agent.HttpPool()
+        assert pool.request("POST", f"{url}/a", body=b"1")[0] == 200
+        assert pool.request("POST", f"{url}/b", body=b"2")[0] == 200
+        pool.close()
+        assert [p for p, _, _ in server.seen] == ["/a", "/b"]
+        assert server.seen[0][1] == server.seen[1][1]
+
+    def test_stale_connection_is_resent_on_a_fresh_one(self, backend):
+        server, url = backend
+        pool = agent.HttpPool()
+        pool.request("POST", f"{url}/drop")
+        time.sleep(0.05)
+        assert pool.request("POST", f"{url}/a", body=b"x") == (200, b'{"ok": true}')
+        pool.close()
+        assert [p for p, _, _ in server.seen] == ["/drop", "/a"]
+        assert server.seen[0][1] != server.seen[1][1]
+
+    @pytest.mark.parametrize("kwargs", [{"idempotent": False}, {"retries": 0}])
+    def test_stale_connection_is_not_resent_when_a_retry_could_repeat_the_call(self, backend, kwargs):
+        server, url = backend
+        pool = agent.HttpPool()
+        pool.request("POST", f"{url}/drop")
+        time.sleep(0.05)
+        with pytest.raises((http.client.HTTPException, OSError)):
+            pool.request("POST", f"{url}/claim", **kwargs)
+        pool.close()
+        assert [p for p, _, _ in server.seen] == ["/drop"]
+
+
+def _config(**overrides) -> "agent.Config":
+    values = dict(
+        backend_url="http://backend",
+        project_id=None,
+        project_name=None,
+        project_path=None,
+        auth_token=None,
+        agent_token="tok",
+        instance_token="inst",
+    )
+    values.update(overrides)
+    return agent.Config(**values)
+
+
+class TestLogUploader:
+    def _capture(self, monkeypatch, fail_first: int = 0) -> list[dict]:
+        posts: list[dict] = []
+        failures = iter(range(fail_first))
+
+        def fake_http_json(**kwargs):
+            posts.append(kwargs["body"])
+            if next(failures, None) is not None:
+                raise OSError("connection reset")
+            return {"success": True}
+
+        monkeypatch.setattr(agent, "_http_json", fake_http_json)
+        monkeypatch.setattr(agent.time, "sleep", lambda s: None)
+        return posts
+
+    def test_character_split_across_pipe_reads_is_carried_to_the_next_flush(self, monkeypatch):
+        posts = self._capture(monkeypatch)
+        # log_flush_bytes=1: every pipe read is uploaded on its own.
+        uploader = agent.LogUploader(_config(log_flush_bytes=1), "c1")
+        uploader.write("stdout", "aé".encode("utf-8")[:-1])
+        uploader.write("stdout", "é".encode("utf-8")[1:] + b"b\xe2\x82")
+        assert uploader.close() == 3
+        assert [p["chunks"] for p in posts] == [["a"], ["éb"], ["�"]]
+        assert [p["sequence_start"] for p in posts] == [0, 1, 2]
+
+    def test_streams_keep_their_own_carry(self, monkeypatch):
+        posts = self._capture(monkeypatch)
+        uploader = agent.LogUploader(_config(log_flush_bytes=1), "c1")
+        euro = "€".encode("utf-8")
+        uploader.write("stdout", euro[:1])
+        uploader.write("stderr", euro[:2])
+        uploader.write("stdout", euro[1:])
+        uploader.write("stderr", euro[2:])
+        uploader.close()
+        assert [(p["stream"], p["chunks"]) for p in posts] == [("stdout", ["€"]), ("stderr", ["€"])]
+
+    def test_failed_upload_is_retried_with_the_same_sequence_start(self, monkeypatch):
+        posts = self._capture(monkeypatch, fail_first=2)
+        uploader = agent.LogUploader(_config(log_flush_bytes=1), "c1", sequence_start=7)
+        uploader.write("stdout", b"one\n")
+        uploader.write("stdout", b"two\n")
+        assert uploader.close() == 9
+        assert [(p["sequence_start"], p["chunks"]) for p in posts] == [
+            (7, ["one\n"]), (7, ["one\n"]), (7, ["one\n"]), (8, ["two\n"]),
+        ]
+
+    def test_batch_dropped_after_retries_keeps_later_sequences_in_place(self, monkeypatch):
+        posts = self._capture(monkeypatch, fail_first=3)
+        uploader = agent.LogUploader(_config(log_flush_bytes=1, log_upload_retries=2), "c1")
+        uploader.write("stdout", b"lost\n")
+        uploader.write("stdout", b"kept\n")
+        assert uploader.close() == 2
+        assert posts[-1] == {"sequence_start": 1, "stream": "stdout", "chunks": ["kept\n"]}
+
+
+class TestCommandPool:
+    def _pool(self, **cfg):
+        lock = threading.Lock()
+        running: dict[str, int] = {}
+        peaks = {"total": 0}
+        order: list[str] = []
+
+        def run(_cfg, cmd, _state):
+            project = cmd["project_id"]
+            with lock:
+                order.append(cmd["id"])
+                running[project] = running.get(project, 0) + 1
+                peaks[project] = max(peaks.get(project, 0), running[project])
+                peaks["total"] = max(peaks["total"], sum(running.values()))
+            time.sleep(0.02)
+            with lock:
+                running[project] -= 1
+
+        return agent.CommandPool(_config(**cfg), run=run), peaks, order
+
+    @staticmethod
+    def _claim_all(pool, cmds) -> None:
+        # What the daemon's main loop does: claim only once a slot is free.
+        for cmd in cmds:
+            pool.wait_for_capacity()
+            pool.submit(cmd)
+        assert pool.wait_idle(5.0)
+
+    def test_never_runs_more_than_max_concurrent(self):
+        pool, peaks, order = self._pool(max_concurrent=2, max_per_project=10)
+        cmds = [{"id": f"c{i}", "session_id": f"s{i}", "project_id": f"p{i}"} for i in range(6)]
+        self._claim_all(pool, cmds)
+        assert peaks["total"] == 2
+        assert sorted(order) == sorted(c["id"] for c in cmds)
+        assert pool.running_ids() == []
+
+    def test_limits_commands_per_project(self):
+        pool, peaks, _ = self._pool(max_concurrent=4, max_per_project=1)
+        cmds = [{"id": f"c{i}", "session_id": f"s{i}", "project_id": "p"} for i in range(3)]
+        cmds.append({"id": "other", "session_id": "s-other", "project_id": "q"})
+        self._claim_all(pool, cmds)
+        assert peaks["p"] == 1 and peaks["q"] == 1
+
+    def test_runs_a_session_one_command_at_a_time_in_claim_order(self):
+        pool, peaks, order = self._pool(max_concurrent=4, max_per_project=4)
+        cmds = [{"id": f"c{i}", "session_id": "s", "project_id": "p"} for i in range(4)]
+        self._claim_all(pool, cmds)
+        assert order == ["c0", "c1", "c2", "c3"]
+        assert peaks["p"] == 1
+
+
+class TestChunkBytes:
+    def test_multibyte_character_at_a_boundary_moves_to_the_next_chunk(self):
+        data = ("aaa" + "é" + "€" * 2).encode("utf-8")
+        assert agent._chunk_bytes(data, 4) == ["aaa", "é", "€", "€"]
+
+    def test_cuts_after_a_newline_in_the_second_half_of_the_window(self):
+        assert agent._chunk_bytes(b"abcd\nefghij", 8) == ["abcd\n", "efghij"]
+        # A newline in the first half would leave a tiny chunk; cut at the limit instead.
+        assert agent._chunk_bytes(b"a\nbcdefghij", 8) == ["a\nbcdefg", "hij"]
+
+    def test_invalid_bytes_are_replaced(self):
+        assert agent._chunk_bytes(b"ok\xff\xfe", 10) == ["ok\ufffd\ufffd"]
+
+    def test_utf8_tail_start_finds_an_incomplete_trailing_character(self):
+        euro = "€".encode("utf-8")
+        assert agent._utf8_tail_start(b"ab") == 2
+        assert agent._utf8_tail_start(b"ab" + euro) == 5
+        assert agent._utf8_tail_start(b"ab" + euro[:2]) == 2
+        assert agent._utf8_tail_start(b"ab" + euro[:1]) == 2
+
+    @settings(max_examples=200, deadline=None)
+    @given(text=st.text(min_size=0, max_size=300), max_bytes=st.integers(min_value=4, max_value=64))
+    def test_chunks_rebuild_the_text_within_the_limit(self, text, max_bytes):
+        chunks = agent._chunk_bytes(text.encode("utf-8"), max_bytes)
+        assert "".join(chunks) == text
+        assert all(0 < len(c.encode("utf-8")) <= max_bytes for c in chunks)
@@ -0,0 +1,42 @@
+"""Tests for database/log_archive.py (compacted terminal output)."""
+from __future__ import annotations
+
+import pytest
+
+from database import log_archive
+
+
+def _rows():
+    return [
+        {"command_id": "c1", "sequence": 2, "stream": "stdout", "chunk": "done ✓\n"},
+        {"command_id": "c1", "sequence": 0, "stream": "stdout", "chunk": "building…\n"},
+        {"command_id": "c1", "sequence": 1, "stream": "stderr", "chunk": "warning: x\n"},
+        {"command_id": "c1", "sequence": 3, "stream": "stdout", "chunk": ""},
+    ]
+
+
+def test_pack_makes_one_archive_per_stream():
+    archives = log_archive.pack("c1", _rows())
+    assert sorted(a["stream"] for a in archives) == ["stderr", "stdout"]
+    stdout = next(a for a in archives if a["stream"] == "stdout")
+    assert [s for s, _ in stdout["sequences"]] == [0, 2, 3]
+    assert stdout["raw_bytes"] == len("building…\ndone ✓\n".encode("utf-8"))
+    assert stdout["chunk_count"] == 3
+
+
+def test_unpack_restores_chunks_in_sequence_order():
+    rows = log_archive.unpack(log_archive.pack("c1", _rows()))
+    assert [(r["sequence"], r["stream"], r["chunk"]) for r in rows] == [
+        (0, "stdout", "building…\n"),
+        (1, "stderr", "warning: x\n"),
+        (2, "stdout", "done ✓\n"),
+        (3, "stdout", ""),
+    ]
+    assert all(r["command_id"] == "c1" for r in rows)
+    assert [r["byte_offset"] for r in rows] == [0, 12, 23, 32]
+
+
+def test_unpack_rejects_unknown_encoding():
+    archive = log_archive.pack("c1", _rows())[0]
+    with pytest.raises(ValueError):
+        log_archive.unpack([{**archive, "encoding": "zstd"}])
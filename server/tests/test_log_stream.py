@@ -0,0 +1,181 @@
+"""
+Tests for services/log_stream.py and the SSE log streaming endpoint.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from unittest.mock import patch
+
+os.environ.setdefault("DEVELOPMENT_MODE", "true")
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+from services.log_stream import LogStreamHub
+
+
+def _parse_sse(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.split("\n\n"):
+        lines = [l for l in block.splitlines() if l and not l.startswith(":")]
+        if not lines:
+            continue
+        fields = dict(l.split(": ", 1) for l in lines)
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestLogStreamHub:
+    async def test_publish_reaches_every_subscriber(self):
+        hub = LogStreamHub()
+        with hub.subscribe("c1") as a, hub.subscribe("c1") as b:
+            hub.publish_chunks("c1", sequence_start=0, stream="stdout", chunks=["x", "y"])
+            for s in (a, b):
+                assert await s.wait(1.0) is True
+                entries, gap = s.read_after(-1)
+                assert [e["chunk"] for e in entries] == ["x", "y"]
+                assert gap is False
+
+    async def test_unwatched_command_is_not_buffered(self):
+        hub = LogStreamHub()
+        hub.publish_chunks("c1", sequence_start=0, stream="stdout", chunks=["x"])
+        assert hub.channel_count() == 0
+
+    async def test_retried_sequences_are_ignored(self):
+        hub = LogStreamHub()
+        with hub.subscribe("c1") as s:
+            hub.publish_chunks("c1", sequence_start=0, stream="stdout", chunks=["a", "b"])
+            hub.publish_chunks("c1", sequence_start=0, stream="stdout", chunks=["a", "b"])
+            entries, _ = s.read_after(-1)
+        assert [e["sequence"] for e in entries] == [0, 1]
+
+    async def test_gap_reported_when_buffer_overflowed(self):
+        hub = LogStreamHub(buffer_chunks=2)
+        with hub.subscribe("c1") as s:
+            hub.publish_chunks("c1", sequence_start=0, stream="stdout", chunks=["a", "b", "c"])
+            entries, gap = s.read_after(-1)
+        assert [e["sequence"] for e in entries] == [1, 2]
+        assert gap is True
+
+    async def test_channel_dropped_after_last_viewer_leaves(self):
+        hub = LogStreamHub()
+        s = hub.subscribe("c1")
+        hub.publish_complete("c1", status="completed", exit_code=0)
+        assert s.final == {"status": "completed", "exit_code": 0}
+        s.close()
+        assert hub.channel_count() == 0
+
+    async def test_concurrent_refreshes_share_one_read(self):
+        hub = LogStreamHub()
+        calls = []
+
+        async def load(after):
+            calls.append(after)
+            await asyncio.sleep(0.01)
+            return [{"sequence": 0, "chunk": "a"}, {"sequence": 1, "chunk": "b"}], None
+
+        with hub.subscribe("c1") as a, hub.subscribe("c1") as b:
+            results = await asyncio.gather(a.refresh(-1, load), b.refresh(0, load))
+            assert [[r["chunk"] for r in rows] for rows, _ in results] == [["a", "b"], ["a", "b"]]
+            assert calls == [-1]
+            # The rows land in the shared buffer for viewers that did not ask.
+            assert [e["chunk"] for e in b.read_after(0)[0]] == ["b"]
+
+    async def test_recent_or_final_reads_are_reused(self):
+        hub = LogStreamHub()
+        calls = []
+        final = None
+
+        async def load(after):
+            calls.append(after)
+            return [], final
+
+        with hub.subscribe("c1") as a, hub.subscribe("c1") as b:
+            await a.refresh(4, load, max_age=30.0)
+            await b.refresh(4, load, max_age=30.0)
+            assert calls == [4]
+            await b.refresh(4, load, max_age=0.0)
+            await a.refresh(3, load, max_age=30.0)
+            assert calls == [4, 4, 3]
+
+            final = {"status": "completed", "exit_code": 0}
+            await a.refresh(4, load)
+            assert await b.wait(1.0) is True
+            assert b.final == final
+            assert await b.refresh(4, load) == ([], final)
+            assert calls == [4, 4, 3, 4]
+
+
+def _seed_command() -> str:
+    from database import models
+
+    pid = models.create_project("test-user-123", "Proj")
+    sid = models.create_terminal_session(user_id="test-user-123", project_id=pid)
+    return models.create_terminal_command(session_id=sid, user_id="test-user-123", command="make")
+
+
+class TestStreamEndpoint:
+    def test_completed_command_streams_backlog_then_end(self, test_db):
+        from fastapi.testclient import TestClient
+        from database import models
+        from main import app
+
+        cid = _seed_command()
+        models.append_terminal_log_chunks(command_id=cid, sequence_start=0, stream="stdout", chunks=["a", "b"])
+        models.complete_terminal_command(command_id=cid, status="completed", exit_code=0)
+
+        resp = TestClient(app).get(f"/api/terminal/commands/{cid}/stream")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(resp.text)
+        assert [(e, d.get("chunk")) for e, d in events[:2]] == [("log", "a"), ("log", "b")]
+        assert events[-1] == ("end", {"command_id": cid, "status": "completed", "exit_code": 0})
+
+    def test_resumes_after_last_event_id(self, test_db):
+        from fastapi.testclient import TestClient
+        from database import models
+        from main import app
+
+        cid = _seed_command()
+        models.append_terminal_log_chunks(command_id=cid, sequence_start=0, stream="stdout", chunks=["a", "b", "c"])
+        models.complete_terminal_command(command_id=cid, status="failed", exit_code=2)
+
+        resp = TestClient(app).get(f"/api/terminal/commands/{cid}/stream", headers={"Last-Event-ID": "1"})
+        events = _parse_sse(resp.text)
+        assert [d["chunk"] for e, d in events if e == "log"] == ["c"]
+
+    async def test_live_chunks_come_from_hub_not_db(self, test_db):
+        import main
+        from database import models
+        from services import log_stream
+
+        cid = _seed_command()
+        hub = LogStreamHub()
+        body = []
+
+        async def consume():
+            async for part in main._terminal_log_events(cid, -1):
+                body.append(part)
+
+        with patch.object(log_stream, "_hub", hub), patch.object(main, "LOG_STREAM_IDLE_SECONDS", 30.0):
+            task = asyncio.create_task(consume())
+            while hub.channel_count() == 0:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+
+            with patch("database.models.get_terminal_logs_for_command",
+                       side_effect=AssertionError("db read")) as reads:
+                hub.publish_chunks(cid, sequence_start=0, stream="stdout", chunks=["live"])
+                await asyncio.sleep(0.05)
+                assert reads.call_count == 0
+
+            models.append_terminal_log_chunks(command_id=cid, sequence_start=0, stream="stdout", chunks=["live"])
+            models.complete_terminal_command(command_id=cid, status="completed", exit_code=0)
+            hub.publish_complete(cid, status="completed", exit_code=0)
+            await asyncio.wait_for(task, 2.0)
+
+        events = _parse_sse("".join(body))
+        assert [d["chunk"] for e, d in events if e == "log"] == ["live"]
+        assert events[-1][0] == "end"
+        assert hub.channel_count() == 0
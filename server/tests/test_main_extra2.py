@@ -14,6 +14,7 @@ Second batch of main.py route tests, targeting previously uncovered lines:
 """
 from __future__ import annotations
 
+import asyncio
 import os
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -23,7 +24,7 @@ os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
 os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
 
 from fastapi.testclient import TestClient
-from main import app
+from main import MAX_LOG_PAGE, app
 
 client = TestClient(app)
 USER_ID = "test-user-123"
@@ -199,11 +200,22 @@ class TestDeviceTokenRoutes:
         assert response.status_code == 200
         assert response.json()["command"]["id"] == "cmd-1"
 
+    def test_device_claim_next_counts_as_heartbeat(self):
+        with patch("database.models.get_device_by_token", return_value=FAKE_DEVICE), \
+             patch("database.models.claim_next_queued_command_for_device", return_value=None), \
+             patch("database.models.touch_device_heartbeat") as touch:
+            response = client.post("/api/device/claim-next",
+                                   headers=DEVICE_TOKEN_HEADERS,
+                                   json={"wait_seconds": 0})
+        assert response.status_code == 200
+        assert touch.call_count == 2
+        touch.assert_called_with(FAKE_DEVICE["id"])
+
     def test_device_append_logs(self):
         cmd = {"id": "cmd-1", "user_id": USER_ID}
         with patch("database.models.get_device_by_token", return_value=FAKE_DEVICE), \
              patch("database.models.get_terminal_command", return_value=cmd), \
-             patch("database.models.append_terminal_log_chunk"), \
+             patch("database.models.append_terminal_log_chunks", return_value=2), \
              patch("database.models.touch_device_heartbeat"):
             response = client.post("/api/device/commands/cmd-1/append-logs",
                                    headers=DEVICE_TOKEN_HEADERS,
@@ -296,6 +308,32 @@ class TestAgentTokenRoutes:
         assert response.status_code == 200
         assert response.json()["success"] is True
 
+    def test_local_agent_heartbeat_keeps_running_commands_alive(self):
+        instance = {"id": "inst-1", "user_id": USER_ID}
+        with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
+             patch("database.models.get_instance_by_id", return_value=instance), \
+             patch("database.models.update_instance_heartbeat"), \
+             patch("database.models.renew_command_leases", return_value=["cmd-1"]) as renew:
+            response = client.post("/api/agent/local/heartbeat",
+                                   headers=AGENT_TOKEN_HEADERS,
+                                   json={"instance_id": "inst-1", "running_command_ids": ["cmd-1"]})
+        assert response.status_code == 200
+        renew.assert_called_once_with(user_id=USER_ID, command_ids=["cmd-1"])
+
+    def test_local_agent_renew_lease(self):
+        with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
+             patch("database.models.renew_command_leases", return_value=["cmd-1"]) as renew:
+            response = client.post("/api/agent/local/commands/cmd-1/renew", headers=AGENT_TOKEN_HEADERS)
+        assert response.status_code == 200
+        assert response.json()["lease_seconds"] > 0
+        renew.assert_called_once_with(user_id=USER_ID, command_ids=["cmd-1"])
+
+    def test_local_agent_renew_lost_lease_returns_409(self):
+        with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
+             patch("database.models.renew_command_leases", return_value=[]):
+            response = client.post("/api/agent/local/commands/cmd-1/renew", headers=AGENT_TOKEN_HEADERS)
+        assert response.status_code == 409
+
     def test_local_agent_heartbeat_instance_not_found(self):
         with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
              patch("database.models.get_instance_by_id", return_value=None):
@@ -315,16 +353,30 @@ class TestAgentTokenRoutes:
         assert response.status_code == 200
         assert response.json()["command"] is None
 
+    def test_local_agent_claim_next_counts_as_heartbeat(self):
+        instance = {"id": "inst-1", "user_id": USER_ID}
+        with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
+             patch("database.models.get_instance_by_id", return_value=instance), \
+             patch("database.models.claim_next_queued_command_for_user", return_value=None), \
+             patch("database.models.touch_instance_heartbeat") as touch:
+            response = client.post("/api/agent/local/claim-next",
+                                   headers=AGENT_TOKEN_HEADERS,
+                                   json={"instance_id": "inst-1", "wait_seconds": 0})
+        assert response.status_code == 200
+        assert touch.call_count == 2
+        touch.assert_called_with("inst-1")
+
     def test_local_agent_append_logs(self):
         cmd = {"id": "cmd-1", "user_id": USER_ID}
         with patch("database.models.get_user_id_for_agent_token", return_value=USER_ID), \
              patch("database.models.get_terminal_command", return_value=cmd), \
-             patch("database.models.append_terminal_log_chunk"):
+             patch("database.models.append_terminal_log_chunks", return_value=1) as append:
             response = client.post("/api/agent/local/commands/cmd-1/append-logs",
                                    headers=AGENT_TOKEN_HEADERS,
                                    json={"sequence_start": 0, "stream": "stdout", "chunks": ["output"]})
         assert response.status_code == 200
         assert response.json()["next_sequence"] == 1
+        append.assert_called_once_with(command_id="cmd-1", sequence_start=0, stream="stdout", chunks=["output"])
 
     def test_local_agent_complete_command(self):
         cmd = {"id": "cmd-1", "user_id": USER_ID}
@@ -430,10 +482,44 @@ class TestTerminalRoutes:
     def test_get_terminal_command_logs(self):
         logs = [{"sequence": 0, "stream": "stdout", "chunk": "hello"}]
         with patch("database.models.get_terminal_command", return_value=self._cmd()), \
-             patch("database.models.get_terminal_logs_for_command", return_value=logs):
+             patch("database.models.get_terminal_logs_for_command", return_value=logs), \
+             patch("database.models.get_terminal_log_size", return_value={"chunks": 1, "bytes": 5}):
             response = client.get("/api/terminal/commands/cmd-1/logs")
         assert response.status_code == 200
         assert len(response.json()["logs"]) == 1
+        assert response.headers["X-Log-Total-Chunks"] == "1"
+        assert response.headers["X-Log-Total-Bytes"] == "5"
+
+    def test_get_terminal_command_logs_tail_and_range(self):
+        logs = [{"sequence": 9, "stream": "stdout", "chunk": "bye", "byte_offset": 40}]
+        with patch("database.models.get_terminal_command", return_value=self._cmd()), \
+             patch("database.models.get_terminal_log_tail", return_value=logs) as tail, \
+             patch("database.models.get_terminal_log_range", return_value=logs) as ranged, \
+             patch("database.models.get_terminal_log_size", return_value={"chunks": 10, "bytes": None}):
+            by_chunks = client.get("/api/terminal/commands/cmd-1/logs?tail=50000")
+            by_lines = client.get("/api/terminal/commands/cmd-1/logs?tail_lines=20")
+            by_bytes = client.get("/api/terminal/commands/cmd-1/logs?byte_start=40&byte_end=43")
+        assert [r.status_code for r in (by_chunks, by_lines, by_bytes)] == [200, 200, 200]
+        assert tail.call_args_list[0].kwargs == {"command_id": "cmd-1", "chunks": MAX_LOG_PAGE, "compacted": False}
+        assert tail.call_args_list[1].kwargs == {"command_id": "cmd-1", "lines": 20, "compacted": False}
+        ranged.assert_called_once_with(command_id="cmd-1", byte_start=40, byte_end=43, limit=200, compacted=False)
+        assert by_chunks.headers["X-Log-Total-Chunks"] == "10"
+        assert "X-Log-Total-Bytes" not in by_chunks.headers
+
+    def test_get_terminal_command_logs_of_compacted_command_reads_archive(self):
+        cmd = {**self._cmd(), "logs_compacted_at": "2026-01-01T00:00:00+00:00"}
+        with patch("database.models.get_terminal_command", return_value=cmd), \
+             patch("database.models.get_terminal_logs_for_command", return_value=[]) as page, \
+             patch("database.models.get_terminal_log_size", return_value={"chunks": 0, "bytes": 0}) as size:
+            response = client.get("/api/terminal/commands/cmd-1/logs")
+        assert response.status_code == 200
+        assert page.call_args.kwargs["compacted"] is True
+        size.assert_called_once_with("cmd-1", compacted=True)
+
+    def test_get_terminal_command_logs_rejects_mixed_modes(self):
+        for query in ("tail=5&after_sequence=3", "byte_end=10", "tail=-1"):
+            response = client.get(f"/api/terminal/commands/cmd-1/logs?{query}")
+            assert response.status_code == 400, query
 
 
 # ---------------------------------------------------------------------------
@@ -697,3 +783,32 @@ class TestCreateTaskAutoDispatch:
         assert response.status_code == 200
         assert response.json()["task_id"] == "task-new"
         # background_tasks.add_task was called (dispatch queued)
+
+
+async def test_reaper_closes_live_streams_of_expired_commands():
+    import main
+
+    hub = MagicMock()
+    with patch.object(main, "REAPER_INTERVAL_SECONDS", 0), \
+         patch("database.models.expire_stale_running_commands",
+               side_effect=[[{"id": "cmd-1", "user_id": USER_ID}], RuntimeError("stop")]), \
+         patch("main.log_stream.get_hub", return_value=hub), \
+         patch("main.logger.warning", side_effect=asyncio.CancelledError):
+        with pytest.raises(asyncio.CancelledError):
+            await main._reap_stale_commands_forever()
+    hub.publish_complete.assert_called_once_with("cmd-1", status="failed", exit_code=-1)
+
+
+async def test_log_compaction_drains_full_batches():
+    import main
+
+    full = {"compacted": 1, "dropped": 1, "archives_expired": 0}
+    partial = {"compacted": 1, "dropped": 0, "archives_expired": 0}
+    compact = MagicMock(side_effect=[full, partial, RuntimeError("stop")])
+    with patch.object(main, "LOG_COMPACTION_INTERVAL_SECONDS", 0), \
+         patch("database.models.LOG_COMPACT_BATCH", 2), \
+         patch("database.models.compact_terminal_logs", compact), \
+         patch("main.logger.warning", side_effect=asyncio.CancelledError):
+        with pytest.raises(asyncio.CancelledError):
+            await main._compact_logs_forever()
+    assert compact.call_count == 3
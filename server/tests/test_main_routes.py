@@ -23,6 +23,7 @@ os.environ.setdefault("DEVELOPMENT_MODE", "true")
 os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
 os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
 
+from database import change_counter
 from main import app
 
 client = TestClient(app)
@@ -119,6 +120,30 @@ class TestDashboard:
         response = client.get("/api/dashboard/other-user")
         assert response.status_code == 403
 
+    def test_get_dashboard_pages_tasks(self):
+        task = {**_make_task(), "created_at": "2026-01-02T00:00:00+00:00"}
+        with patch("database.models.get_user_projects_with_task_counts", return_value=[]), \
+             patch("database.models.get_user_tasks", return_value=[task]) as get_tasks:
+            response = client.get(f"/api/dashboard/{USER_ID}?limit=1")
+        body = response.json()
+        assert get_tasks.call_args.kwargs == {"limit": 1, "cursor": None, "updated_since": None}
+        assert body["next_cursor"]
+        assert body["synced_at"]
+
+    def test_get_dashboard_delta_mode(self):
+        task = {**_make_task(), "updated_at": "2026-01-03T00:00:00+00:00"}
+        with patch("database.models.get_user_projects_with_task_counts", return_value=[]), \
+             patch("database.models.get_user_tasks", return_value=[task]) as get_tasks:
+            response = client.get(f"/api/dashboard/{USER_ID}?limit=1&updated_since=2026-01-01T00:00:00Z")
+        assert get_tasks.call_args.kwargs["updated_since"] == "2026-01-01T00:00:00+00:00"
+        # Delta pages continue on updated_at rather than created_at.
+        from database import pagination
+        assert pagination.decode_cursor(response.json()["next_cursor"]) == (task["updated_at"], task["id"])
+
+    def test_get_dashboard_rejects_bad_updated_since(self):
+        response = client.get(f"/api/dashboard/{USER_ID}?updated_since=yesterday")
+        assert response.status_code == 400
+
 
 # ---------------------------------------------------------------------------
 # Project tasks
@@ -189,6 +214,15 @@ class TestCallSessions:
         assert response.status_code == 200
         assert len(response.json()["sessions"]) == 1
 
+    def test_get_call_history_passes_paging(self):
+        with patch("database.models.get_user_call_history", return_value=[]) as history:
+            response = client.get(f"/api/call-sessions/{USER_ID}?limit=5&updated_since=2026-01-01T00:00:00")
+        assert response.status_code == 200
+        assert response.json()["next_cursor"] is None
+        history.assert_called_once_with(
+            USER_ID, limit=5, cursor=None, updated_since="2026-01-01T00:00:00+00:00"
+        )
+
     def test_get_call_history_forbidden(self):
         response = client.get("/api/call-sessions/other-user")
         assert response.status_code == 403
@@ -252,13 +286,28 @@ class TestUnifiedEndpoints:
         assert len(response.json()["commands"]) == 1
 
     def test_get_unified_timeline_filtered_by_project(self):
-        cmds = [
-            {**_make_command("cmd-1"), "project_id": "proj-1"},
-            {**_make_command("cmd-2"), "project_id": "proj-2"},
-        ]
-        with patch("database.models.list_recent_terminal_commands_for_user", return_value=cmds):
-            response = client.get("/api/unified/timeline?project_id=proj-1")
+        cmds = [{**_make_command("cmd-1"), "project_id": "proj-1"}]
+        with patch("database.models.list_recent_terminal_commands_for_user", return_value=cmds) as list_cmds:
+            response = client.get("/api/unified/timeline?project_id=proj-1&limit=5")
         assert len(response.json()["commands"]) == 1
+        assert response.json()["next_cursor"] is None
+        assert list_cmds.call_args.kwargs["project_id"] == "proj-1"
+        assert list_cmds.call_args.kwargs["limit"] == 5
+
+    def test_get_unified_timeline_returns_cursor_for_full_page(self):
+        cmds = [{**_make_command("cmd-1"), "created_at": "2026-01-01T00:00:00+00:00"}]
+        with patch("database.models.list_recent_terminal_commands_for_user", return_value=cmds):
+            response = client.get("/api/unified/timeline?limit=1")
+        cursor = response.json()["next_cursor"]
+        assert cursor
+        with patch("database.models.list_recent_terminal_commands_for_user", return_value=[]) as list_cmds:
+            response = client.get(f"/api/unified/timeline?limit=1&cursor={cursor}")
+        assert list_cmds.call_args.kwargs["cursor"] == cursor
+        assert response.json()["next_cursor"] is None
+
+    def test_get_unified_timeline_rejects_bad_cursor(self):
+        response = client.get("/api/unified/timeline?cursor=not-a-cursor")
+        assert response.status_code == 400
 
     def test_get_unified_conversation(self):
         with patch("database.models.list_conversation_turns_for_user", return_value=[{"id": "turn-1"}]):
@@ -266,6 +315,38 @@ class TestUnifiedEndpoints:
         assert response.status_code == 200
         assert len(response.json()["turns"]) == 1
 
+    def test_timeline_answers_304_until_a_command_changes(self):
+        with patch("database.models.list_recent_terminal_commands_for_user", return_value=[_make_command()]) as list_cmds:
+            first = client.get("/api/unified/timeline?project_id=proj-1")
+            etag = first.headers["etag"]
+            again = client.get("/api/unified/timeline?project_id=proj-1", headers={"If-None-Match": etag})
+            other_view = client.get("/api/unified/timeline?project_id=proj-2", headers={"If-None-Match": etag})
+            change_counter.bump("commands", user_id=USER_ID)
+            changed = client.get("/api/unified/timeline?project_id=proj-1", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.headers["etag"] == etag
+        assert other_view.status_code == 200
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+        assert list_cmds.call_count == 3
+
+    def test_conversation_ignores_other_users_writes(self):
+        with patch("database.models.list_conversation_turns_for_user", return_value=[]) as list_turns:
+            etag = client.get("/api/unified/conversation").headers["etag"]
+            change_counter.bump("conversation", user_id="someone-else")
+            change_counter.bump("commands", user_id=USER_ID)
+            response = client.get("/api/unified/conversation", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert list_turns.call_count == 1
+
+    def test_terminal_sessions_304_skips_ownership_read(self):
+        with patch("database.models.get_project_by_id", return_value=_make_project()) as get_project, \
+             patch("database.models.list_terminal_sessions_for_project", return_value=[]):
+            etag = client.get("/api/terminal/sessions/proj-1").headers["etag"]
+            response = client.get("/api/terminal/sessions/proj-1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert get_project.call_count == 1
+
 
 # ---------------------------------------------------------------------------
 # Unified command approval
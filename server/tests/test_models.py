@@ -332,24 +332,39 @@ class TestComputeDefaultProjectFilePath:
 # ---------------------------------------------------------------------------
 
 class TestUserOperations:
-    def test_upsert_user_inserts_new_user(self):
-        sb = _mock_sb(data_single=None)  # no existing user
+    def test_upsert_user_is_a_single_upsert(self):
+        sb = _mock_sb()
         with patch("database.models.get_sb", return_value=sb):
             models.upsert_user("user-new", "new@example.com")
-        sb.table.return_value.insert.assert_called_once()
+        chain = sb.table.return_value
+        chain.upsert.assert_called_once_with({"id": "user-new", "email": "new@example.com"}, on_conflict="id")
+        chain.select.assert_not_called()
+        chain.insert.assert_not_called()
 
-    def test_upsert_user_updates_existing_user(self):
-        sb = _mock_sb(data_single={"id": "user-existing"})
+    def test_upsert_user_includes_phone_when_provided(self):
+        sb = _mock_sb()
         with patch("database.models.get_sb", return_value=sb):
-            models.upsert_user("user-existing", "existing@example.com")
-        sb.table.return_value.update.assert_called()
+            models.upsert_user("u1", "a@b.com", phone_number="+15550001111")
+        upsert_payload = sb.table.return_value.upsert.call_args[0][0]
+        assert upsert_payload["phone_number"] == "+15550001111"
 
-    def test_upsert_user_includes_phone_when_provided(self):
-        sb = _mock_sb(data_single=None)
+    def test_upsert_user_skips_known_unchanged_user(self):
+        sb = _mock_sb()
         with patch("database.models.get_sb", return_value=sb):
             models.upsert_user("u1", "a@b.com", phone_number="+15550001111")
-        insert_payload = sb.table.return_value.insert.call_args[0][0]
-        assert insert_payload["phone_number"] == "+15550001111"
+            models.upsert_user("u1", "a@b.com", phone_number="+15550001111")
+            models.upsert_user("u1", "a@b.com")  # omitted phone keeps the stored one
+        assert sb.table.return_value.upsert.call_count == 1
+
+    def test_upsert_user_writes_when_details_change(self):
+        sb = _mock_sb()
+        with patch("database.models.get_sb", return_value=sb):
+            models.upsert_user("u1", "a@b.com")
+            models.upsert_user("u1", "new@b.com")
+            models.upsert_user("u1", "new@b.com", telegram_chat_id=42)
+        chain = sb.table.return_value
+        assert chain.upsert.call_count == 3
+        assert chain.upsert.call_args[0][0]["telegram_chat_id"] == "42"
 
     def test_get_user_id_by_telegram_chat_id_found(self):
         sb = _mock_sb([{"id": "user-123"}])
@@ -421,6 +436,51 @@ class TestProjectOperations:
         calls = [str(c) for c in sb.table.call_args_list]
         assert any("projects" in c for c in calls)
 
+    def test_delete_project_fallback_removes_everything_in_batches(self, test_db, tmp_path, monkeypatch):
+        from database import sidecar_store
+
+        monkeypatch.setenv("DISPATCH_SIDECAR_PATH", str(tmp_path / "sidecar.db"))
+        monkeypatch.setattr(models, "_DELETE_BATCH", 2)
+        monkeypatch.setattr(models, "_DELETE_LOGS_BATCH", 2)
+        cmd_ids = [f"c{i}" for i in range(5)]
+        test_db._tables.update({
+            "projects": [{"id": "p1"}, {"id": "p2"}],
+            "terminal_sessions": [{"id": "s1", "project_id": "p1"}, {"id": "s2", "project_id": "p2"}],
+            "terminal_commands": [{"id": c, "session_id": "s1"} for c in cmd_ids] + [{"id": "keep", "session_id": "s2"}],
+            "terminal_logs": [{"id": f"l-{c}", "command_id": c} for c in cmd_ids + ["keep"]],
+            "tasks": [{"id": "t1", "project_id": "p1"}],
+            "agent_executions": [{"id": "e1", "task_id": "t1"}, {"id": "e2", "task_id": "other", "terminal_command_id": "c0"}],
+            "instances": [{"id": "i1", "project_id": "p1"}],
+        })
+        sidecar_store.add_conversation_turn(
+            user_id="u1", project_id="p1", session_id="s1", command_id=None, role="user", turn_type="text", content="hi"
+        )
+        sidecar_store.set_command_risk(command_id="c3", user_id="u1", risk_level="SAFE", risk_reason=None)
+
+        counts = models.delete_project("p1")
+
+        assert counts["terminal_logs"] == 5 and counts["terminal_commands"] == 5
+        assert counts["conversation_turns"] == 1 and counts["command_risk"] == 1
+        assert [r["id"] for r in test_db._tables["projects"]] == ["p2"]
+        assert [r["id"] for r in test_db._tables["terminal_commands"]] == ["keep"]
+        assert [r["id"] for r in test_db._tables["terminal_logs"]] == ["l-keep"]
+        assert test_db._tables["agent_executions"] == [{"id": "e2", "task_id": "other", "terminal_command_id": None}]
+        assert test_db._tables["instances"] == [] and test_db._tables["tasks"] == []
+        assert sidecar_store.get_command_risk("c3") is None
+
+    def test_delete_project_uses_cascade_rpc(self, test_db, tmp_path, monkeypatch):
+        from database import sidecar_store
+
+        monkeypatch.setenv("DISPATCH_SIDECAR_PATH", str(tmp_path / "sidecar.db"))
+        sidecar_store.set_command_risk(command_id="c1", user_id="u1", risk_level="SAFE", risk_reason=None)
+        test_db.rpc_handlers["delete_project_cascade"] = lambda p_project_id: {
+            "projects": 1, "terminal_commands": 1, "command_ids": ["c1"],
+        }
+        with patch.object(test_db, "table", side_effect=AssertionError("no per-table calls")):
+            counts = models.delete_project("p1")
+        assert counts["projects"] == 1 and counts["command_risk"] == 1
+        assert "command_ids" not in counts
+
     def test_get_user_tasks_flattens_project_name(self):
         fake_tasks = [{"id": "t1", "projects": {"name": "MyApp"}, "description": "fix bug"}]
         sb = _mock_sb(fake_tasks)
@@ -494,6 +554,34 @@ class TestUserPreferences:
             result = models.get_terminal_access_for_user("user-1")
         assert result is True
 
+    def test_preferences_are_cached_and_bootstrapped_once(self):
+        sb = self._prefs_sb({"user_id": "user-1", "default_provider": "claude"})
+        with patch("database.models.get_sb", return_value=sb):
+            assert models.get_default_provider_for_user("user-1") == "claude"
+            assert models.get_terminal_access_for_user("user-1") is False
+            models.get_project_base_path_for_user("user-1")
+        chain = sb.table.return_value
+        assert chain.upsert.call_count == 1
+        assert chain.select.call_count == 1
+
+    def test_set_writes_through_to_cached_row(self):
+        sb = self._prefs_sb({"user_id": "user-1", "default_provider": "claude"})
+        with patch("database.models.get_sb", return_value=sb):
+            models.get_user_preferences("user-1")
+            models.set_default_provider_for_user("user-1", "shell")
+            models.set_terminal_access_for_user("user-1", True)
+            assert models.get_default_provider_for_user("user-1") == "shell"
+            assert models.get_terminal_access_for_user("user-1") is True
+        assert sb.table.return_value.select.call_count == 1
+
+    def test_failed_bootstrap_is_retried(self):
+        sb = self._prefs_sb(None)
+        sb.table.return_value.upsert.return_value.execute.side_effect = Exception("23503 foreign key")
+        with patch("database.models.get_sb", return_value=sb):
+            assert models.get_user_preferences("user-1") == {"user_id": "user-1"}
+            models.get_user_preferences("user-1")
+        assert sb.table.return_value.upsert.call_count == 2
+
 
 # ---------------------------------------------------------------------------
 # Terminal command operations
@@ -515,6 +603,239 @@ class TestTerminalCommandOperations:
         payload = sb.table.return_value.update.call_args[0][0]
         assert "completed_at" in payload
 
+    def test_reaper_without_rpc_fails_long_runs_by_started_at(self, test_db):
+        # No reaper RPC means no lease migration: the rows only have the original columns.
+        old = "2020-01-01T00:00:00+00:00"
+        row = {"user_id": "u1", "status": "running"}
+        test_db._tables["terminal_commands"] = [
+            {**row, "id": "stale", "started_at": old},
+            {**row, "id": "fresh", "started_at": models._now_iso()},
+            {**row, "id": "done", "status": "completed", "started_at": old},
+        ]
+        expired = models.expire_stale_running_commands(stale_seconds=300, max_attempts=2)
+        assert [(r["id"], r["status"]) for r in expired] == [("stale", "failed")]
+        status = {r["id"]: r["status"] for r in test_db._tables["terminal_commands"]}
+        assert status == {"stale": "failed", "fresh": "running", "done": "completed"}
+        assert "lease_expires_at" not in test_db._tables["terminal_commands"][0]
+
+    def test_reaper_rpc_errors_do_not_fall_back(self, test_db):
+        def timed_out(**params):
+            raise TimeoutError("read timed out")
+
+        test_db.rpc_handlers["expire_stale_running_commands"] = timed_out
+        test_db._tables["terminal_commands"] = [
+            {"id": "c1", "user_id": "u1", "status": "running", "started_at": "2020-01-01T00:00:00+00:00"},
+        ]
+        with pytest.raises(TimeoutError):
+            models.expire_stale_running_commands()
+        assert test_db._tables["terminal_commands"][0]["status"] == "running"
+
+    def test_lease_writes_stop_once_the_lease_migration_is_missing(self, test_db):
+        test_db._tables["terminal_commands"] = [{"id": "c1", "user_id": "u1", "status": "running"}]
+        models.expire_stale_running_commands()
+        models.extend_command_lease("c1")
+        assert models._pending_leases == {}
+        assert models.renew_command_leases(user_id="u1", command_ids=["c1", "gone"]) == ["c1"]
+        assert test_db._tables["terminal_commands"][0] == {"id": "c1", "user_id": "u1", "status": "running"}
+
+    def test_failing_lease_writes_are_dropped_after_a_few_flushes(self, test_db):
+        models.extend_command_lease("c1")
+        with patch("database.models.get_sb") as sb:
+            sb.return_value.table.side_effect = TimeoutError("read timed out")
+            for _ in range(models._LEASE_FLUSH_ATTEMPTS - 1):
+                models.flush_pending_touches()
+                assert list(models._pending_leases) == ["c1"]
+            models.flush_pending_touches()
+        assert models._pending_leases == {}
+
+    def test_fallback_claim_writes_only_pre_lease_columns(self, test_db):
+        # No claim RPC means the lease migration has not run, so neither have its columns.
+        test_db._tables["terminal_sessions"] = [{"id": "s1", "project_id": "p1", "user_id": "u1"}]
+        test_db._tables["terminal_commands"] = [
+            {"id": "c1", "user_id": "u1", "session_id": "s1", "status": "queued", "created_at": "1"},
+        ]
+        claimed = models.claim_next_queued_command_for_user(user_id="u1")
+        assert claimed["status"] == "running" and claimed["started_at"]
+        assert "lease_expires_at" not in claimed and "attempts" not in claimed
+
+    def test_claim_rpc_errors_do_not_fall_back(self, test_db):
+        # The RPC may have committed before the error; a fallback claim would strand that command.
+        def timed_out(**params):
+            raise TimeoutError("read timed out")
+
+        test_db.rpc_handlers["claim_next_queued_command_for_user"] = timed_out
+        test_db._tables["terminal_commands"] = [
+            {"id": "c1", "user_id": "u1", "session_id": "s1", "status": "queued", "created_at": "1"},
+        ]
+        with pytest.raises(TimeoutError):
+            models.claim_next_queued_command_for_user(user_id="u1")
+        assert test_db._tables["terminal_commands"][0]["status"] == "queued"
+
+    def test_buffered_lease_extensions_only_land_on_running_commands(self, test_db):
+        later = "2999-01-01T00:00:00+00:00"
+        test_db._tables["terminal_commands"] = [
+            {"id": "running", "status": "running", "lease_expires_at": None},
+            {"id": "renewed", "status": "running", "lease_expires_at": later},
+            {"id": "requeued", "status": "queued", "lease_expires_at": None},
+            {"id": "done", "status": "completed", "lease_expires_at": None},
+        ]
+        for command_id in ("running", "renewed", "requeued", "done"):
+            models.extend_command_lease(command_id)
+        models.flush_pending_touches()
+        leases = {r["id"]: r["lease_expires_at"] for r in test_db._tables["terminal_commands"]}
+        assert leases["running"] > models._now_iso()
+        assert leases["renewed"] == later
+        assert leases["requeued"] is None and leases["done"] is None
+        assert models._pending_leases == {}
+
+    def test_lease_renewal_only_touches_the_callers_running_commands(self, test_db):
+        test_db._tables["terminal_commands"] = [
+            {"id": "c1", "user_id": "u1", "status": "running", "last_heartbeat_at": None},
+            {"id": "c2", "user_id": "u2", "status": "running", "last_heartbeat_at": None},
+            {"id": "c3", "user_id": "u1", "status": "completed", "last_heartbeat_at": None},
+        ]
+        renewed = models.renew_command_leases(user_id="u1", command_ids=["c1", "c2", "c3"])
+        assert renewed == ["c1"]
+        leases = {r["id"]: r.get("lease_expires_at") for r in test_db._tables["terminal_commands"]}
+        assert leases["c1"] and leases["c2"] is None and leases["c3"] is None
+
+    def test_compaction_archives_finished_commands_and_reads_stay_the_same(self, test_db):
+        old = "2020-01-01T00:00:00+00:00"
+        test_db._tables["terminal_commands"] = [
+            {"id": "done", "completed_at": old, "logs_compacted_at": None},
+            {"id": "just-done", "completed_at": models._now_iso(), "logs_compacted_at": None},
+            {"id": "running", "completed_at": None, "logs_compacted_at": None},
+        ]
+        test_db._tables["terminal_logs"] = [
+            {"id": f"{cid}-{seq}", "command_id": cid, "sequence": seq, "stream": "stderr" if seq == 1 else "stdout",
+             "chunk": f"{cid} line {seq}\n"}
+            for cid in ("done", "just-done", "running") for seq in range(3)
+        ]
+        before = models.get_terminal_logs_for_command(command_id="done", after_sequence=0, limit=10)
+
+        counts = models.compact_terminal_logs(compact_after_seconds=600, retention_days=0)
+
+        assert counts == {"compacted": 1, "dropped": 0, "archives_expired": 0}
+        assert {r["command_id"] for r in test_db._tables["terminal_logs"]} == {"just-done", "running"}
+        assert sorted(a["stream"] for a in test_db._tables["terminal_log_archives"]) == ["stderr", "stdout"]
+        assert next(c for c in test_db._tables["terminal_commands"] if c["id"] == "done")["logs_compacted_at"]
+        after = models.get_terminal_logs_for_command(command_id="done", after_sequence=0, limit=10, compacted=True)
+        assert [(r["sequence"], r["stream"], r["chunk"]) for r in after] == [
+            (r["sequence"], r["stream"], r["chunk"]) for r in before
+        ]
+        assert [r["sequence"] for r in models.get_terminal_logs_for_command(command_id="done", limit=1, compacted=True)] == [0]
+        assert models.compact_terminal_logs(compact_after_seconds=600, retention_days=0)["compacted"] == 0
+
+    def test_compaction_drops_output_past_retention(self, test_db):
+        from datetime import datetime, timedelta, timezone
+
+        # PostgREST renders fractional seconds with a varying number of digits.
+        ten_days_ago = (datetime.now(timezone.utc) - timedelta(days=10)).strftime("%Y-%m-%dT%H:%M:%S.12345+00:00")
+        test_db._tables["terminal_commands"] = [
+            {"id": "ancient", "completed_at": "2020-01-01T00:00:00.1234+00:00", "logs_compacted_at": None},
+            {"id": "kept", "completed_at": ten_days_ago, "logs_compacted_at": None},
+        ]
+        test_db._tables["terminal_logs"] = [
+            {"id": "l1", "command_id": "ancient", "sequence": 0, "stream": "stdout", "chunk": "x"},
+            {"id": "l2", "command_id": "kept", "sequence": 0, "stream": "stdout", "chunk": "y"},
+        ]
+        test_db._tables["terminal_log_archives"] = [
+            {"command_id": "older", "stream": "stdout", "created_at": "2020-01-01T00:00:00+00:00"},
+            {"command_id": "recent", "stream": "stdout", "created_at": models._now_iso()},
+        ]
+        counts = models.compact_terminal_logs(compact_after_seconds=600, retention_days=30)
+        assert counts == {"compacted": 1, "dropped": 1, "archives_expired": 1}
+        assert test_db._tables["terminal_logs"] == []
+        assert [a["command_id"] for a in test_db._tables["terminal_log_archives"]] == ["recent", "kept"]
+        assert [r["chunk"] for r in models.get_terminal_logs_for_command(command_id="kept", compacted=True)] == ["y"]
+        assert models.get_terminal_logs_for_command(command_id="ancient", compacted=True) == []
+
+    @staticmethod
+    def _logs(command_id, chunks):
+        rows, offset = [], 0
+        for seq, chunk in enumerate(chunks):
+            rows.append({"id": f"{command_id}-{seq}", "command_id": command_id, "sequence": seq,
+                         "stream": "stdout", "chunk": chunk, "byte_offset": offset})
+            offset += len(chunk.encode("utf-8"))
+        return rows
+
+    def test_log_tail_reads_backward_from_the_end(self, test_db):
+        test_db._tables["terminal_logs"] = self._logs("c1", [f"line {i}\n" for i in range(50)])
+        tail = models.get_terminal_log_tail(command_id="c1", chunks=3)
+        assert [r["sequence"] for r in tail] == [47, 48, 49]
+        assert models.get_terminal_log_size("c1") == {"chunks": 50, "bytes": sum(len(f"line {i}\n") for i in range(50))}
+
+    def test_log_tail_by_lines_trims_the_first_chunk(self, test_db, monkeypatch):
+        monkeypatch.setattr(models, "_LOG_READ_PAGE", 10)
+        test_db._tables["terminal_logs"] = self._logs("c1", ["a\nb\n", "c\nd", "\ne\n"] * 5)
+        tail = models.get_terminal_log_tail(command_id="c1", lines=3)
+        assert "".join(r["chunk"] for r in tail) == "c\nd\ne\n"
+        first = tail[0]
+        assert first["sequence"] == 13 and first["byte_offset"] == test_db._tables["terminal_logs"][13]["byte_offset"]
+        everything = models.get_terminal_log_tail(command_id="c1", lines=1000)
+        assert len(everything) == 15
+
+    def test_log_range_starts_at_the_chunk_holding_byte_start(self, test_db):
+        test_db._tables["terminal_logs"] = self._logs("c1", ["aaaa", "bbbb", "cccc", "dddd"])
+        rows = models.get_terminal_log_range(command_id="c1", byte_start=5, byte_end=12)
+        assert [r["chunk"] for r in rows] == ["bbbb", "cccc"]
+        assert [r["chunk"] for r in models.get_terminal_log_range(command_id="c1", byte_start=8, limit=1)] == ["cccc"]
+
+    def test_log_tail_range_and_size_of_archived_output(self, test_db):
+        from database import log_archive
+
+        test_db._tables["terminal_log_archives"] = log_archive.pack("c1", self._logs("c1", ["aaaa", "bb\n", "é\n"]))
+        tail = models.get_terminal_log_tail(command_id="c1", chunks=2, compacted=True)
+        assert [r["chunk"] for r in tail] == ["bb\n", "é\n"]
+        assert [r["chunk"] for r in models.get_terminal_log_tail(command_id="c1", lines=1, compacted=True)] == ["é\n"]
+        ranged = models.get_terminal_log_range(command_id="c1", byte_start=6, compacted=True)
+        assert [r["chunk"] for r in ranged] == ["bb\n", "é\n"]
+        assert models.get_terminal_log_size("c1", compacted=True) == {"chunks": 3, "bytes": 10}
+        assert models.get_terminal_log_size("missing", compacted=True) == {"chunks": 0, "bytes": 0}
+
+    def test_log_reads_of_live_commands_do_not_probe_the_archive(self, test_db):
+        from database import log_archive
+
+        test_db._tables["terminal_log_archives"] = log_archive.pack("c1", self._logs("c1", ["aaaa"]))
+        with patch("database.models._archived_log") as archived, \
+             patch("database.models._archived_log_size") as archived_size:
+            assert models.get_terminal_logs_for_command(command_id="c1") == []
+            assert models.get_terminal_log_tail(command_id="c1", chunks=5) == []
+            assert models.get_terminal_log_range(command_id="c1", byte_start=0) == []
+            assert models.get_terminal_log_size("c1") == {"chunks": 0, "bytes": 0}
+        archived.assert_not_called()
+        archived_size.assert_not_called()
+
+    def test_archived_log_size_comes_from_the_index(self, test_db):
+        from database import log_archive
+
+        test_db._tables["terminal_log_archives"] = log_archive.pack("c1", self._logs("c1", ["aaaa", "bb\n", "é\n"]))
+        with patch("database.log_archive.unpack") as unpack:
+            assert models.get_terminal_log_size("c1", compacted=True) == {"chunks": 3, "bytes": 10}
+        unpack.assert_not_called()
+
+    def test_archive_is_decoded_once_for_every_read(self, test_db):
+        from database import log_archive
+
+        chunks = [f"line {i}\n" for i in range(3000)]
+        test_db._tables["terminal_log_archives"] = log_archive.pack("c1", self._logs("c1", chunks))
+        with patch("database.log_archive.unpack", wraps=log_archive.unpack) as unpack:
+            pages, after = [], None
+            while True:
+                page = models.get_terminal_logs_for_command(
+                    command_id="c1", after_sequence=after, limit=500, compacted=True
+                )
+                if not page:
+                    break
+                pages.extend(r["chunk"] for r in page)
+                after = page[-1]["sequence"]
+            ranged = models.get_terminal_log_range(command_id="c1", byte_start=70, byte_end=80, compacted=True)
+            size = models.get_terminal_log_size("c1", compacted=True)
+        assert pages == chunks
+        assert unpack.call_count == 1
+        assert [r["chunk"] for r in ranged] == ["line 10\n", "line 11\n"]
+        assert size == {"chunks": 3000, "bytes": sum(len(c) for c in chunks)}
+
     def test_update_call_session_sets_ended_at(self):
         sb = _mock_sb()
         with patch("database.models.get_sb", return_value=sb):
@@ -36,61 +36,52 @@ def _result(data):
 
 
 class TestUpsertUser:
-    def test_new_user_path_calls_insert(self):
+    def test_upsert_on_id_conflict(self):
         sb = _make_sb()
-        # maybe_single().execute() returns None → user does not exist
-        sb.table.return_value.select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = (
-            _result(None)
-        )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
             models.upsert_user("user-new", "new@example.com")
 
-        sb.table.return_value.insert.assert_called_once()
-        insert_data = sb.table.return_value.insert.call_args.args[0]
-        assert insert_data["id"] == "user-new"
-        assert insert_data["email"] == "new@example.com"
+        sb.table.assert_called_with("users")
+        sb.table.return_value.upsert.assert_called_once()
+        upsert_data = sb.table.return_value.upsert.call_args.args[0]
+        assert upsert_data["id"] == "user-new"
+        assert upsert_data["email"] == "new@example.com"
+        assert sb.table.return_value.upsert.call_args.kwargs["on_conflict"] == "id"
+        sb.table.return_value.insert.assert_not_called()
+        sb.table.return_value.update.assert_not_called()
 
-    def test_new_user_with_phone_includes_phone_in_insert(self):
+    def test_phone_included_in_upsert(self):
         sb = _make_sb()
-        sb.table.return_value.select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = (
-            _result(None)
-        )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
             models.upsert_user("user-new", "new@example.com", phone_number="+15551234567")
 
-        insert_data = sb.table.return_value.insert.call_args.args[0]
-        assert insert_data.get("phone_number") == "+15551234567"
+        upsert_data = sb.table.return_value.upsert.call_args.args[0]
+        assert upsert_data.get("phone_number") == "+15551234567"
 
-    def test_existing_user_path_calls_update_not_insert(self):
+    def test_omitted_phone_is_not_overwritten(self):
         sb = _make_sb()
-        # maybe_single().execute() returns existing user
-        sb.table.return_value.select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = (
-            _result({"id": "user-old"})
-        )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
-            models.upsert_user("user-old", "old@example.com")
+            models.upsert_user("user-old", "updated@example.com")
 
-        sb.table.return_value.update.assert_called_once()
-        sb.table.return_value.insert.assert_not_called()
+        upsert_data = sb.table.return_value.upsert.call_args.args[0]
+        assert upsert_data == {"id": "user-old", "email": "updated@example.com"}
 
-    def test_existing_user_update_includes_email(self):
+    def test_phone_update_forgets_known_user(self):
         sb = _make_sb()
-        sb.table.return_value.select.return_value.eq.return_value.maybe_single.return_value.execute.return_value = (
-            _result({"id": "user-old"})
-        )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
-            models.upsert_user("user-old", "updated@example.com")
+            models.upsert_user("user-1", "a@example.com", phone_number="+15550000000")
+            models.update_user_phone_number("user-1", "+15551111111")
+            models.upsert_user("user-1", "a@example.com", phone_number="+15550000000")
 
-        update_data = sb.table.return_value.update.call_args.args[0]
-        assert update_data["email"] == "updated@example.com"
+        assert sb.table.return_value.upsert.call_count == 2
 
 
 # ---------------------------------------------------------------------------
@@ -232,6 +223,13 @@ class TestDeleteProject:
 
 
 class TestClaimNextQueuedCommand:
+    @pytest.fixture(autouse=True)
+    def _reset_rpc_probe(self):
+        from database import models
+        models._missing_rpcs.clear()
+        yield
+        models._missing_rpcs.clear()
+
     def _make_queued_cmd(self):
         return {"id": "cmd-queued", "status": "queued", "session_id": "sess-1", "user_id": "user-1"}
 
@@ -239,7 +237,7 @@ class TestClaimNextQueuedCommand:
         return {"id": "cmd-queued", "status": "running", "session_id": "sess-1", "user_id": "user-1"}
 
     def test_finds_and_claims_queued_command(self):
-        """Patch _expire_stale and use per-table mocks to avoid chain conflicts."""
+        """Use per-table mocks to avoid chain conflicts."""
         running_cmd = self._make_running_cmd()
 
         # Use a table-dispatch approach so each table gets its own sub-mock.
@@ -250,11 +248,11 @@ class TestClaimNextQueuedCommand:
                 table_mocks[name] = MagicMock()
             return table_mocks[name]
 
-        with patch("database.models._expire_stale_running_commands"), \
-             patch(GET_SB_PATH) as mock_get_sb:
+        with patch(GET_SB_PATH) as mock_get_sb:
 
             sb = MagicMock()
             sb.table.side_effect = table_side_effect
+            sb.rpc.return_value.execute.side_effect = Exception("PGRST202 Could not find the function")
             mock_get_sb.return_value = sb
 
             tc = table_mocks.setdefault("terminal_commands", MagicMock())
@@ -276,10 +274,10 @@ class TestClaimNextQueuedCommand:
         assert result["status"] == "running"
 
     def test_returns_none_when_no_queued_commands(self):
-        with patch("database.models._expire_stale_running_commands"), \
-             patch(GET_SB_PATH) as mock_get_sb:
+        with patch(GET_SB_PATH) as mock_get_sb:
 
             sb = MagicMock()
+            sb.rpc.return_value.execute.side_effect = Exception("PGRST202 Could not find the function")
             mock_get_sb.return_value = sb
 
             # No queued commands found
@@ -291,41 +289,119 @@ class TestClaimNextQueuedCommand:
         assert result is None
 
 
+class TestClaimViaRpc:
+    @pytest.fixture(autouse=True)
+    def _reset_rpc_probe(self):
+        from database import models
+        models._missing_rpcs.clear()
+        yield
+        models._missing_rpcs.clear()
+
+    def test_user_claim_is_a_single_rpc_round_trip(self):
+        sb = _make_sb()
+        claimed = {"id": "cmd-1", "status": "running", "project_id": "p1", "project_path": "/srv/p1"}
+        sb.rpc.return_value.execute.return_value = _result([claimed])
+
+        with patch(GET_SB_PATH, return_value=sb), \
+             patch("database.sidecar_store.get_command_risk", return_value=None):
+            from database import models
+            result = models.claim_next_queued_command_for_user(user_id="user-1")
+
+        sb.rpc.assert_called_once_with(
+            "claim_next_queued_command_for_user", {"p_user_id": "user-1", "p_lease_seconds": models.COMMAND_LEASE_SECONDS}
+        )
+        sb.table.assert_not_called()
+        assert result["id"] == "cmd-1"
+        assert result["project_path"] == "/srv/p1"
+        assert result["risk_level"] == "PENDING"
+
+    def test_device_claim_returns_none_when_rpc_claims_nothing(self):
+        sb = _make_sb()
+        sb.rpc.return_value.execute.return_value = _result([])
+
+        with patch(GET_SB_PATH, return_value=sb):
+            from database import models
+            assert models.claim_next_queued_command_for_device(device_id="dev-1") is None
+
+        sb.rpc.assert_called_once_with(
+            "claim_next_queued_command_for_device", {"p_device_id": "dev-1", "p_lease_seconds": models.COMMAND_LEASE_SECONDS}
+        )
+        sb.table.assert_not_called()
+
+    def test_missing_rpc_is_remembered_and_falls_back(self):
+        sb = _make_sb()
+        sb.rpc.return_value.execute.side_effect = Exception("PGRST202 Could not find the function")
+        sb.table.return_value.select.return_value.eq.return_value.execute.return_value = _result([])
+
+        with patch(GET_SB_PATH, return_value=sb):
+            from database import models
+            assert models.claim_next_queued_command_for_device(device_id="dev-1") is None
+            assert models.claim_next_queued_command_for_device(device_id="dev-1") is None
+
+        # Second claim skips the RPC probe entirely.
+        assert sb.rpc.call_count == 1
+        assert "claim_next_queued_command_for_device" in models._missing_rpcs
+
+
 # ---------------------------------------------------------------------------
-# _expire_stale_running_commands
+# expire_stale_running_commands (background reaper)
 # ---------------------------------------------------------------------------
 
 
 class TestExpireStaleRunningCommands:
-    def test_marks_stale_commands_as_failed(self):
-        sb = MagicMock()
+    @pytest.fixture(autouse=True)
+    def _reset_rpc_probe(self):
+        from database import models
+        models._missing_rpcs.clear()
+        yield
+        models._missing_rpcs.clear()
+
+    def test_rpc_expires_in_one_round_trip(self):
+        sb = _make_sb()
+        sb.rpc.return_value.execute.return_value = _result([{"id": "cmd-stale", "user_id": "user-1"}])
 
-        stale_cmd = {"id": "cmd-stale"}
-        sb.table.return_value.select.return_value.eq.return_value.eq.return_value.lt.return_value.execute.return_value = (
-            _result([stale_cmd])
+        with patch(GET_SB_PATH, return_value=sb):
+            from database import models
+            rows = models.expire_stale_running_commands(stale_seconds=120, max_attempts=2)
+
+        sb.rpc.assert_called_once_with("expire_stale_running_commands", {"p_stale_seconds": 120, "p_max_attempts": 2})
+        sb.table.assert_not_called()
+        assert [r["id"] for r in rows] == ["cmd-stale"]
+
+    def test_fallback_is_a_single_update_without_a_select(self):
+        sb = _make_sb()
+        sb.rpc.return_value.execute.side_effect = Exception("PGRST202 Could not find the function")
+        sb.table.return_value.update.return_value.eq.return_value.lt.return_value.execute.return_value = (
+            _result([{"id": "cmd-stale", "user_id": "user-1"}])
         )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
-            models._expire_stale_running_commands("user-1")
+            rows = models.expire_stale_running_commands(stale_seconds=300, max_attempts=1)
 
-        # update should have been called with status="failed"
-        update_call = sb.table.return_value.update.call_args
-        assert update_call is not None
-        update_data = update_call.args[0]
+        assert rows == [{"id": "cmd-stale", "user_id": "user-1"}]
+        update_data = sb.table.return_value.update.call_args.args[0]
         assert update_data["status"] == "failed"
         assert update_data["exit_code"] == -1
+        sb.table.return_value.select.assert_not_called()
+        assert set(update_data) == {"status", "exit_code", "completed_at"}
+        sb.table.return_value.update.return_value.eq.return_value.lt.assert_called_once()
 
-    def test_no_update_when_no_stale_commands(self):
-        sb = MagicMock()
-
-        sb.table.return_value.select.return_value.eq.return_value.eq.return_value.lt.return_value.execute.return_value = (
-            _result([])
+    def test_renewal_without_lease_columns_reports_running_commands(self):
+        sb = _make_sb()
+        sb.table.return_value.update.return_value.in_.return_value.eq.return_value.eq.return_value.execute.side_effect = (
+            Exception("PGRST204 Could not find the 'last_heartbeat_at' column of 'terminal_commands'")
+        )
+        sb.table.return_value.select.return_value.in_.return_value.eq.return_value.eq.return_value.execute.return_value = (
+            _result([{"id": "cmd-1"}])
         )
 
         with patch(GET_SB_PATH, return_value=sb):
             from database import models
-            models._expire_stale_running_commands("user-1")
+            assert models.renew_command_leases(user_id="user-1", command_ids=["cmd-1"]) == ["cmd-1"]
+            assert models.renew_command_leases(user_id="user-1", command_ids=["cmd-1"]) == ["cmd-1"]
+            models.extend_command_lease("cmd-1")
 
-        # No update calls on terminal_commands
-        sb.table.return_value.update.assert_not_called()
+        # The second renewal and the extension skip the lease write entirely.
+        sb.table.return_value.update.assert_called_once()
+        assert models._pending_leases == {}
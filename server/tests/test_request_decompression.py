@@ -0,0 +1,103 @@
+"""
+Tests for services/request_decompression.py (gzip request bodies).
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+
+os.environ.setdefault("DEVELOPMENT_MODE", "true")
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from services.request_decompression import GzipRequestMiddleware
+
+
+def _client(max_inflated_bytes: int = 1024 * 1024, max_compressed_bytes: int = 1024 * 1024) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(
+        GzipRequestMiddleware, max_inflated_bytes=max_inflated_bytes, max_compressed_bytes=max_compressed_bytes
+    )
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {
+            "body": await request.json(),
+            "encoding": request.headers.get("content-encoding"),
+            "length": request.headers.get("content-length"),
+        }
+
+    return TestClient(app)
+
+
+def _gzip_json(payload) -> bytes:
+    return gzip.compress(json.dumps(payload).encode("utf-8"))
+
+
+def test_gzip_body_is_inflated_for_the_route():
+    payload = {"chunks": ["line\n"] * 100}
+    resp = _client().post(
+        "/echo",
+        content=_gzip_json(payload),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["body"] == payload
+    assert data["encoding"] is None
+    assert int(data["length"]) == len(json.dumps(payload))
+
+
+def test_plain_body_passes_through():
+    resp = _client().post("/echo", json={"a": 1})
+    assert resp.status_code == 200
+    assert resp.json()["body"] == {"a": 1}
+
+
+def test_corrupt_gzip_is_rejected():
+    resp = _client().post(
+        "/echo", content=b"not gzip", headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    )
+    assert resp.status_code == 400
+
+
+def test_inflated_size_is_capped():
+    resp = _client(max_inflated_bytes=1000).post(
+        "/echo",
+        content=_gzip_json({"x": "a" * 5000}),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert resp.status_code == 413
+
+
+def test_compressed_size_is_capped():
+    body = gzip.compress(os.urandom(4000))
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    assert _client(max_compressed_bytes=1000).post("/echo", content=body, headers=headers).status_code == 413
+
+    # Without a Content-Length the cap applies while the body streams in.
+    def chunked():
+        for i in range(0, len(body), 512):
+            yield body[i:i + 512]
+
+    assert _client(max_compressed_bytes=1000).post("/echo", content=chunked(), headers=headers).status_code == 413
+
+
+def test_main_app_accepts_gzip_append_logs():
+    from unittest.mock import patch
+    from main import app
+
+    with patch("database.models.get_user_id_for_agent_token", return_value="u1"), \
+         patch("database.models.append_terminal_log_chunks", return_value=2) as append, \
+         patch("database.models.get_terminal_command", return_value={"id": "c1", "user_id": "u1"}):
+        resp = TestClient(app).post(
+            "/api/agent/local/commands/c1/append-logs",
+            content=_gzip_json({"sequence_start": 0, "stream": "stdout", "chunks": ["a", "b"]}),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip", "X-Agent-Token": "tok"},
+        )
+    assert resp.status_code == 200, resp.text
+    assert append.call_args.kwargs["chunks"] == ["a", "b"]
@@ -7,6 +7,7 @@ so no mocking is needed — the store is purely local.
 from __future__ import annotations
 
 import os
+import sqlite3
 import tempfile
 import pytest
 from database import sidecar_store as store
@@ -201,3 +202,91 @@ class TestCommandRisk:
         result = store.enrich_commands(cmds)
         assert result[0]["risk_level"] == "WARNING"
         assert result[1]["risk_level"] == "PENDING"
+
+
+    def test_get_command_risks_returns_dict_for_known_ids(self):
+        store.set_command_risk(command_id="a", user_id="u1", risk_level="SAFE", risk_reason=None)
+        store.set_command_risk(command_id="b", user_id="u1", risk_level="HIGH_RISK", risk_reason="rm")
+        risks = store.get_command_risks(["a", "b", "missing", "a", None])
+        assert set(risks) == {"a", "b"}
+        assert risks["b"]["risk_level"] == "HIGH_RISK"
+        assert store.get_command_risks([]) == {}
+
+    def test_get_command_risks_chunks_large_id_lists(self, monkeypatch):
+        monkeypatch.setattr(store, "_IN_CHUNK", 2)
+        for cid in ("a", "b", "c", "d", "e"):
+            store.set_command_risk(command_id=cid, user_id="u1", risk_level="SAFE", risk_reason=None)
+        assert set(store.get_command_risks(["a", "b", "c", "d", "e"])) == {"a", "b", "c", "d", "e"}
+
+    def test_enrich_commands_uses_one_bulk_lookup(self):
+        from unittest.mock import patch
+
+        cmds = [{"id": f"c{i}"} for i in range(5)] + [{"command": "no id"}]
+        with patch.object(store, "get_command_risk", side_effect=AssertionError("per-row lookup")):
+            result = store.enrich_commands(cmds)
+        assert [r.get("risk_level") for r in result] == ["PENDING"] * 5 + [None]
+
+# ---------------------------------------------------------------------------
+# connection reuse / schema setup
+# ---------------------------------------------------------------------------
+
+class TestConnection:
+    def test_connection_is_reused_within_a_thread(self):
+        assert store._conn() is store._conn()
+
+    def test_threads_get_their_own_connection(self):
+        import threading
+
+        mine = store._conn()
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(store._conn()))
+        t.start()
+        t.join()
+        assert seen[0] is not mine
+
+    def test_uses_wal_journal(self):
+        mode = store._conn().execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode.lower() == "wal"
+
+    def test_schema_initialized_once_per_path(self, monkeypatch):
+        from unittest.mock import patch
+
+        store.close_connection()
+        with patch.object(store, "_init", wraps=store._init) as init:
+            store.get_command_risk("a")
+            store.set_command_risk(command_id="a", user_id="u1", risk_level="SAFE", risk_reason=None)
+            store.close_connection()
+            store.get_command_risk("a")
+        assert init.call_count == 1
+
+    def test_failed_write_rolls_back(self):
+        with pytest.raises(sqlite3.IntegrityError):
+            with store._conn() as c:
+                c.execute(
+                    "INSERT INTO command_risk (command_id, user_id, risk_level, updated_at) VALUES ('x', 'u', 'SAFE', 'now')"
+                )
+                c.execute("INSERT INTO command_risk (command_id) VALUES ('y')")
+        assert store.get_command_risk("x") is None
+
+
+class TestDeleteProjectData:
+    def test_purges_project_rows_and_command_rows(self):
+        store.add_conversation_turn(
+            user_id="u1", project_id="p1", session_id=None, command_id=None, role="user", turn_type="text", content="a"
+        )
+        store.add_conversation_turn(
+            user_id="u1", project_id=None, session_id=None, command_id="c1", role="assistant", turn_type="text", content="b"
+        )
+        store.add_conversation_turn(
+            user_id="u1", project_id="p2", session_id=None, command_id=None, role="user", turn_type="text", content="c"
+        )
+        store.upsert_conversation_state(user_id="u1", project_id="p1", state="idle", active_command_id=None)
+        store.set_command_risk(command_id="c1", user_id="u1", risk_level="SAFE", risk_reason=None)
+        store.set_command_risk(command_id="c9", user_id="u1", risk_level="SAFE", risk_reason=None)
+
+        counts = store.delete_project_data(project_id="p1", command_ids=["c1", "c1"])
+
+        assert counts == {"conversation_turns": 2, "conversation_state": 1, "command_risk": 1}
+        assert [t["content"] for t in store.list_conversation_turns_for_user(user_id="u1", project_id="p2")] == ["c"]
+        assert store.get_conversation_state(user_id="u1", project_id="p1") is None
+        assert store.get_command_risk("c9") is not None
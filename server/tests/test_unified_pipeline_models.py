@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from database import models
 from agents.command_builder import build_provider_command, normalize_provider
 
@@ -74,6 +76,57 @@ def test_list_recent_terminal_commands_for_user(test_db):
     assert rows[0]["project_name"] == "Proj"
 
 
+def test_timeline_filters_project_in_query_and_pages_by_cursor(test_db):
+    from database import pagination
+
+    p1 = models.create_project("user-1", "One")
+    p2 = models.create_project("user-1", "Two")
+    s1 = models.create_terminal_session(user_id="user-1", project_id=p1, name="s1", instance_id=None)
+    s2 = models.create_terminal_session(user_id="user-1", project_id=p2, name="s2", instance_id=None)
+    for i in range(5):
+        models.create_terminal_command(session_id=s2, user_id="user-1", command=f"other {i}")
+        models.create_terminal_command(session_id=s1, user_id="user-1", command=f"mine {i}")
+    # Identical timestamps across a page boundary must not skip or repeat rows.
+    for row in test_db._tables["terminal_commands"]:
+        row["created_at"] = "2026-01-01T00:00:00+00:00"
+
+    seen, cursor = [], None
+    while True:
+        rows = models.list_recent_terminal_commands_for_user(user_id="user-1", limit=2, project_id=p1, cursor=cursor)
+        assert all(r["project_id"] == p1 for r in rows)
+        seen.extend(r["id"] for r in rows)
+        cursor = pagination.next_cursor(rows, 2)
+        if cursor is None:
+            break
+    mine = [r["id"] for r in test_db._tables["terminal_commands"] if r["session_id"] == s1]
+    assert sorted(seen) == sorted(mine)
+    assert len(seen) == len(set(seen)) == 5
+
+
+def test_user_tasks_delta_mode_returns_changes_oldest_first(test_db):
+    from database import pagination
+
+    project_id = models.create_project("user-1", "Proj")
+    ids = [models.create_task(project_id, "user-1", f"task {i}") for i in range(4)]
+    for i, row in enumerate(test_db._tables["tasks"]):
+        row["created_at"] = f"2026-01-0{i + 1}T00:00:00+00:00"
+        row["updated_at"] = row["created_at"]
+    test_db._tables["tasks"][0]["updated_at"] = "2026-02-01T00:00:00+00:00"
+
+    changed = models.get_user_tasks("user-1", updated_since="2026-01-03T00:00:00+00:00", limit=2)
+    assert [t["id"] for t in changed] == [ids[2], ids[3]]
+    rest = models.get_user_tasks(
+        "user-1",
+        updated_since="2026-01-03T00:00:00+00:00",
+        limit=2,
+        cursor=pagination.next_cursor(changed, 2, "updated_at"),
+    )
+    assert [t["id"] for t in rest] == [ids[0]]
+
+    newest = models.get_user_tasks("user-1", limit=3)
+    assert [t["id"] for t in newest] == [ids[3], ids[2], ids[1]]
+
+
 def test_command_builder_provider_templates():
     assert normalize_provider("CLAUDE") == "claude"
     assert normalize_provider("n/a") == "cursor"
@@ -115,6 +168,20 @@ class TestAgentTokens:
         models.revoke_agent_token(user_id="user-1", token_id=token_id)
         assert models.get_user_id_for_agent_token(token) is None
 
+    def test_resolved_token_is_cached_and_touch_is_buffered(self, test_db):
+        token = models.create_agent_token(user_id="user-1")["token"]
+        models.get_user_id_for_agent_token(token)
+        with patch.object(test_db, "table", wraps=test_db.table) as table:
+            for _ in range(5):
+                assert models.get_user_id_for_agent_token(token) == "user-1"
+        table.assert_not_called()
+
+        row = test_db._tables["agent_tokens"][0]
+        assert row.get("last_used_at") is None
+        assert models.flush_pending_touches() == 1
+        assert row["last_used_at"]
+        assert models.flush_pending_touches() == 0
+
 
 class TestTerminalClaim:
     def test_claim_next_returns_session_scoped_command(self, test_db):
@@ -134,3 +201,48 @@ class TestTerminalClaim:
         assert claimed["id"] == cid
         assert claimed["session_id"] == sid
 
+
+
+class TestTerminalLogs:
+    def _command(self):
+        pid = models.create_project("user-1", "Proj")
+        sid = models.create_terminal_session(user_id="user-1", project_id=pid)
+        return models.create_terminal_command(session_id=sid, user_id="user-1", command="make")
+
+    def test_bulk_append_assigns_sequences_in_one_request(self, test_db):
+        cid = self._command()
+        with patch.object(test_db, "table", wraps=test_db.table) as table:
+            next_seq = models.append_terminal_log_chunks(
+                command_id=cid, sequence_start=5, stream="stdout", chunks=["a", "b", "c"]
+            )
+        assert next_seq == 8
+        table.assert_called_once_with("terminal_logs")
+        logs = models.get_terminal_logs_for_command(command_id=cid)
+        assert [(l["sequence"], l["chunk"]) for l in logs] == [(5, "a"), (6, "b"), (7, "c")]
+
+    def test_retried_batch_does_not_duplicate(self, test_db):
+        cid = self._command()
+        for _ in range(2):
+            models.append_terminal_log_chunks(command_id=cid, sequence_start=0, stream="stdout", chunks=["x", "y"])
+        assert len(models.get_terminal_logs_for_command(command_id=cid)) == 2
+
+    def test_large_batches_are_split(self, test_db, monkeypatch):
+        monkeypatch.setattr(models, "_LOG_INSERT_BATCH", 2)
+        cid = self._command()
+        with patch.object(test_db, "table", wraps=test_db.table) as table:
+            models.append_terminal_log_chunks(command_id=cid, sequence_start=0, stream="stdout", chunks=list("abcde"))
+        assert table.call_count == 3
+        assert len(models.get_terminal_logs_for_command(command_id=cid)) == 5
+
+    def test_falls_back_to_insert_without_unique_index(self):
+        from unittest.mock import MagicMock
+
+        sb = MagicMock()
+        sb.table.return_value.upsert.return_value.execute.side_effect = Exception(
+            "42P10 there is no unique or exclusion constraint matching the ON CONFLICT specification"
+        )
+        with patch("database.models.get_sb", return_value=sb):
+            models.append_terminal_log_chunks(command_id="c1", sequence_start=0, stream="stdout", chunks=["a"])
+            models.append_terminal_log_chunks(command_id="c1", sequence_start=1, stream="stdout", chunks=["b"])
+        assert sb.table.return_value.upsert.call_count == 1
+        assert sb.table.return_value.insert.call_count == 2
@@ -0,0 +1,95 @@
+"""Tests for database/unit_of_work.py (request-scoped read memoization)."""
+from __future__ import annotations
+
+import os
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("DEVELOPMENT_MODE", "true")
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "placeholder-key")
+
+from database import async_models as adb
+from database import unit_of_work
+from database.unit_of_work import memoized, writes
+
+calls: list[str] = []
+
+
+@memoized("projects")
+def _read_projects(user_id):
+    calls.append(f"projects:{user_id}")
+    return [{"id": "p1", "user_id": user_id}]
+
+
+@memoized("user_preferences")
+def _read_prefs(user_id):
+    calls.append(f"prefs:{user_id}")
+    return {"user_id": user_id}
+
+
+@writes("projects")
+def _write_project(user_id):
+    calls.append("write")
+
+
+def _unmarked(user_id):
+    calls.append("unmarked")
+
+
+class TestUnitOfWork:
+    def setup_method(self):
+        calls.clear()
+
+    async def test_identical_reads_hit_once(self):
+        with unit_of_work.begin() as uow:
+            a = await adb.run(_read_projects, "u1")
+            b = await adb.run(_read_projects, "u1")
+            await adb.run(_read_projects, "u2")
+        assert a == b
+        assert calls == ["projects:u1", "projects:u2"]
+        assert uow.hits == 1
+
+    async def test_cached_results_are_copies(self):
+        with unit_of_work.begin():
+            (await adb.run(_read_projects, "u1"))[0]["id"] = "mutated"
+            assert (await adb.run(_read_projects, "u1"))[0]["id"] == "p1"
+
+    async def test_write_evicts_only_its_tables(self):
+        with unit_of_work.begin():
+            await adb.run(_read_projects, "u1")
+            await adb.run(_read_prefs, "u1")
+            await adb.run(_write_project, "u1")
+            await adb.run(_read_projects, "u1")
+            await adb.run(_read_prefs, "u1")
+        assert calls == ["projects:u1", "prefs:u1", "write", "projects:u1"]
+
+    async def test_unmarked_call_evicts_everything(self):
+        with unit_of_work.begin():
+            await adb.run(_read_prefs, "u1")
+            await adb.run(_unmarked, "u1")
+            await adb.run(_read_prefs, "u1")
+        assert calls == ["prefs:u1", "unmarked", "prefs:u1"]
+
+    async def test_no_memoization_outside_a_unit_of_work(self):
+        await adb.run(_read_projects, "u1")
+        await adb.run(_read_projects, "u1")
+        assert calls == ["projects:u1", "projects:u1"]
+        assert unit_of_work.current() is None
+
+
+def test_transcribe_text_reads_projects_once_per_write(test_db):
+    from fastapi.testclient import TestClient
+    from database import models
+    from main import app
+
+    real = models.get_user_projects
+    with patch("database.models.get_user_projects", wraps=real) as get_projects, \
+         patch("main.parse_intent", new_callable=AsyncMock, return_value={"intent": "unknown"}), \
+         patch("main.get_terminal_access", return_value=False) as terminal_access:
+        get_projects._uow = real._uow
+        terminal_access._uow = ("read", frozenset({"user_preferences"}))
+        resp = TestClient(app).post("/transcribe-text", json={"text": "hello"})
+
+    assert resp.json()["status"] == "success"
+    # Context + fresh_projects share one read; the audit task insert forces the final re-read.
+    assert get_projects.call_count == 2
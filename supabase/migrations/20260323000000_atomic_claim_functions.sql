@@ -0,0 +1,129 @@
+-- Single-round-trip atomic claims, one function per scope (instance, user, device).
+-- Each locks the oldest queued command with FOR UPDATE SKIP LOCKED, flips it to
+-- 'running' and returns the claimed row as JSONB, already joined with the project
+-- location the agent needs. Competing claimers skip locked rows instead of racing
+-- an update-then-verify sequence.
+
+CREATE INDEX IF NOT EXISTS idx_terminal_commands_queued_user_created
+    ON terminal_commands(user_id, created_at)
+    WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_terminal_commands_running_started
+    ON terminal_commands(started_at)
+    WHERE status = 'running';
+
+-- The original claim_next_queued_command returned SETOF terminal_commands; the
+-- return type changes, so it has to be dropped first.
+DROP FUNCTION IF EXISTS claim_next_queued_command(TEXT);
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command(p_instance_id TEXT)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+BEGIN
+  SELECT tc.id, ts.project_id INTO v_command_id, v_project_id
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  WHERE ts.instance_id = p_instance_id
+    AND tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running', started_at = now()
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object('project_id', v_project_id);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command_for_user(
+  p_user_id TEXT,
+  p_stale_minutes INTEGER DEFAULT 5
+)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+  v_project_path TEXT;
+BEGIN
+  -- Expire commands stuck in 'running' (set-based, same round trip).
+  UPDATE terminal_commands
+  SET status = 'failed', exit_code = -1, completed_at = now()
+  WHERE user_id = p_user_id
+    AND status = 'running'
+    AND started_at < now() - make_interval(mins => p_stale_minutes);
+
+  SELECT tc.id, ts.project_id, p.file_path INTO v_command_id, v_project_id, v_project_path
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  LEFT JOIN projects p ON p.id = ts.project_id
+  WHERE tc.user_id = p_user_id
+    AND tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running', started_at = now()
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object(
+    'project_id', v_project_id,
+    'project_path', v_project_path
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command_for_device(
+  p_device_id TEXT,
+  p_stale_minutes INTEGER DEFAULT 5
+)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+  v_local_path TEXT;
+BEGIN
+  UPDATE terminal_commands tc
+  SET status = 'failed', exit_code = -1, completed_at = now()
+  FROM terminal_sessions ts
+  JOIN device_project_links l ON l.project_id = ts.project_id
+  WHERE tc.session_id = ts.id
+    AND l.device_id = p_device_id
+    AND tc.status = 'running'
+    AND tc.started_at < now() - make_interval(mins => p_stale_minutes);
+
+  SELECT tc.id, ts.project_id, l.local_path INTO v_command_id, v_project_id, v_local_path
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  JOIN device_project_links l ON l.project_id = ts.project_id AND l.device_id = p_device_id
+  WHERE tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running', started_at = now()
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object(
+    'project_id', v_project_id,
+    'project_local_path', v_local_path
+  );
+END;
+$$ LANGUAGE plpgsql;
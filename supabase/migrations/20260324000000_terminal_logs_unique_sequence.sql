@@ -0,0 +1,15 @@
+-- Make (command_id, sequence) unique so append-logs can upsert multi-row batches with
+-- ON CONFLICT DO NOTHING: a client retrying a batch it already sent is a no-op.
+
+-- Drop duplicates left by earlier retries, keeping the first row written for each sequence.
+DELETE FROM terminal_logs t
+USING terminal_logs d
+WHERE t.command_id = d.command_id
+  AND t.sequence = d.sequence
+  AND (t.created_at, t.id) > (d.created_at, d.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_terminal_logs_command_sequence
+    ON terminal_logs(command_id, sequence);
+
+-- The unique index covers the same lookups.
+DROP INDEX IF EXISTS idx_terminal_logs_command_sequence;
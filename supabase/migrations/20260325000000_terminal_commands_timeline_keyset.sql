@@ -0,0 +1,4 @@
+-- The unified timeline pages newest-first on (created_at, id) per user. Project views
+-- join through terminal_sessions and use idx_terminal_commands_session_created.
+CREATE INDEX IF NOT EXISTS idx_terminal_commands_user_created_id
+    ON terminal_commands(user_id, created_at DESC, id DESC);
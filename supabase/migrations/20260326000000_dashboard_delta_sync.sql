@@ -0,0 +1,43 @@
+-- Delta sync for the dashboard lists (tasks, agent executions, call history):
+-- every row carries updated_at, bumped on any UPDATE, so clients can ask for
+-- "changed since" instead of re-downloading whole histories.
+
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$;
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+ALTER TABLE agent_executions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+ALTER TABLE call_sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+
+-- Backfill with the latest known change rather than the migration time.
+UPDATE tasks SET updated_at = COALESCE(completed_at, created_at) WHERE updated_at IS NULL;
+UPDATE agent_executions SET updated_at = COALESCE(completed_at, created_at) WHERE updated_at IS NULL;
+UPDATE call_sessions SET updated_at = COALESCE(ended_at, started_at) WHERE updated_at IS NULL;
+
+ALTER TABLE tasks ALTER COLUMN updated_at SET DEFAULT now();
+ALTER TABLE agent_executions ALTER COLUMN updated_at SET DEFAULT now();
+ALTER TABLE call_sessions ALTER COLUMN updated_at SET DEFAULT now();
+
+DROP TRIGGER IF EXISTS trg_tasks_updated_at ON tasks;
+CREATE TRIGGER trg_tasks_updated_at BEFORE UPDATE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+DROP TRIGGER IF EXISTS trg_agent_executions_updated_at ON agent_executions;
+CREATE TRIGGER trg_agent_executions_updated_at BEFORE UPDATE ON agent_executions
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+DROP TRIGGER IF EXISTS trg_call_sessions_updated_at ON call_sessions;
+CREATE TRIGGER trg_call_sessions_updated_at BEFORE UPDATE ON call_sessions
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Keyset pages: (user_id, created_at) already exists for tasks.
+CREATE INDEX IF NOT EXISTS idx_tasks_user_updated_at ON tasks(user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_call_sessions_user_started_at ON call_sessions(user_id, started_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_call_sessions_user_updated_at ON call_sessions(user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_agent_executions_task_created_at ON agent_executions(task_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_agent_executions_updated_at ON agent_executions(updated_at, id);
@@ -0,0 +1,29 @@
+-- Stale running commands are expired by a periodic server-side reaper instead of
+-- on every claim. Agents heartbeat the commands they are executing (and appending
+-- output counts too), so a long command that is still alive is no longer failed
+-- five minutes after it started.
+
+ALTER TABLE terminal_commands ADD COLUMN IF NOT EXISTS last_heartbeat_at TIMESTAMPTZ;
+
+-- One set-based UPDATE ... RETURNING per sweep. Running rows are few and already
+-- covered by idx_terminal_commands_running_started (partial, status = 'running').
+-- Every expired command fails for now; p_max_attempts and the returned status are
+-- there so the lease migration can add retries with CREATE OR REPLACE.
+CREATE OR REPLACE FUNCTION expire_stale_running_commands(
+  p_stale_seconds INTEGER DEFAULT 300,
+  p_max_attempts INTEGER DEFAULT 1
+)
+RETURNS TABLE (id TEXT, user_id TEXT, status TEXT) AS $$
+BEGIN
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'failed', exit_code = -1, completed_at = now()
+  WHERE tc.status = 'running'
+    AND GREATEST(tc.started_at, tc.last_heartbeat_at) < now() - make_interval(secs => p_stale_seconds)
+  RETURNING tc.id, tc.user_id, tc.status;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The claim functions from 20260323000000 still fail stale commands inline; the
+-- lease migration (20260328000000) replaces them once, together with their
+-- signatures, instead of redefining them here as well.
@@ -0,0 +1,171 @@
+-- Lease model for running terminal commands. A claim leases the command to its
+-- agent until lease_expires_at; heartbeats, log appends and the renew endpoints
+-- push the expiry forward. The server reaper requeues (attempts < p_max_attempts)
+-- or fails commands whose lease ran out, so a crashed daemon's work is released
+-- within one lease instead of a fixed five minutes, and slow jobs that keep
+-- renewing are never killed.
+
+ALTER TABLE terminal_commands ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+ALTER TABLE terminal_commands ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_terminal_commands_running_lease
+    ON terminal_commands(lease_expires_at)
+    WHERE status = 'running';
+
+-- Claims gain p_lease_seconds and lose their inline expiry (the reaper owns it
+-- now), so the 20260323000000 signatures are dropped first.
+DROP FUNCTION IF EXISTS claim_next_queued_command(TEXT);
+DROP FUNCTION IF EXISTS claim_next_queued_command_for_user(TEXT, INTEGER);
+DROP FUNCTION IF EXISTS claim_next_queued_command_for_device(TEXT, INTEGER);
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command(
+  p_instance_id TEXT,
+  p_lease_seconds INTEGER DEFAULT 120
+)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+BEGIN
+  SELECT tc.id, ts.project_id INTO v_command_id, v_project_id
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  WHERE ts.instance_id = p_instance_id
+    AND tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running',
+      started_at = now(),
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      attempts = tc.attempts + 1
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object('project_id', v_project_id);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command_for_user(
+  p_user_id TEXT,
+  p_lease_seconds INTEGER DEFAULT 120
+)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+  v_project_path TEXT;
+BEGIN
+  SELECT tc.id, ts.project_id, p.file_path INTO v_command_id, v_project_id, v_project_path
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  LEFT JOIN projects p ON p.id = ts.project_id
+  WHERE tc.user_id = p_user_id
+    AND tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running',
+      started_at = now(),
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      attempts = tc.attempts + 1
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object(
+    'project_id', v_project_id,
+    'project_path', v_project_path
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION claim_next_queued_command_for_device(
+  p_device_id TEXT,
+  p_lease_seconds INTEGER DEFAULT 120
+)
+RETURNS SETOF JSONB AS $$
+DECLARE
+  v_command_id TEXT;
+  v_project_id TEXT;
+  v_local_path TEXT;
+BEGIN
+  SELECT tc.id, ts.project_id, l.local_path INTO v_command_id, v_project_id, v_local_path
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  JOIN device_project_links l ON l.project_id = ts.project_id AND l.device_id = p_device_id
+  WHERE tc.status = 'queued'
+  ORDER BY tc.created_at ASC
+  LIMIT 1
+  FOR UPDATE OF tc SKIP LOCKED;
+
+  IF v_command_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  RETURN QUERY
+  UPDATE terminal_commands tc
+  SET status = 'running',
+      started_at = now(),
+      lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+      attempts = tc.attempts + 1
+  WHERE tc.id = v_command_id AND tc.status = 'queued'
+  RETURNING to_jsonb(tc.*) || jsonb_build_object(
+    'project_id', v_project_id,
+    'project_local_path', v_local_path
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Same signature as in 20260327000000, now with requeueing. One statement per
+-- sweep. Rows claimed before this migration have no lease and fall back to the
+-- heartbeat window (p_stale_seconds). Requeued commands lose their partial
+-- output, since the next attempt logs from sequence 0 again.
+CREATE OR REPLACE FUNCTION expire_stale_running_commands(
+  p_stale_seconds INTEGER DEFAULT 300,
+  p_max_attempts INTEGER DEFAULT 1
+)
+RETURNS TABLE (id TEXT, user_id TEXT, status TEXT) AS $$
+BEGIN
+  RETURN QUERY
+  WITH expired AS (
+    SELECT tc.id
+    FROM terminal_commands tc
+    WHERE tc.status = 'running'
+      AND (
+        tc.lease_expires_at < now()
+        OR (
+          tc.lease_expires_at IS NULL
+          AND GREATEST(tc.started_at, tc.last_heartbeat_at) < now() - make_interval(secs => p_stale_seconds)
+        )
+      )
+    FOR UPDATE SKIP LOCKED
+  ),
+  updated AS (
+    UPDATE terminal_commands tc
+    SET status = CASE WHEN tc.attempts < p_max_attempts THEN 'queued' ELSE 'failed' END,
+        exit_code = CASE WHEN tc.attempts < p_max_attempts THEN NULL ELSE -1 END,
+        completed_at = CASE WHEN tc.attempts < p_max_attempts THEN NULL ELSE now() END,
+        started_at = CASE WHEN tc.attempts < p_max_attempts THEN NULL ELSE tc.started_at END,
+        lease_expires_at = NULL
+    FROM expired
+    WHERE tc.id = expired.id
+    RETURNING tc.id, tc.user_id, tc.status
+  ),
+  cleared AS (
+    DELETE FROM terminal_logs tl
+    USING updated u
+    WHERE tl.command_id = u.id AND u.status = 'queued'
+  )
+  SELECT u.id, u.user_id, u.status FROM updated u;
+END;
+$$ LANGUAGE plpgsql;
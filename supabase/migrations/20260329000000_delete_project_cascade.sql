@@ -0,0 +1,78 @@
+-- Delete a project and everything hanging off it in one transaction. This replaces
+-- the dozen sequential PostgREST calls delete_project made, which timed out on
+-- projects with tens of thousands of terminal_logs rows. Returns per-table row
+-- counts plus the deleted command ids (the server purges its local sidecar rows
+-- for them).
+
+-- Each of these backs a filter or a foreign-key check that the cascade below
+-- hits once per deleted row; without them every check is a sequential scan.
+CREATE INDEX IF NOT EXISTS idx_terminal_sessions_project ON terminal_sessions(project_id);
+CREATE INDEX IF NOT EXISTS idx_terminal_sessions_instance ON terminal_sessions(instance_id);
+CREATE INDEX IF NOT EXISTS idx_agent_executions_terminal_command ON agent_executions(terminal_command_id);
+CREATE INDEX IF NOT EXISTS idx_intents_task ON intents(task_id);
+CREATE INDEX IF NOT EXISTS idx_device_project_links_project ON device_project_links(project_id);
+CREATE INDEX IF NOT EXISTS idx_cursor_context_project ON cursor_context_snapshots(project_id);
+
+CREATE OR REPLACE FUNCTION delete_project_cascade(p_project_id TEXT)
+RETURNS JSONB AS $$
+DECLARE
+  counts JSONB := '{}'::JSONB;
+  v_command_ids TEXT[];
+  c BIGINT;
+BEGIN
+  SELECT COALESCE(array_agg(tc.id), '{}') INTO v_command_ids
+  FROM terminal_commands tc
+  JOIN terminal_sessions ts ON ts.id = tc.session_id
+  WHERE ts.project_id = p_project_id;
+
+  -- Conversation tables only exist on deployments that ran the optional
+  -- init_supabase_conversation_tables script; the server keeps them in its sidecar.
+  IF to_regclass('public.conversation_turns') IS NOT NULL THEN
+    EXECUTE 'DELETE FROM conversation_turns WHERE project_id = $1 OR command_id = ANY($2)'
+      USING p_project_id, v_command_ids;
+  END IF;
+  IF to_regclass('public.conversation_state') IS NOT NULL THEN
+    EXECUTE 'DELETE FROM conversation_state WHERE project_id = $1' USING p_project_id;
+  END IF;
+
+  DELETE FROM terminal_logs WHERE command_id = ANY(v_command_ids);
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('terminal_logs', c);
+
+  DELETE FROM agent_executions WHERE task_id IN (SELECT id FROM tasks WHERE project_id = p_project_id);
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('agent_executions', c);
+
+  DELETE FROM intents WHERE task_id IN (SELECT id FROM tasks WHERE project_id = p_project_id);
+
+  DELETE FROM tasks WHERE project_id = p_project_id;
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('tasks', c);
+
+  -- Executions of other projects' tasks may still point at these commands.
+  UPDATE agent_executions SET terminal_command_id = NULL WHERE terminal_command_id = ANY(v_command_ids);
+
+  DELETE FROM terminal_commands WHERE id = ANY(v_command_ids);
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('terminal_commands', c);
+
+  DELETE FROM terminal_sessions WHERE project_id = p_project_id;
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('terminal_sessions', c);
+
+  UPDATE terminal_sessions SET instance_id = NULL
+  WHERE instance_id IN (SELECT id FROM instances WHERE project_id = p_project_id);
+  DELETE FROM instances WHERE project_id = p_project_id;
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('instances', c);
+
+  DELETE FROM device_project_links WHERE project_id = p_project_id;
+  DELETE FROM cursor_context_snapshots WHERE project_id = p_project_id;
+
+  DELETE FROM projects WHERE id = p_project_id;
+  GET DIAGNOSTICS c = ROW_COUNT;
+  counts := counts || jsonb_build_object('projects', c);
+
+  RETURN counts || jsonb_build_object('command_ids', to_jsonb(v_command_ids));
+END;
+$$ LANGUAGE plpgsql;
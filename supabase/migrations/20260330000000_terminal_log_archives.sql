@@ -0,0 +1,29 @@
+-- Compacted terminal output. A background job on the server merges the
+-- terminal_logs rows of a finished command into one row per stream here (gzip,
+-- base64-encoded, with a [[sequence, byte_length], ...] index to rebuild the
+-- chunks), deletes the chunk rows and stamps logs_compacted_at. Reads of a command
+-- with logs_compacted_at set go to this table.
+
+CREATE TABLE IF NOT EXISTS terminal_log_archives (
+    -- Deleting a command (project delete, history delete) takes its archives with it.
+    command_id TEXT NOT NULL REFERENCES terminal_commands(id) ON DELETE CASCADE,
+    stream TEXT NOT NULL,
+    encoding TEXT NOT NULL DEFAULT 'gzip',
+    data TEXT NOT NULL,
+    sequences JSONB NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    raw_bytes BIGINT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (command_id, stream)
+);
+
+-- Age-based retention deletes archives by created_at.
+CREATE INDEX IF NOT EXISTS idx_terminal_log_archives_created
+    ON terminal_log_archives(created_at);
+
+ALTER TABLE terminal_commands ADD COLUMN IF NOT EXISTS logs_compacted_at TIMESTAMPTZ;
+
+-- The compaction sweep: finished commands not compacted yet, oldest first.
+CREATE INDEX IF NOT EXISTS idx_terminal_commands_uncompacted
+    ON terminal_commands(completed_at)
+    WHERE logs_compacted_at IS NULL AND completed_at IS NOT NULL;
@@ -0,0 +1,44 @@
+-- Tail and byte-range reads of terminal output.
+--
+-- Tail reads (ORDER BY sequence DESC LIMIT n) need no new index: the unique
+-- (command_id, sequence) btree from 20260324000000 is scanned backward just as
+-- cheaply, and a second DESC copy would only slow every append.
+--
+-- byte_offset is the number of UTF-8 output bytes before a chunk. A trigger fills
+-- it from the command's previous chunk, so a byte range maps to its first chunk
+-- with one index probe, and the newest row gives the log's total size.
+
+ALTER TABLE terminal_logs ADD COLUMN IF NOT EXISTS byte_offset BIGINT;
+
+CREATE OR REPLACE FUNCTION terminal_logs_set_byte_offset()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- Rows inserted earlier by the same multi-row INSERT are visible here, so a
+  -- batch of chunks (sent in sequence order) gets consecutive offsets.
+  SELECT COALESCE(tl.byte_offset, 0) + octet_length(tl.chunk) INTO NEW.byte_offset
+  FROM terminal_logs tl
+  WHERE tl.command_id = NEW.command_id AND tl.sequence < NEW.sequence
+  ORDER BY tl.sequence DESC
+  LIMIT 1;
+  NEW.byte_offset := COALESCE(NEW.byte_offset, 0);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_terminal_logs_byte_offset ON terminal_logs;
+CREATE TRIGGER trg_terminal_logs_byte_offset
+  BEFORE INSERT ON terminal_logs
+  FOR EACH ROW EXECUTE FUNCTION terminal_logs_set_byte_offset();
+
+-- Existing rows: running total of the chunks before each one.
+UPDATE terminal_logs t
+SET byte_offset = s.byte_offset
+FROM (
+  SELECT id,
+         SUM(octet_length(chunk)) OVER (PARTITION BY command_id ORDER BY sequence, id) - octet_length(chunk) AS byte_offset
+  FROM terminal_logs
+) s
+WHERE t.id = s.id AND t.byte_offset IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_terminal_logs_command_byte_offset
+    ON terminal_logs(command_id, byte_offset);
@@ -32,7 +32,7 @@ export function AgentStatusPanel({ userId }: { userId: string }) {
         return;
       }
       try {
-        const res = await authFetch(`${backendUrl}/api/agent/executions/${userId}`);
+        const res = await authFetch(`${backendUrl}/api/agent/executions/${userId}`, { cache: "no-cache" });
         if (res.ok) {
           const data = await res.json();
           setExecutions(data.executions || []);
@@ -180,7 +180,7 @@ export function CommandLogViewer({
     if (!commandId) return;
     try {
       const res = await authFetch(
-        `${backendUrl}/api/terminal/commands/${commandId}/logs?limit=300`,
+        `${backendUrl}/api/terminal/commands/${commandId}/logs?tail=300`,
         { cache: "no-store" }
       );
       if (!res.ok) return;
@@ -76,7 +76,7 @@ export function TerminalConsole({ projects }: { projects: ProjectOption[] }) {
     if (!selectedProjectId) return;
     try {
       setErr(null);
-      const res = await authFetch(`${backendUrl}/api/terminal/sessions/${selectedProjectId}`, { cache: "no-store" });
+      const res = await authFetch(`${backendUrl}/api/terminal/sessions/${selectedProjectId}`, { cache: "no-cache" });
       const data = await res.json();
       if (!res.ok) throw new Error(data?.detail ?? "Failed to load sessions");
       const next = (data.sessions ?? []) as TerminalSession[];
@@ -107,8 +107,13 @@ export function TerminalConsole({ projects }: { projects: ProjectOption[] }) {
     if (!activeCommandId) return;
     try {
       const params = new URLSearchParams();
-      if (afterSeqRef.current !== null) params.set("after_sequence", String(afterSeqRef.current));
-      params.set("limit", "200");
+      // First load starts from the end of the log; later polls pick up after the last chunk seen.
+      if (afterSeqRef.current !== null) {
+        params.set("after_sequence", String(afterSeqRef.current));
+        params.set("limit", "200");
+      } else {
+        params.set("tail", "200");
+      }
       const res = await authFetch(`${backendUrl}/api/terminal/commands/${activeCommandId}/logs?${params}`, { cache: "no-store" });
       const data = await res.json();
       if (!res.ok) return;
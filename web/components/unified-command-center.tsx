@@ -252,7 +252,7 @@ export function UnifiedCommandCenter({
     try {
       const params = new URLSearchParams({ limit: "50" });
       if (selectedProjectId) params.set("project_id", selectedProjectId);
-      const res = await authFetch(`${backendUrl}/api/unified/timeline?${params}`, { cache: "no-store" });
+      const res = await authFetch(`${backendUrl}/api/unified/timeline?${params}`, { cache: "no-cache" });
       if (!res.ok) return;
       const data = await res.json();
       const next = (data.commands ?? []) as TimelineCommand[];
@@ -265,7 +265,7 @@ export function UnifiedCommandCenter({
     try {
       const params = new URLSearchParams({ limit: "80" });
       if (selectedProjectId) params.set("project_id", selectedProjectId);
-      const res = await authFetch(`${backendUrl}/api/unified/conversation?${params}`, { cache: "no-store" });
+      const res = await authFetch(`${backendUrl}/api/unified/conversation?${params}`, { cache: "no-cache" });
       if (!res.ok) return;
       const data = await res.json();
       const next = (data.turns ?? []) as ConversationTurn[];